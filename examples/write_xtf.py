@@ -3,7 +3,6 @@ Example of how to write an XTF file from other source.
 All fields that are marked as required in the XTF spec are filled with a value.
 """
 
-import ctypes
 import datetime
 
 import numpy as np
@@ -46,7 +45,6 @@ for i in range(num_pings):
 
     p = pyxtf.XTFPingHeader()
     p.HeaderType = pyxtf.XTFHeaderType.sonar.value
-    p.NumChansToFollow = 2
     p.Year = t.year
     p.Month = t.month
     p.Day = t.day
@@ -75,12 +73,10 @@ for i in range(num_pings):
     c[0].ChannelNumber = 0
     c[0].SlantRange = 30
     c[0].Frequency = 340
-    c[0].NumSamples = num_samples_per_ping
     c[0].SampleFormat = 8  # Enumeration for uint8 type. See xtf_ctypes.py for other enum values
     c[1].ChannelNumber = 1
     c[1].SlantRange = 30
     c[1].Frequency = 340
-    c[1].NumSamples = num_samples_per_ping
     c[1].SampleFormat = 8  # Enumeration for uint8 type. See xtf_ctypes.py for other enum values
 
     p.ping_chan_headers = c
@@ -90,21 +86,13 @@ for i in range(num_pings):
     d1 = d0[::-1]
     p.data = [d0, d1]
 
-    # Set packet size
-    sz = ctypes.sizeof(pyxtf.XTFPingHeader)
-    sz += ctypes.sizeof(pyxtf.XTFPingChanHeader) * 2
-    sz += len(d0) + len(d1)
-    p.NumBytesThisRecord = sz
-
     pings.append(p)
 
 #
 # Write to file
 #
 
-with open('test.xtf', 'wb') as f:
-    # Write file header
-    f.write(fh.to_bytes())
-
+# The writer fills in NumBytesThisRecord, NumChansToFollow and NumSamples, and pads each packet to 64 bytes
+with pyxtf.XTFWriter('test.xtf', fh, save_index=True) as writer:
     for p in pings:
-        f.write(p.to_bytes())
+        writer.write(p)
@@ -1,4 +1,14 @@
 from pyxtf.enumerations import *
 from pyxtf.xtf_ctypes import *
-from pyxtf.xtf_io import xtf_read, xtf_read_gen, concatenate_channel
-
+from pyxtf.xtf_storage import XTFStorage, LocalStorage, MmapStorage, HTTPStorage, CachedStorage, StorageFile
+from pyxtf.xtf_arena import XTFArena, XTFSpillArena, xtf_peak_rss
+from pyxtf.xtf_io import xtf_read, xtf_read_gen, xtf_read_batches, xtf_read_index, xtf_read_stream, xtf_open, \
+    xtf_scan, concatenate_channel
+from pyxtf.xtf_snippet import XTFSnippets, concatenate_snippets
+from pyxtf.xtf_write import XTFWriter, xtf_time_fields
+from pyxtf.xtf_edit import xtf_filter, xtf_split, xtf_merge, XTFHeaderMap
+from pyxtf.xtf_archive import XTFArchive, xtf_compress, xtf_decompress
+from pyxtf.xtf_reader import XTFReader
+from pyxtf.xtf_table import PingTable, PacketTable, concatenate_pings
+from pyxtf.xtf_cache import XTFCache
+from pyxtf.xtf_shared import XTFSharedWaterfall
@@ -4,17 +4,17 @@ Based on Kongsberg Document 850-160692 (EM Series Datagram Formats) Rev.U (June
 Note: use pyall if you're trying to read all-files
 
 The following echosounders: EM3002, EM710, EM302, EM122, EM2040, EM2040C and ME70BO
-use little endian byte ordering. Beware that others might not.
+use little endian byte ordering. Older systems may use big endian byte ordering, which is detected from the
+datagram header (see km_byte_order). Big endian datagrams are swapped in bulk through numpy dtypes.
 '''
 
-# TODO: Implement automatic byte order check, and covert each field to little endian (or change the base class)
-
 import ctypes
 from enum import IntEnum, unique
 from io import IOBase, BytesIO
+from typing import Generator, Iterable
 import numpy as np
 
-from pyxtf.xtf_ctypes import XTFBase
+from pyxtf.xtf_ctypes import XTFBase, ctypes_to_dtype, _xtf_pickle_buffer, _xtf_pickle_state, _xtf_unpickle
 import warnings
 
 
@@ -53,7 +53,64 @@ class KMDatagramType(IntEnum):
     pu_bist_result = 0x42
 
 
+def km_byte_order(datagram: bytes) -> str:
+    '''
+    Detects the byte order of a raw EM datagram from the common datagram header.
+    The NumberOfBytes field is checked against the number of bytes available. If that is inconclusive (e.g. only the
+    header is available), the EM model number is used, as it is a large number when read in the wrong byte order.
+    :param datagram: The datagram bytes, starting at the NumberOfBytes field
+    :return: '<' for little endian, '>' for big endian
+    '''
+    if len(datagram) < ctypes.sizeof(KMOutputDatagramHeader):
+        raise RuntimeError('Too few bytes to detect the byte order of the EM datagram.')
+
+    # NumberOfBytes does not include the size of the field itself
+    n_available = len(datagram) - KMOutputDatagramHeader.NumberOfBytes.size
+    n_bytes_field = datagram[:KMOutputDatagramHeader.NumberOfBytes.size]
+    fits_little = 0 < int.from_bytes(n_bytes_field, 'little') <= n_available
+    fits_big = 0 < int.from_bytes(n_bytes_field, 'big') <= n_available
+    if fits_little != fits_big:
+        return '<' if fits_little else '>'
+
+    model_offset = KMOutputDatagramHeader.EMModelNumber.offset
+    model_field = datagram[model_offset:model_offset + KMOutputDatagramHeader.EMModelNumber.size]
+    return '<' if int.from_bytes(model_field, 'little') <= int.from_bytes(model_field, 'big') else '>'
+
+
+def _km_little_endian(datagram: bytes, km_struct, byte_order: str) -> bytes:
+    '''
+    Returns the datagram bytes in little endian byte order, according to the layout of the ctypes structure.
+    All fields (including nested arrays) are swapped at once by numpy, instead of converting them field by field.
+    '''
+    if byte_order == '<':
+        return datagram
+
+    big_endian = np.frombuffer(datagram, dtype=ctypes_to_dtype(km_struct, '>'), count=1)
+    return big_endian.astype(ctypes_to_dtype(km_struct, '<')).tobytes()
+
+
 class KMBase(XTFBase):
+    @classmethod
+    def create_from_buffer(cls, buffer: IOBase, file_header=None, byte_order: str = None):
+        '''
+        Initializes the datagram structure by copying from the target buffer.
+        :param buffer: Input bytes
+        :param file_header: Not used
+        :param byte_order: '<' (little endian) or '>' (big endian). Detected from the datagram header if None.
+        :return:
+        '''
+        if type(buffer) in [bytes, bytearray]:
+            buffer = BytesIO(buffer)
+
+        datagram_bytes = buffer.read(ctypes.sizeof(cls))
+        if len(datagram_bytes) < ctypes.sizeof(cls):
+            raise RuntimeError('Datagram shorter than expected (end hit while reading {})'.format(cls.__name__))
+
+        if byte_order is None:
+            byte_order = km_byte_order(datagram_bytes)
+
+        return cls.from_buffer_copy(_km_little_endian(datagram_bytes, cls, byte_order))
+
     def get_time(self):
         if hasattr(self, 'Date') and hasattr(self, 'Time'):
             Y = self.Date // 10000
@@ -154,6 +211,20 @@ class KMRawRangeAngle78_RX(XTFBase):
         return bool(self.DetectionInfo & 0x10)
 
 
+# Cache of the dynamically sized datagram classes, keyed on (class, n_tx, n_rx)
+_km_sized_classes = {}
+
+
+def _km_sized_reduce_ex(self, protocol):
+    # The dynamically sized classes can not be looked up by name, and are recreated with sized_class when unpickled
+    (cls, n_tx, n_rx) = self._km_sized_key
+    return _km_unpickle_sized, (cls, n_tx, n_rx, _xtf_pickle_buffer(self, protocol), _xtf_pickle_state(self))
+
+
+def _km_unpickle_sized(cls, n_tx: int, n_rx: int, buffer, state: dict):
+    return _xtf_unpickle(cls.sized_class(n_tx, n_rx), buffer, state)
+
+
 class KMRawRangeAngle78(KMBase):
     _pack_ = 1
     _fields_ = [
@@ -179,20 +250,52 @@ class KMRawRangeAngle78(KMBase):
     ]
 
     @classmethod
-    def create_from_buffer(cls, buffer: IOBase, file_header=None):
+    def create_from_buffer(cls, buffer: IOBase, file_header=None, byte_order: str = None):
         if type(buffer) in [bytes, bytearray]:
             buffer = BytesIO(buffer)
 
-            # Read bytes up until the variable-sized data
+        # Read bytes up until the variable-sized data
         base_bytes = buffer.read(cls.TX.offset)
-        n_bytes = ctypes.c_uint32.from_buffer_copy(base_bytes, cls.NumberOfBytes.offset).value
-        n_tx = ctypes.c_uint16.from_buffer_copy(base_bytes, cls.Ntx.offset).value
-        n_rx = ctypes.c_uint16.from_buffer_copy(base_bytes, cls.Nrx.offset).value
+        if byte_order is None:
+            byte_order = km_byte_order(base_bytes)
+
+        endian = 'little' if byte_order == '<' else 'big'
+        n_bytes = int.from_bytes(base_bytes[cls.NumberOfBytes.offset:cls.NumberOfBytes.offset + cls.NumberOfBytes.size], endian)
+        n_tx = int.from_bytes(base_bytes[cls.Ntx.offset:cls.Ntx.offset + cls.Ntx.size], endian)
+        n_rx = int.from_bytes(base_bytes[cls.Nrx.offset:cls.Nrx.offset + cls.Nrx.size], endian)
 
         # Read remaining bytes
         remaining_bytes = buffer.read(n_bytes - cls.TX.offset + cls.NumberOfBytes.size)
 
-        # Create new class dynamically with string array at the correct size
+        new_cls = cls.sized_class(n_tx, n_rx)
+        all_bytes = base_bytes + remaining_bytes
+        obj = new_cls.from_buffer_copy(_km_little_endian(all_bytes, new_cls, byte_order))
+
+        # Checksum (not crc16, but a straight sum of bytes with overflow)
+        checksum_bytes = np.frombuffer(all_bytes, dtype=np.uint8, offset=new_cls.DatagramType.offset,
+                                       count=new_cls.EndID.offset - new_cls.DatagramType.offset)
+        chk = int(checksum_bytes.sum()) & 0xFFFF
+        if chk != obj.Checksum:
+            warning_str = '{}: Checksum failed'.format(cls.__name__)
+            warnings.warn(warning_str)
+
+        return obj
+
+    @classmethod
+    def sized_class(cls, n_tx: int, n_rx: int):
+        '''
+        Returns the structure with the TX and RX arrays at the given sizes.
+        The classes are created dynamically and cached, as most datagrams in a file share the same sizes.
+        :param n_tx: Number of transmit sectors
+        :param n_rx: Number of receiver beams
+        :return: ctypes.LittleEndianStructure class
+        '''
+        try:
+            return _km_sized_classes[(cls, n_tx, n_rx)]
+        except KeyError:
+            pass
+
+        # Create new class dynamically with the arrays at the correct size
         new_name = cls.__name__ + '_ntx{}_nrx{}'.format(n_tx, n_rx)
         new_fields = cls._fields_.copy()
         tx_idx = [i for i, (name, fieldtype) in enumerate(cls._fields_) if name == 'TX'][0]
@@ -201,20 +304,14 @@ class KMRawRangeAngle78(KMBase):
         new_fields[rx_idx] = ('RX', KMRawRangeAngle78_RX * n_rx)
         new_cls = type(new_name, (ctypes.LittleEndianStructure,), {
             '__str__': cls.__str__,
+            '__reduce_ex__': _km_sized_reduce_ex,
+            '_km_sized_key': (cls, n_tx, n_rx),
             '_pack_': cls._pack_,
             '_fields_': new_fields
         })
 
-        all_bytes = base_bytes + remaining_bytes
-        obj = new_cls.from_buffer_copy(all_bytes)
-
-        # Checksum (not crc16, but a straight sum of bytes with overflow)
-        chk = (sum(all_bytes[new_cls.DatagramType.offset:new_cls.EndID.offset]) & 0xFFFF)
-        if chk != obj.Checksum:
-            warning_str = '{}: Checksum failed'.format(cls.__name__)
-            warnings.warn(warning_str)
-
-        return obj
+        _km_sized_classes[(cls, n_tx, n_rx)] = new_cls
+        return new_cls
 
     def __init__(self):
         super().__init__()
@@ -223,6 +320,29 @@ class KMRawRangeAngle78(KMBase):
         self.EndID = 0x03
 
 
+# Mapping from datagram type to the class implementation
+KMDatagramClasses = {
+    KMDatagramType.raw_range_and_angle_78: KMRawRangeAngle78
+}
+
+
+def km_decode_datagrams(datagrams: Iterable[bytes], byte_order: str = None) -> Generator[KMBase, None, None]:
+    '''
+    Decodes a sequence of raw EM datagrams, e.g. the data of the multibeam_raw_beam_angle packets in a file.
+    The byte order is detected from the first datagram and reused for the rest, as it does not change within a file.
+    Datagram types without an implementation are returned as KMOutputDatagramHeader.
+    :param datagrams: Iterable of datagram bytes
+    :param byte_order: '<' (little endian) or '>' (big endian). Detected from the first datagram if None.
+    :return: Generator of decoded datagrams
+    '''
+    for datagram in datagrams:
+        if byte_order is None:
+            byte_order = km_byte_order(datagram)
+
+        km_class = KMDatagramClasses.get(datagram[KMOutputDatagramHeader.DatagramType.offset], KMOutputDatagramHeader)
+        yield km_class.create_from_buffer(buffer=datagram, byte_order=byte_order)
+
+
 if __name__ == '__main__':
     from pyxtf.xtf_io import xtf_read
     from pyxtf.xtf_ctypes import XTFHeaderType
@@ -235,7 +355,7 @@ if __name__ == '__main__':
 
     if XTFHeaderType.multibeam_raw_beam_angle in p:
         # The KMRawRangeAngle78 data is stored as raw bytes in the data field of a XTFPingHeader type
-        data_bytes = p[XTFHeaderType.multibeam_raw_beam_angle][0].data
-        decoded_data = KMRawRangeAngle78.create_from_buffer(buffer=data_bytes)
+        data_bytes = (packet.data for packet in p[XTFHeaderType.multibeam_raw_beam_angle])
+        decoded_data = next(km_decode_datagrams(data_bytes))
         print(decoded_data)
 
@@ -1,7 +1,8 @@
 import ctypes
+from enum import IntEnum
 import numpy as np
 from io import IOBase, BytesIO
-from typing import List, Tuple, Dict, Callable, Any
+from typing import List, Tuple, Dict, Callable, Any, Generator, Iterable
 
 
 
@@ -29,6 +30,72 @@ class XTFBase(ctypes.LittleEndianStructure):
     def __init__(self, buffer=None, *args, **kwargs):
         pass
 
+    def __reduce_ex__(self, protocol: int) -> tuple:
+        pass
+
+    @classmethod
+    def create_from_buffer(cls, buffer: IOBase, file_header=None):
+        pass
+
+    @classmethod
+    def view_from_buffer(cls, buffer: IOBase, file_header=None):
+        pass
+
+    @classmethod
+    def np_dtype(cls, byte_order: str = '<') -> np.dtype:
+        pass
+
+
+def km_byte_order(datagram: bytes) -> str:
+    pass
+
+
+def km_decode_datagrams(datagrams: Iterable[bytes], byte_order: str = None) -> Generator[KMBase, None, None]:
+    pass
+
+
+class KMDatagramType(IntEnum):
+    depth = 0x44
+    xyz_88 = 0x58
+    extra_detections = 0x6C
+    central_beams_echogram = 0x4B
+    raw_range_and_angle_F = 0x46
+    raw_range_and_angle_f = 0x66
+    raw_range_and_angle_78 = 0x4E
+    seabed_image_diagram = 0x53
+    seabed_image_data_Y = 0x59
+    water_column = 0x6B
+    quality_factor = 0x4F
+    attitude = 0x41
+    network_attitude_velocity = 0x6E
+    clock = 0x43
+    pressure_or_height = 0x68
+    heading = 0x48
+    position = 0x50
+    single_beam_echo_sounder_depth = 0x45
+    tide = 0x54
+    sound_speed = 0x47
+    sound_speed_profile = 0x55
+    ssp_output = 0x57
+    installation_param_start = 0x49
+    installation_param_stop = 0x69
+    installation_param_remote = 0x70
+    runtime_param = 0x52
+    mechanical_transducer_tilt = 0x4A
+    extra_param = 0x33
+    pu_id_output = 0x30
+    pu_status = 0x31
+    pu_bist_result = 0x42
+
+
+class KMBase(XTFBase):
+    @classmethod
+    def create_from_buffer(cls, buffer: IOBase, file_header=None, byte_order: str = None):
+        pass
+    def get_time(self):
+        pass
+
+
 class KMOutputDatagramHeader(KMBase):
     NumberOfBytes = None  # type: CField
     StartID = None  # type: CField
@@ -149,6 +216,12 @@ class KMRawRangeAngle78(KMBase):
         self.Spare = None  # type: ctypes.c_ubyte
         self.EndID = None  # type: ctypes.c_ubyte
         self.Checksum = None  # type: ctypes.c_ushort
+    @classmethod
+    def create_from_buffer(cls, buffer: IOBase, file_header=None, byte_order: str = None) -> 'KMRawRangeAngle78':
+        pass
+    @classmethod
+    def sized_class(cls, n_tx: int, n_rx: int) -> type:
+        pass
     def get_time(self):
         pass
     def to_bytes(self):
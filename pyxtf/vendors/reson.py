@@ -0,0 +1,462 @@
+'''
+This file contains some of the Reson 7k record formats. Only used for the raw vendor data in XTF packets.
+Based on the Reson 7k Data Format Definition, and appendix 1 (Reson 71xx Data Structures) of the XTF format document.
+All 7k records use little endian byte ordering.
+'''
+
+import ctypes
+from enum import IntEnum, unique
+import tempfile
+from typing import List, Tuple
+from warnings import warn
+
+import numpy as np
+
+from pyxtf.enumerations import XTFHeaderType
+from pyxtf.xtf_ctypes import XTFBase, XTFPingHeader, XTFPingChanHeader
+from pyxtf.xtf_io import xtf_read_index
+
+
+@unique
+class R7kRecordType(IntEnum):
+    beam_geometry = 7004
+    bathymetric_data = 7006
+    side_scan = 7007
+    generic_water_column = 7008
+    beamformed_data = 7018
+    raw_detection = 7027
+    snippet = 7028
+
+
+class R7kDataRecordFrame(XTFBase):
+    '''
+    Data Record Frame (DRF) that starts every 7k record.
+    '''
+    _pack_ = 1
+    _fields_ = [
+        ('ProtocolVersion', ctypes.c_uint16),
+        ('Offset', ctypes.c_uint16),  # Offset from the start of the sync pattern to the record type header
+        ('SyncPattern', ctypes.c_uint32),  # Always 0x0000FFFF
+        ('Size', ctypes.c_uint32),  # Size of the record, from the protocol version to the end of the checksum
+        ('OptionalDataOffset', ctypes.c_uint32),
+        ('OptionalDataIdentifier', ctypes.c_uint32),
+        ('Year', ctypes.c_uint16),
+        ('Day', ctypes.c_uint16),  # Day of year (1-366)
+        ('Seconds', ctypes.c_float),
+        ('Hours', ctypes.c_uint8),
+        ('Minutes', ctypes.c_uint8),
+        ('RecordVersion', ctypes.c_uint16),
+        ('RecordTypeIdentifier', ctypes.c_uint32),  # See R7kRecordType
+        ('DeviceIdentifier', ctypes.c_uint32),
+        ('Reserved1', ctypes.c_uint16),
+        ('SystemEnumerator', ctypes.c_uint16),
+        ('Reserved2', ctypes.c_uint32),
+        ('Flags', ctypes.c_uint16),  # Bit 0: checksum valid
+        ('Reserved3', ctypes.c_uint16),
+        ('Reserved4', ctypes.c_uint32),
+        ('TotalRecordsInFragmentedSet', ctypes.c_uint32),
+        ('FragmentNumber', ctypes.c_uint32)
+    ]
+
+    def header_offset(self) -> int:
+        '''
+        Returns the offset of the record type header (RTH) from the start of the DRF.
+        '''
+        return R7kDataRecordFrame.SyncPattern.offset + self.Offset if self.Offset else ctypes.sizeof(R7kDataRecordFrame)
+
+
+class R7kBeamformedHeader(XTFBase):
+    '''
+    Record type header of the 7018 beamformed (water column) record.
+    The header is followed by Samples x Beams amplitude and phase pairs, ordered by sample.
+    '''
+    _pack_ = 1
+    _fields_ = [
+        ('SonarID', ctypes.c_uint64),
+        ('PingNumber', ctypes.c_uint32),
+        ('MultiPingSequence', ctypes.c_uint16),
+        ('Beams', ctypes.c_uint16),
+        ('Samples', ctypes.c_uint32),  # Samples per beam
+        ('Reserved', ctypes.c_uint32 * 8)
+    ]
+
+
+# Amplitude and phase of a single 7018 beamformed sample
+r7k_beamformed_dtype = np.dtype([('Amplitude', '<u2'), ('Phase', '<i2')])
+
+
+def r7k_watercolumn_offset(payload, offset: int = 0) -> Tuple[R7kBeamformedHeader, int]:
+    '''
+    Locates the 7018 record in the vendor data of a reson_7018_watercolumn packet.
+    :param payload: The data following the XTFPingChanHeader (DRF, 7018 record and 7004 record)
+    :param offset: The position of the DRF in the payload
+    :return: The 7018 record type header, and the position of the beamformed samples in the payload
+    '''
+    drf = R7kDataRecordFrame.from_buffer_copy(payload, offset)
+    if drf.RecordTypeIdentifier != R7kRecordType.beamformed_data:
+        raise RuntimeError('Expected 7k record {}, found {}.'.format(
+            R7kRecordType.beamformed_data.value, drf.RecordTypeIdentifier))
+
+    rth_offset = offset + drf.header_offset()
+    rth = R7kBeamformedHeader.from_buffer_copy(payload, rth_offset)
+
+    return rth, rth_offset + ctypes.sizeof(R7kBeamformedHeader)
+
+
+def r7k_watercolumn(ping: XTFPingHeader) -> Tuple[R7kBeamformedHeader, np.ndarray]:
+    '''
+    Decodes the 7018 beamformed data of a reson_7018_watercolumn packet without copying the samples.
+    :param ping: The reson_7018_watercolumn packet (the vendor data is stored in the data field)
+    :return: The 7018 record type header, and a (beams x samples) array view over the packet data.
+             The array has the fields 'Amplitude' and 'Phase'.
+    '''
+    rth, data_offset = r7k_watercolumn_offset(ping.data)
+    samples = np.frombuffer(ping.data, dtype=r7k_beamformed_dtype, count=rth.Beams * rth.Samples, offset=data_offset)
+
+    # The samples are stored sample by sample (all beams of the first sample, then the next)
+    return rth, samples.reshape(rth.Samples, rth.Beams).T
+
+
+def r7k_watercolumn_volume(path: str, volume_path: str = None) -> Tuple[np.ndarray, np.ndarray, np.memmap]:
+    '''
+    Stacks all reson_7018_watercolumn pings in the XTF file into a (pings x beams x samples) volume.
+    The volume is memory mapped, and each ping is copied once, straight from the (memory mapped) XTF file.
+    Pings with fewer beams or samples than the largest ping are zero padded.
+    :param path: The path to the XTF file
+    :param volume_path: Optional path of the volume file. A temporary file is used if None.
+    :return: Tuple of the ping headers (XTFPingHeader dtype), the 7018 record type headers (R7kBeamformedHeader dtype)
+             and the volume (fields 'Amplitude' and 'Phase')
+    '''
+    packet_locs = xtf_read_index(path).get(XTFHeaderType.reson_7018_watercolumn, [])
+    xtf_map = np.memmap(path, dtype=np.uint8, mode='r')
+
+    ping_dtype = XTFPingHeader.np_dtype()
+    ping_headers = np.zeros(len(packet_locs), dtype=ping_dtype)
+    rth_headers = np.zeros(len(packet_locs), dtype=R7kBeamformedHeader.np_dtype())
+    data_locs = np.zeros(len(packet_locs), dtype=np.int64)
+    for i, packet_start_loc in enumerate(packet_locs):
+        ping_headers[i] = xtf_map[packet_start_loc:packet_start_loc + ping_dtype.itemsize].view(ping_dtype)[0]
+
+        # 7018 water column has a single XTFPingChanHeader before the vendor data
+        drf_loc = packet_start_loc + ctypes.sizeof(XTFPingHeader) + ctypes.sizeof(XTFPingChanHeader)
+        rth, data_loc = r7k_watercolumn_offset(xtf_map, drf_loc)
+        rth_headers[i] = np.frombuffer(bytes(rth), dtype=rth_headers.dtype)[0]
+        data_locs[i] = data_loc
+
+    n_beams = int(rth_headers['Beams'].max()) if len(packet_locs) else 0
+    n_samples = int(rth_headers['Samples'].max()) if len(packet_locs) else 0
+    shape = (len(packet_locs), n_beams, n_samples)
+
+    if not len(packet_locs):
+        return ping_headers, rth_headers, np.zeros(shape, dtype=r7k_beamformed_dtype)
+    elif volume_path is None:
+        # Removed by the OS when the mapping is closed
+        volume = np.memmap(tempfile.TemporaryFile(), dtype=r7k_beamformed_dtype, mode='w+', shape=shape)
+    else:
+        volume = np.memmap(volume_path, dtype=r7k_beamformed_dtype, mode='w+', shape=shape)
+
+    for i, data_loc in enumerate(data_locs):
+        beams, samples = int(rth_headers['Beams'][i]), int(rth_headers['Samples'][i])
+        ping_bytes = xtf_map[data_loc:data_loc + beams * samples * r7k_beamformed_dtype.itemsize]
+        volume[i, :beams, :samples] = ping_bytes.view(r7k_beamformed_dtype).reshape(samples, beams).T
+
+    return ping_headers, rth_headers, volume
+
+
+class R7kBeamGeometryHeader(XTFBase):
+    '''
+    Record type header of the 7004 beam geometry record.
+    The header is followed by four arrays of Beams floats: vertical direction angle, horizontal direction angle,
+    -3dB beam width along track and -3dB beam width across track (all in radians).
+    '''
+    _pack_ = 1
+    _fields_ = [
+        ('SonarID', ctypes.c_uint64),
+        ('Beams', ctypes.c_uint32)
+    ]
+
+
+class R7kBathymetricHeader(XTFBase):
+    '''
+    Record type header of the 7006 bathymetric data record.
+    The header is followed by the arrays (of Beams elements): travel time (float), quality (uint8), intensity (float),
+    minimum travel time filter (float) and maximum travel time filter (float).
+    '''
+    _pack_ = 1
+    _fields_ = [
+        ('SonarID', ctypes.c_uint64),
+        ('PingNumber', ctypes.c_uint32),
+        ('MultiPingSequence', ctypes.c_uint16),
+        ('Beams', ctypes.c_uint32),
+        ('LayerCompensationFlag', ctypes.c_uint8),
+        ('SoundVelocityFlag', ctypes.c_uint8),
+        ('SoundVelocity', ctypes.c_float)  # m/s
+    ]
+
+
+class R7kRawDetectionHeader(XTFBase):
+    '''
+    Record type header of the 7027 raw detection data record.
+    The header is followed by Detections entries of DataFieldSize bytes (see R7kRawDetection).
+    '''
+    _pack_ = 1
+    _fields_ = [
+        ('SonarID', ctypes.c_uint64),
+        ('PingNumber', ctypes.c_uint32),
+        ('MultiPingSequence', ctypes.c_uint16),
+        ('Detections', ctypes.c_uint32),
+        ('DataFieldSize', ctypes.c_uint32),  # Size of each detection entry
+        ('DetectionAlgorithm', ctypes.c_uint8),
+        ('Flags', ctypes.c_uint32),
+        ('SamplingRate', ctypes.c_float),  # Hz
+        ('TransmitAngle', ctypes.c_float),  # Radians
+        ('AppliedRoll', ctypes.c_float),  # Radians
+        ('Reserved', ctypes.c_uint32 * 15)
+    ]
+
+
+class R7kRawDetection(XTFBase):
+    '''
+    Detection entry of the 7027 raw detection data record.
+    Older records (DataFieldSize of 22 bytes) end after the Uncertainty field.
+    '''
+    _pack_ = 1
+    _fields_ = [
+        ('BeamDescriptor', ctypes.c_uint16),
+        ('DetectionPoint', ctypes.c_float),  # Non-corrected fractional sample number
+        ('RxAngle', ctypes.c_float),  # Radians
+        ('Flags', ctypes.c_uint32),
+        ('Quality', ctypes.c_uint32),
+        ('Uncertainty', ctypes.c_float),
+        ('Intensity', ctypes.c_float),
+        ('MinLimit', ctypes.c_float),
+        ('MaxLimit', ctypes.c_float)
+    ]
+
+
+class R7kSnippetHeader(XTFBase):
+    '''
+    Record type header of the 7008 generic water column (snippet) record.
+    The header is followed by Beams snippet beam descriptors (see R7kSnippetBeam) and the samples.
+    '''
+    _pack_ = 1
+    _fields_ = [
+        ('SonarID', ctypes.c_uint64),
+        ('PingNumber', ctypes.c_uint32),
+        ('MultiPingSequence', ctypes.c_uint16),
+        ('Beams', ctypes.c_uint16),
+        ('Reserved1', ctypes.c_uint16),
+        ('Samples', ctypes.c_uint32),
+        ('RecordSubsetFlag', ctypes.c_uint8),
+        ('RowColumnFlag', ctypes.c_uint8),  # 0 = samples stored beam by beam
+        ('Reserved2', ctypes.c_uint16),
+        ('DataSampleType', ctypes.c_uint32)  # Sample size of amplitude (b0-3), phase (b4-7), I (b8-11) and Q (b12-15)
+    ]
+
+
+class R7kSnippetBeam(XTFBase):
+    _pack_ = 1
+    _fields_ = [
+        ('BeamNumber', ctypes.c_uint16),
+        ('BeginSample', ctypes.c_uint32),
+        ('EndSample', ctypes.c_uint32)
+    ]
+
+
+# One row per beam for the bathymetry of all pings in a file (see r7k_bathymetry)
+r7k_bathy_beam_dtype = np.dtype([
+    ('Ping', '<u4'),  # Index of the packet in the list of pings
+    ('PingNumber', '<u4'),
+    ('Beam', '<u2'),
+    ('TravelTime', '<f4'),  # Two way travel time in seconds
+    ('Angle', '<f4'),  # Receive angle in radians
+    ('Quality', '<u4'),
+    ('Intensity', '<f4')
+])
+
+# Element types of the 7008 sample types (unsigned amplitude, signed phase/I/Q), keyed on the size code
+_r7k_amplitude_dtype = {1: '<u1', 2: '<u2', 3: '<u4'}
+_r7k_signed_dtype = {1: '<i1', 2: '<i2', 3: '<i4'}
+
+
+def _r7k_detection_dtype(data_field_size: int) -> np.dtype:
+    '''
+    Returns the 7027 detection dtype for the given entry size, leaving out fields not present in older records.
+    '''
+    full = R7kRawDetection.np_dtype()
+    names = [name for name in full.names if full.fields[name][1] + full.fields[name][0].itemsize <= data_field_size]
+    return np.dtype({
+        'names': names,
+        'formats': [full.fields[name][0] for name in names],
+        'offsets': [full.fields[name][1] for name in names],
+        'itemsize': data_field_size
+    })
+
+
+def _r7k_bathy_beams(payload: bytes) -> np.ndarray:
+    '''
+    Decodes the beams of the 7006 or 7027 record (starting with the DRF) in the data of a reson_7125 packet.
+    '''
+    drf = R7kDataRecordFrame.from_buffer_copy(payload)
+    rth_offset = drf.header_offset()
+
+    if drf.RecordTypeIdentifier == R7kRecordType.raw_detection:
+        rth = R7kRawDetectionHeader.from_buffer_copy(payload, rth_offset)
+        detections = np.frombuffer(payload, dtype=_r7k_detection_dtype(rth.DataFieldSize), count=rth.Detections,
+                                   offset=rth_offset + ctypes.sizeof(R7kRawDetectionHeader))
+
+        beams = np.zeros(rth.Detections, dtype=r7k_bathy_beam_dtype)
+        beams['PingNumber'] = rth.PingNumber
+        beams['Beam'] = detections['BeamDescriptor']
+        beams['TravelTime'] = detections['DetectionPoint'] / rth.SamplingRate if rth.SamplingRate else np.nan
+        beams['Angle'] = detections['RxAngle']
+        beams['Quality'] = detections['Quality']
+        beams['Intensity'] = detections['Intensity'] if 'Intensity' in detections.dtype.names else np.nan
+        return beams
+
+    elif drf.RecordTypeIdentifier == R7kRecordType.bathymetric_data:
+        rth = R7kBathymetricHeader.from_buffer_copy(payload, rth_offset)
+        n = rth.Beams
+        offset = rth_offset + ctypes.sizeof(R7kBathymetricHeader)
+
+        beams = np.zeros(n, dtype=r7k_bathy_beam_dtype)
+        beams['PingNumber'] = rth.PingNumber
+        beams['Beam'] = np.arange(n)
+        beams['TravelTime'] = np.frombuffer(payload, dtype='<f4', count=n, offset=offset)
+        beams['Quality'] = np.frombuffer(payload, dtype='<u1', count=n, offset=offset + 4 * n)
+        beams['Intensity'] = np.frombuffer(payload, dtype='<f4', count=n, offset=offset + 5 * n)
+
+        # The beam angles are in the 7004 record appended after the 7006 record.
+        # The packet padding is not mistaken for the 7004 record, as its beam count would not match.
+        geometry_offset = drf.Size
+        geometry_size = ctypes.sizeof(R7kBeamGeometryHeader)
+        if geometry_offset + geometry_size + 16 * n <= len(payload) and \
+                R7kBeamGeometryHeader.from_buffer_copy(payload, geometry_offset).Beams == n:
+            angle_offset = geometry_offset + geometry_size
+            beams['Angle'] = np.frombuffer(payload, dtype='<f4', count=n, offset=angle_offset)
+        else:
+            beams['Angle'] = np.nan
+        return beams
+
+    raise RuntimeError('Unsupported 7k record in reson_7125 packet: {}'.format(drf.RecordTypeIdentifier))
+
+
+def r7k_bathymetry(pings: List[XTFPingHeader]) -> np.ndarray:
+    '''
+    Decodes the bathymetry in a list of reson_7125 packets into a single array with one row per beam.
+    Both the 7006 (bathymetric data) and the newer 7027 (raw detection) records are supported.
+    :param pings: A list of reson_7125 packets (the vendor data is stored in the data field)
+    :return: Structured array (r7k_bathy_beam_dtype), e.g. beams['TravelTime'] for the travel time of all beams
+    '''
+    all_beams = []
+    for i, ping in enumerate(pings):
+        beams = _r7k_bathy_beams(ping.data)
+        beams['Ping'] = i
+        all_beams.append(beams)
+
+    if not all_beams:
+        return np.zeros(0, dtype=r7k_bathy_beam_dtype)
+
+    return np.concatenate(all_beams)
+
+
+class R7kSnippets:
+    '''
+    The 7008 snippets of a sequence of reson_7125_snippet packets, stored in flat arrays.
+    The samples of beam i are samples[offsets[i]:offsets[i + 1]].
+    The beams of record j are beams[record_offsets[j]:record_offsets[j + 1]].
+    '''
+    def __init__(self, records: np.ndarray, record_ping: np.ndarray, beams: np.ndarray,
+                 record_offsets: np.ndarray, offsets: np.ndarray, samples: np.ndarray):
+        self.records = records  # 7008 record type headers (one per head and ping)
+        self.record_ping = record_ping  # Index of the packet each record was read from
+        self.beams = beams  # Snippet beam descriptors (BeamNumber, BeginSample, EndSample)
+        self.record_offsets = record_offsets
+        self.offsets = offsets
+        self.samples = samples  # Amplitude samples
+
+    def __len__(self):
+        return len(self.beams)
+
+    def beam_samples(self, i: int) -> np.ndarray:
+        '''
+        Returns a view of the amplitude samples of a single beam.
+        :param i: The beam index (in beams)
+        :return: The samples as a numpy array
+        '''
+        return self.samples[self.offsets[i]:self.offsets[i + 1]]
+
+
+def r7k_snippets(pings: List[XTFPingHeader]) -> R7kSnippets:
+    '''
+    Decodes the 7008 snippets in a list of reson_7125_snippet packets, and concatenates the amplitude samples of all
+    beams into a single contiguous buffer. Each packet holds one 7008 record (+ 7004 record) per sonar head.
+    :param pings: A list of reson_7125_snippet packets (the vendor data is stored in the data field)
+    :return: R7kSnippets
+    '''
+    rth_dtype = R7kSnippetHeader.np_dtype()
+    beam_dtype = R7kSnippetBeam.np_dtype()
+    rth_size = ctypes.sizeof(R7kSnippetHeader)
+
+    records = []
+    record_ping = []
+    all_beams = []
+    all_samples = []
+    for i, ping in enumerate(pings):
+        payload = ping.data
+        pos = 0
+        while pos + rth_size <= len(payload):
+            rth = np.frombuffer(payload, dtype=rth_dtype, count=1, offset=pos)[0]
+            n_beams = int(rth['Beams'])
+            if n_beams == 0:
+                break  # Padding after the last record
+
+            if rth['RowColumnFlag'] != 0:
+                warn('7008 record with samples ordered by sample (RowColumnFlag) is not supported, skipping packet.')
+                break
+
+            sample_type = int(rth['DataSampleType'])
+            amplitude_code = sample_type & 0xF
+            if amplitude_code not in _r7k_amplitude_dtype:
+                warn('7008 record without amplitude samples, skipping packet.')
+                break
+
+            # Each sample consists of the elements enabled in the sample type (amplitude, phase, I and Q)
+            sample_fields = [('Amplitude', _r7k_amplitude_dtype[amplitude_code])]
+            for name, shift in (('Phase', 4), ('I', 8), ('Q', 12)):
+                code = (sample_type >> shift) & 0xF
+                if code:
+                    sample_fields.append((name, _r7k_signed_dtype[code]))
+            sample_dtype = np.dtype(sample_fields)
+
+            beams = np.frombuffer(payload, dtype=beam_dtype, count=n_beams, offset=pos + rth_size)
+            n_samples = int((beams['EndSample'].astype(np.int64) - beams['BeginSample'] + 1).sum())
+            data_offset = pos + rth_size + beams.nbytes
+            samples = np.frombuffer(payload, dtype=sample_dtype, count=n_samples, offset=data_offset)
+
+            records.append(rth)
+            record_ping.append(i)
+            all_beams.append(beams)
+            all_samples.append(samples['Amplitude'])
+
+            # Skip the appended 7004 record (header and four arrays of floats)
+            pos = data_offset + samples.nbytes
+            if pos + ctypes.sizeof(R7kBeamGeometryHeader) > len(payload):
+                break
+            geometry = np.frombuffer(payload, dtype=R7kBeamGeometryHeader.np_dtype(), count=1, offset=pos)[0]
+            pos += ctypes.sizeof(R7kBeamGeometryHeader) + 16 * int(geometry['Beams'])
+
+    beams = np.concatenate(all_beams) if all_beams else np.zeros(0, dtype=beam_dtype)
+    counts = beams['EndSample'].astype(np.int64) - beams['BeginSample'] + 1
+
+    offsets = np.zeros(len(beams) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    record_offsets = np.zeros(len(records) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in all_beams], out=record_offsets[1:])
+
+    return R7kSnippets(records=np.array(records, dtype=rth_dtype),
+                       record_ping=np.array(record_ping, dtype=np.int64),
+                       beams=beams,
+                       record_offsets=record_offsets,
+                       offsets=offsets,
+                       samples=np.concatenate(all_samples) if all_samples else np.zeros(0, dtype=np.uint16))
@@ -0,0 +1,408 @@
+"""
+Compressed XTF container with random access (.xtfz).
+The packets of an XTF file are stored verbatim in independently compressed blocks, followed by a block table and a
+packet table (type, time and location of every packet). Reads only decompress the blocks that contain the packets
+requested, and the container converts back to the exact bytes of the original XTF file.
+
+Layout: magic, XTFFileHeader, compressed blocks, compressed block table, compressed packet table, compressed sample
+table, footer. With byte shuffling, the sample arrays of the sonar pings (listed in the sample table) are moved to the
+end of each block and shuffled, while the headers and other packets are stored unchanged.
+"""
+
+import ctypes
+import lzma
+import os
+import struct
+from typing import Generator, List, Tuple, Union
+from warnings import warn
+import zlib
+
+import numpy as np
+
+from pyxtf.enumerations import XTFHeaderType
+from pyxtf.xtf_ctypes import XTFFileHeader, XTFPacket, XTFPacketClasses, XTFPingChanHeader, XTFPingHeader, \
+    XTFUnknownPacket
+from pyxtf.xtf_io import BufferReader, xtf_scan
+from pyxtf.xtf_storage import XTFStorage, LocalStorage
+
+XTFZ_MAGIC = b'PYXTFZ\x00\x02'
+
+XTFZ_CODECS = {'zlib': 0, 'lzma': 1}
+
+# Footer: magic, block table position and size, packet table position and size, sample table position and size,
+# number of blocks, packets and sample arrays, codec and byte-shuffle element size
+_xtfz_footer = struct.Struct('<8sQQQQQQQQQBB')
+
+xtfz_block_dtype = np.dtype([
+    ('offset', '<i8'),  # Position of the compressed block in the container
+    ('size', '<u4'),  # Compressed size
+    ('raw_size', '<u4')  # Uncompressed size
+])
+
+xtfz_packet_dtype = np.dtype([
+    ('type', '<u1'),  # The header type as stored in the packet
+    ('block', '<u4'),
+    ('offset', '<u4'),  # Position of the packet in the uncompressed block
+    ('size', '<u4'),  # NumBytesThisRecord
+    ('time', '<M8[us]'),  # NaT for packets without time fields
+    ('xtf_offset', '<i8')  # Position of the packet in the XTF file
+])
+
+xtfz_sample_dtype = np.dtype([
+    ('block', '<u4'),
+    ('offset', '<u4'),  # Position of the sample array in the uncompressed block
+    ('size', '<u4')
+])
+
+
+def _shuffle(data: bytes, element_size: int) -> bytes:
+    # Groups the n-th byte of every element together, which compresses better for arrays of multi-byte samples
+    if element_size <= 1:
+        return data
+    raw = np.frombuffer(data, dtype=np.uint8)
+    n_body = len(raw) - len(raw) % element_size
+    return raw[:n_body].reshape(-1, element_size).T.tobytes() + raw[n_body:].tobytes()
+
+
+def _unshuffle(data: bytes, element_size: int) -> bytes:
+    if element_size <= 1:
+        return data
+    raw = np.frombuffer(data, dtype=np.uint8)
+    n_body = len(raw) - len(raw) % element_size
+    return raw[:n_body].reshape(element_size, -1).T.tobytes() + raw[n_body:].tobytes()
+
+
+def _compress(data: bytes, codec: int, level: int = None) -> bytes:
+    if codec == XTFZ_CODECS['lzma']:
+        return lzma.compress(data, preset=6 if level is None else level)
+    return zlib.compress(data, -1 if level is None else level)
+
+
+def _decompress(data: bytes, codec: int) -> bytes:
+    if codec == XTFZ_CODECS['lzma']:
+        return lzma.decompress(data)
+    return zlib.decompress(data)
+
+
+def _field(raw: np.ndarray, positions: np.ndarray, p_class: type, name: str) -> np.ndarray:
+    # Gathers a single header field of the packets at positions
+    field = getattr(p_class, name)
+    field_bytes = raw[positions[:, np.newaxis] + field.offset + np.arange(field.size)]
+    return field_bytes.view(p_class.np_dtype().fields[name][0]).reshape(-1)
+
+
+def _sonar_samples(raw: np.ndarray, packets: np.ndarray, file_header: XTFFileHeader) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Locates the sample arrays of the sonar pings in the file, following the channel headers of every ping as
+    XTFPingHeader.create_from_buffer does (one channel of all pings at a time). A ping that can not be decoded is
+    followed up to the channel where it fails.
+    :param raw: The XTF file (uint8)
+    :param packets: The packets of the file (see xtf_scan)
+    :return: The position and size of each sample array, in file order
+    """
+    n_ping_header = ctypes.sizeof(XTFPingHeader)
+    n_chan_header = ctypes.sizeof(XTFPingChanHeader)
+
+    pings = packets[packets['type'] == XTFHeaderType.sonar]
+    pos = pings['offset'] + n_ping_header
+    ends = pings['offset'] + pings['size'].astype(np.int64)
+    active = pos <= ends
+    n_chans = np.zeros(len(pings), dtype=np.int64)
+    n_chans[active] = _field(raw, pings['offset'][active], XTFPingHeader, 'NumChansToFollow')
+
+    # The channel info by ChannelNumber (see XTFFileHeader.channel_info)
+    bytes_per_sample = np.array([c.BytesPerSample for c in file_header.ChanInfo], dtype=np.int64)
+    reserved = np.array([c.Reserved for c in file_header.ChanInfo], dtype=np.int64)
+
+    starts, sizes = [], []
+    for c in range(int(n_chans.max()) if len(n_chans) else 0):
+        active &= (n_chans > c) & (pos + n_chan_header <= ends)
+        idx = np.flatnonzero(active)
+        chan_pos = pos[idx]
+
+        chan_number = _field(raw, chan_pos, XTFPingChanHeader, 'ChannelNumber').astype(np.int64)
+        n_samples = _field(raw, chan_pos, XTFPingChanHeader, 'NumSamples').astype(np.int64)
+        numbered = (chan_number < len(bytes_per_sample)) & \
+            (bytes_per_sample[np.minimum(chan_number, len(bytes_per_sample) - 1)] > 0)
+        chan_number = np.minimum(chan_number, len(bytes_per_sample) - 1)
+        if c < len(file_header.sonar_info):
+            fallback = file_header.sonar_info[c]
+            has_info = np.ones(len(idx), dtype=bool)
+        else:
+            fallback = None
+            has_info = numbered
+        chan_bytes_per_sample = np.where(numbered, bytes_per_sample[chan_number],
+                                         fallback.BytesPerSample if fallback else 0)
+        chan_reserved = np.where(numbered, reserved[chan_number], fallback.Reserved if fallback else 0)
+
+        n_bytes = np.where(n_samples > 0, n_samples, chan_reserved) * chan_bytes_per_sample
+        ok = has_info & (n_bytes <= ends[idx] - chan_pos - n_chan_header)
+        active[idx[~ok]] = False
+
+        starts.append(chan_pos[ok] + n_chan_header)
+        sizes.append(n_bytes[ok])
+        pos[idx] += n_chan_header + n_bytes
+
+    starts = np.concatenate(starts) if starts else np.empty(0, dtype=np.int64)
+    sizes = np.concatenate(sizes) if sizes else np.empty(0, dtype=np.int64)
+    order = np.argsort(starts[sizes > 0], kind='stable')
+    return starts[sizes > 0][order], sizes[sizes > 0][order]
+
+
+def _sample_mask(n_bytes: int, samples: np.ndarray) -> np.ndarray:
+    # Marks the bytes of the sample arrays (xtfz_sample_dtype) in a block
+    edges = np.zeros(n_bytes + 1, dtype=np.int64)
+    np.add.at(edges, samples['offset'].astype(np.int64), 1)
+    np.add.at(edges, samples['offset'].astype(np.int64) + samples['size'], -1)
+    return np.cumsum(edges[:-1]) > 0
+
+
+def _encode_block(data: np.ndarray, samples: np.ndarray, element_size: int) -> bytes:
+    # The bytes outside the sample arrays are stored first, followed by the shuffled samples
+    if element_size <= 1 or not len(samples):
+        return data.tobytes()
+    mask = _sample_mask(len(data), samples)
+    return data[~mask].tobytes() + _shuffle(data[mask].tobytes(), element_size)
+
+
+def _decode_block(data: bytes, samples: np.ndarray, element_size: int) -> bytes:
+    if element_size <= 1 or not len(samples):
+        return data
+    encoded = np.frombuffer(data, dtype=np.uint8)
+    mask = _sample_mask(len(encoded), samples)
+    n_other = len(encoded) - int(np.count_nonzero(mask))
+
+    block = np.empty(len(encoded), dtype=np.uint8)
+    block[~mask] = encoded[:n_other]
+    block[mask] = np.frombuffer(_unshuffle(encoded[n_other:].tobytes(), element_size), dtype=np.uint8)
+    return block.tobytes()
+
+
+def xtf_compress(path: str, out_path: str, codec: str = 'zlib', level: int = None, shuffle: int = 0,
+                 block_size: int = 4 * 1024 * 1024) -> int:
+    """
+    Converts an XTF file to the compressed container format.
+    :param path: The path to the XTF file
+    :param out_path: The path of the container
+    :param codec: The compression method, 'zlib' or 'lzma'
+    :param level: The compression level (zlib level or lzma preset), None for the default
+    :param shuffle: Byte-shuffle element size applied to the sonar samples before compression (e.g. 2 for 16-bit
+                    samples), 0 to disable
+    :param block_size: The uncompressed size at which a block is completed
+    :return: The number of packets stored
+    """
+    if codec not in XTFZ_CODECS:
+        raise RuntimeError('Unknown codec ({}), must be one of {}.'.format(codec, list(XTFZ_CODECS)))
+    codec_id = XTFZ_CODECS[codec]
+
+    n_file_header = ctypes.sizeof(XTFFileHeader)
+    if os.path.getsize(path) < n_file_header:
+        raise RuntimeError('XTF file shorter than expected (end hit while reading XTFFileHeader)')
+    raw = np.memmap(path, dtype=np.uint8, mode='r')
+    packets = xtf_scan(path, with_time=True)
+
+    # The packets are stored in file order, so that the container converts back to the exact same file
+    xtf_pos = np.cumsum(packets['size'], dtype=np.int64) - packets['size'] + n_file_header
+    not_contiguous = np.flatnonzero(packets['offset'] != xtf_pos)
+    if len(not_contiguous):
+        raise RuntimeError('XTF packets are not contiguous at {} (index does not match the file?)'.format(
+            packets['offset'][not_contiguous[0]]))
+    xtf_end = int(xtf_pos[-1] + packets['size'][-1]) if len(packets) else n_file_header
+    if xtf_end != len(raw):
+        raise RuntimeError('XTF file has trailing bytes after the last packet.')
+
+    # A block is completed at the first packet starting at least block_size after the start of the block
+    block_starts = [n_file_header]
+    while True:
+        i = np.searchsorted(xtf_pos, block_starts[-1] + max(block_size, 1))
+        if i >= len(packets):
+            break
+        block_starts.append(int(xtf_pos[i]))
+    block_ends = block_starts[1:] + [xtf_end]
+
+    packet_table = np.zeros(len(packets), dtype=xtfz_packet_dtype)
+    packet_table['block'] = np.searchsorted(block_starts, xtf_pos, side='right') - 1
+    packet_table['offset'] = xtf_pos - np.array(block_starts, dtype=np.int64)[packet_table['block']]
+    packet_table['xtf_offset'] = packets['offset']
+    for name in ['type', 'size', 'time']:
+        # The header type is stored as in the packet, as unknown types are grouped in the index
+        packet_table[name] = packets[name]
+
+    # Only the sample arrays are shuffled, as shuffling the headers mixes unrelated fields
+    if shuffle > 1:
+        file_header = XTFFileHeader.create_from_buffer(buffer=raw[:n_file_header].tobytes())
+        (sample_starts, sample_sizes) = _sonar_samples(raw, packets, file_header)
+    else:
+        (sample_starts, sample_sizes) = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64))
+    sample_table = np.zeros(len(sample_starts), dtype=xtfz_sample_dtype)
+    sample_table['block'] = np.searchsorted(block_starts, sample_starts, side='right') - 1
+    sample_table['offset'] = sample_starts - np.array(block_starts, dtype=np.int64)[sample_table['block']]
+    sample_table['size'] = sample_sizes
+    block_samples = np.searchsorted(sample_table['block'], np.arange(len(block_starts) + 1))
+
+    blocks = []
+    with open(out_path, 'wb') as f_out:
+        f_out.write(XTFZ_MAGIC)
+        f_out.write(raw[:n_file_header].tobytes())
+        out_pos = len(XTFZ_MAGIC) + n_file_header
+
+        for i, (start, end) in enumerate(zip(block_starts, block_ends)):
+            if end == start:
+                continue
+            samples = sample_table[block_samples[i]:block_samples[i + 1]]
+            block = _compress(_encode_block(raw[start:end], samples, shuffle), codec_id, level)
+            f_out.write(block)
+            blocks.append((out_pos, len(block), end - start))
+            out_pos += len(block)
+
+        block_table = zlib.compress(np.array(blocks, dtype=xtfz_block_dtype).tobytes())
+        packet_table = zlib.compress(packet_table.tobytes())
+        sample_table_bytes = zlib.compress(sample_table.tobytes())
+        f_out.write(block_table)
+        f_out.write(packet_table)
+        f_out.write(sample_table_bytes)
+        f_out.write(_xtfz_footer.pack(XTFZ_MAGIC,
+                                      out_pos, len(block_table),
+                                      out_pos + len(block_table), len(packet_table),
+                                      out_pos + len(block_table) + len(packet_table), len(sample_table_bytes),
+                                      len(blocks), len(packets), len(sample_table),
+                                      codec_id, shuffle))
+
+    return len(packets)
+
+
+class XTFArchive:
+    """
+    Reader of the compressed XTF container (see xtf_compress).
+    The packet table (type, time and size of each packet) is available without decompressing any blocks.
+    """
+    def __init__(self, path: Union[str, XTFStorage]):
+        """
+        :param path: The path of the container, or a storage backend (see xtf_storage)
+        """
+        self._own_storage = not isinstance(path, XTFStorage)
+        self._storage = LocalStorage(path) if self._own_storage else path
+        self.path = self._storage.path
+
+        file_size = self._storage.size()
+        if file_size < len(XTFZ_MAGIC) + _xtfz_footer.size or self._storage.read_range(0, len(XTFZ_MAGIC)) != XTFZ_MAGIC:
+            raise RuntimeError('File is not a compressed XTF container.')
+
+        footer = self._storage.read_range(file_size - _xtfz_footer.size, _xtfz_footer.size)
+        (magic, block_pos, block_size, packet_pos, packet_size, sample_pos, sample_size, n_blocks, n_packets, n_samples,
+         self.codec, self.shuffle) = _xtfz_footer.unpack(footer)
+        if magic != XTFZ_MAGIC:
+            raise RuntimeError('Compressed XTF container is incomplete (missing footer).')
+
+        self.file_header = XTFFileHeader.create_from_buffer(
+            buffer=self._storage.read_range(len(XTFZ_MAGIC), ctypes.sizeof(XTFFileHeader)))
+        self.blocks = np.frombuffer(zlib.decompress(self._storage.read_range(block_pos, block_size)),
+                                    dtype=xtfz_block_dtype)
+        self.packets = np.frombuffer(zlib.decompress(self._storage.read_range(packet_pos, packet_size)),
+                                     dtype=xtfz_packet_dtype)
+        self.samples = np.frombuffer(zlib.decompress(self._storage.read_range(sample_pos, sample_size)),
+                                     dtype=xtfz_sample_dtype)
+        if len(self.blocks) != n_blocks or len(self.packets) != n_packets or len(self.samples) != n_samples:
+            raise RuntimeError('Compressed XTF container tables do not match the footer (file corrupt?)')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __len__(self):
+        return len(self.packets)
+
+    def close(self):
+        # A storage passed by the caller is left open
+        if self._own_storage:
+            self._storage.close()
+
+    def read_block(self, i: int) -> bytes:
+        """
+        Returns the uncompressed bytes of a block, i.e. the packets stored in it.
+        """
+        (offset, size, raw_size) = self.blocks[i]
+        samples = self.samples[np.searchsorted(self.samples['block'], i):np.searchsorted(self.samples['block'], i + 1)]
+        data = _decompress(self._storage.read_range(int(offset), int(size)), self.codec)
+        if len(data) != raw_size:
+            raise RuntimeError('Block {} of compressed XTF container has unexpected size (file corrupt?)'.format(i))
+        return _decode_block(data, samples, self.shuffle)
+
+    def select(self, types: List[XTFHeaderType] = None, start: np.datetime64 = None,
+               end: np.datetime64 = None) -> np.ndarray:
+        """
+        Returns the indices (in the packet table) of the packets matching the given types and time range.
+        Packets without time fields are included if the previous packet with time is included.
+        :param types: Optional list of XTFHeaderTypes to keep. Default (None) keeps all types
+        :param start: Optional start time (inclusive)
+        :param end: Optional end time (exclusive)
+        :return: Array of packet indices
+        """
+        mask = np.ones(len(self.packets), dtype=bool)
+        if types:
+            mask &= np.isin(self.packets['type'], [int(t) for t in types])
+
+        if start is not None or end is not None:
+            times = self.packets['time']
+            in_range = np.ones(len(times), dtype=bool)
+            if start is not None:
+                in_range &= times >= np.datetime64(start, 'us')
+            if end is not None:
+                in_range &= times < np.datetime64(end, 'us')
+
+            # Forward fill the packets without time from the previous packet with time
+            has_time = ~np.isnat(times)
+            prev_timed = np.maximum.accumulate(np.where(has_time, np.arange(len(times)), -1))
+            mask &= np.where(prev_timed >= 0, in_range[np.maximum(prev_timed, 0)], True)
+
+        return np.flatnonzero(mask)
+
+    def read(self, types: List[XTFHeaderType] = None, start: np.datetime64 = None, end: np.datetime64 = None) \
+            -> Generator[XTFPacket, None, None]:
+        """
+        Generator of the packets matching the given types and time range (see select), in file order.
+        Only the blocks containing these packets are decompressed.
+        :return: None
+        """
+        block_idx, block = -1, None
+        for packet in self.packets[self.select(types, start, end)]:
+            if packet['block'] != block_idx:
+                block_idx = packet['block']
+                block = memoryview(self.read_block(block_idx))
+
+            try:
+                p_headertype = XTFHeaderType(packet['type'])
+            except ValueError:
+                p_headertype = XTFHeaderType.unknown
+
+            p_class = XTFPacketClasses.get(p_headertype, XTFUnknownPacket)
+            if p_headertype == XTFHeaderType.unknown:
+                warn('XTFHeaderType ({}) is not known. Returned as XTFUnknownPacket'.format(packet['type']))
+            elif p_class is XTFUnknownPacket:
+                warn('XTFHeaderType ({}) has no implementation. Returned as XTFUnknownPacket.'.format(
+                    p_headertype.name))
+
+            packet_bytes = block[packet['offset']:packet['offset'] + packet['size']]
+            yield p_class.create_from_buffer(buffer=BufferReader(packet_bytes), file_header=self.file_header)
+
+    def to_xtf(self, out_path: str):
+        """
+        Writes the original XTF file.
+        :param out_path: The path of the XTF file
+        """
+        with open(out_path, 'wb') as f_out:
+            f_out.write(bytes(self.file_header))
+            for i in range(len(self.blocks)):
+                f_out.write(self.read_block(i))
+
+
+def xtf_decompress(path: str, out_path: str):
+    """
+    Converts a compressed XTF container back to the original XTF file.
+    :param path: The path of the container
+    :param out_path: The path of the XTF file
+    """
+    with XTFArchive(path) as archive:
+        archive.to_xtf(out_path)
@@ -0,0 +1,211 @@
+"""
+Buffer arena for decoding XTF packets with few allocations, for long-running processes reading many files.
+Each record is read into a pooled buffer that is reused (and grown to fit the largest record), the headers are copied
+directly into their ctypes structures, and the sample arrays are carved out of large slabs instead of being
+allocated one by one. The number of buffer allocations per packet and the peak RSS can be reported.
+The slabs can also be placed in memory-mapped temporary files beyond a memory budget (XTFSpillArena).
+"""
+
+import sys
+import tempfile
+from typing import Union
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+
+def xtf_peak_rss() -> Union[int, None]:
+    """
+    Returns the peak resident set size of the process in bytes, or None if not available on this platform.
+    """
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS reports bytes
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+
+class XTFArena:
+    """
+    Pooled buffers for decoding packets, passed to xtf_read_gen (arena=...).
+    The sample arrays of sonar pings are carved out of slabs of slab_size bytes, and keep their slab alive as long
+    as they are referenced. Use copy=True to give every array its own memory instead (e.g. when only a few pings are
+    kept while the rest are discarded). The arena is not thread-safe, use one arena per reading thread.
+    """
+    _alignment = 16
+
+    def __init__(self, slab_size: int = 4 * 1024 * 1024, copy: bool = False):
+        """
+        :param slab_size: The size of each slab that sample arrays are carved out of
+        :param copy: If true, sample arrays are copied to their own memory instead of carved out of slabs
+        """
+        self.slab_size = slab_size
+        self.copy = copy
+        self._record = bytearray(64 * 1024)
+        self._slab = np.empty(0, dtype=np.uint8)
+        self._slab_pos = 0
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.n_packets = 0
+        self.n_allocations = 0
+        self.n_bytes_allocated = 0
+
+    def _allocated(self, n_bytes: int):
+        self.n_allocations += 1
+        self.n_bytes_allocated += n_bytes
+
+    @property
+    def allocations_per_packet(self) -> float:
+        """
+        The average number of buffer allocations per packet decoded (not counting the packet objects themselves).
+        """
+        return self.n_allocations / self.n_packets if self.n_packets else 0.0
+
+    def stats(self) -> dict:
+        """
+        Returns the allocation counters and the peak RSS of the process (see xtf_peak_rss).
+        """
+        return {
+            'packets': self.n_packets,
+            'allocations': self.n_allocations,
+            'allocations_per_packet': self.allocations_per_packet,
+            'bytes_allocated': self.n_bytes_allocated,
+            'peak_rss': xtf_peak_rss()
+        }
+
+    def record(self, size: int) -> memoryview:
+        """
+        Returns the pooled record buffer, grown to at least size bytes. The buffer is reused for the next record.
+        """
+        if size > len(self._record):
+            # A new buffer is allocated, as views of the current buffer may still exist
+            self._record = bytearray(max(size, 2 * len(self._record)))
+            self._allocated(len(self._record))
+        return memoryview(self._record)[:size]
+
+    def carve(self, data, dtype: np.dtype) -> np.ndarray:
+        """
+        Returns a long-lived array of the given dtype with a copy of data, carved out of the current slab.
+        """
+        dtype = np.dtype(dtype)
+        n_bytes = len(data)
+        if self.copy or n_bytes > self.slab_size // 4:
+            # Large arrays get their own memory, so that a slab is not wasted on them
+            out = self.allocate(n_bytes)
+        else:
+            start = -self._slab_pos % self._alignment + self._slab_pos
+            if start + n_bytes > len(self._slab):
+                self._slab = self.allocate(self.slab_size)
+                start = 0
+            self._slab_pos = start + n_bytes
+            out = self._slab[start:self._slab_pos]
+
+        out[:] = np.frombuffer(data, dtype=np.uint8)
+        return out.view(dtype)
+
+    def allocate(self, n_bytes: int) -> np.ndarray:
+        """
+        Allocates a long-lived byte array (a slab, or the memory of a large array).
+        """
+        self._allocated(n_bytes)
+        return np.empty(n_bytes, dtype=np.uint8)
+
+    def reader(self, buffer) -> '_ArenaReader':
+        """
+        Returns a file-like reader of a record (e.g. from record()) to pass to create_from_buffer.
+        """
+        self.n_packets += 1
+        return _ArenaReader(self, buffer)
+
+
+class XTFSpillArena(XTFArena):
+    """
+    Arena that keeps the sample data in memory up to max_memory bytes, and places the rest in memory-mapped temporary
+    files (see xtf_read with max_memory). The arrays are used as any other numpy array, and the temporary files are
+    deleted by the operating system when the last array using them is released.
+    The spilled arrays are carved out of temporary files of spill_size bytes, so that a memory map (and the file
+    descriptor it holds) is shared by many arrays instead of one per array.
+    """
+    def __init__(self, max_memory: int, spill_dir: str = None, slab_size: int = 4 * 1024 * 1024, copy: bool = False,
+                 spill_size: int = 64 * 1024 * 1024):
+        """
+        :param max_memory: The number of bytes allocated in memory before spilling to disk
+        :param spill_dir: The directory of the temporary files, None for the default (see tempfile.gettempdir)
+        :param slab_size: The size of each slab that sample arrays are carved out of
+        :param copy: If true, sample arrays are copied to their own memory (or file) instead of carved out of slabs
+        :param spill_size: The size of each temporary file, larger allocations get a file of their own size
+        """
+        super().__init__(slab_size=slab_size, copy=copy)
+        self.max_memory = max_memory
+        self.spill_dir = spill_dir
+        self.spill_size = spill_size
+        self._spill = np.empty(0, dtype=np.uint8)
+        self._spill_pos = 0
+        self.n_bytes_memory = 0
+        self.n_bytes_spilled = 0
+        self.n_spill_files = 0
+
+    def stats(self) -> dict:
+        stats = super().stats()
+        stats['bytes_memory'] = self.n_bytes_memory
+        stats['bytes_spilled'] = self.n_bytes_spilled
+        stats['spill_files'] = self.n_spill_files
+        return stats
+
+    def allocate(self, n_bytes: int) -> np.ndarray:
+        if self.n_bytes_memory + n_bytes <= self.max_memory or n_bytes == 0:
+            self.n_bytes_memory += n_bytes
+            return super().allocate(n_bytes)
+
+        self._allocated(n_bytes)
+        self.n_bytes_spilled += n_bytes
+
+        start = -self._spill_pos % self._alignment + self._spill_pos
+        if start + n_bytes > len(self._spill):
+            # The file has no name (it is removed once created), and lives as long as the memory map. The pages of
+            # the file are only allocated on disk when written.
+            with tempfile.TemporaryFile(dir=self.spill_dir) as f:
+                self._spill = np.memmap(f, dtype=np.uint8, mode='w+', shape=(max(n_bytes, self.spill_size),))
+            self.n_spill_files += 1
+            start = 0
+        self._spill_pos = start + n_bytes
+        return self._spill[start:self._spill_pos]
+
+
+class _ArenaReader:
+    """
+    File-like reader of a record in the arena. Structures are filled with readinto, sample arrays are carved out of
+    the arena with read_array, and other payloads are returned as bytes by read.
+    """
+    def __init__(self, arena: XTFArena, buffer):
+        self._arena = arena
+        self._view = memoryview(buffer).cast('B')
+        self._pos = 0
+
+    def _take(self, size: int) -> memoryview:
+        end = len(self._view) if size is None or size < 0 else min(self._pos + size, len(self._view))
+        view = self._view[self._pos:end]
+        self._pos = end
+        return view
+
+    def read(self, size: int = -1) -> bytes:
+        data = bytes(self._take(size))
+        self._arena._allocated(len(data))
+        return data
+
+    def readinto(self, buffer) -> int:
+        out = memoryview(buffer).cast('B')
+        view = self._take(len(out))
+        out[:len(view)] = view
+        return len(view)
+
+    def read_array(self, n_bytes: int, dtype: np.dtype) -> np.ndarray:
+        view = self._take(n_bytes)
+        if len(view) < n_bytes:
+            raise RuntimeError('File ended while reading data packets (file corrupt?)')
+        return self._arena.carve(view, dtype)
@@ -0,0 +1,303 @@
+"""
+Persistent cache of decoded XTF files, so that repeated analyses of the same files skip the parsing.
+The columns of each file (see xtf_read with columnar=True, and PingTable) are stored as .npy files in a directory
+per source file, listed in a manifest. Entries are keyed by the source path, size, modification time and the pyxtf
+version, loaded as memory maps, and the least recently used entries are removed when the cache exceeds its size limit.
+Changes to the manifest are serialized with a lock file (fcntl), so that several processes can share a directory.
+"""
+
+from contextlib import contextmanager
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
+
+from pyxtf.enumerations import XTFHeaderType
+from pyxtf.xtf_ctypes import XTFFileHeader, XTFPacketClasses, XTFUnknownPacket
+from pyxtf.xtf_io import xtf_read, xtf_read_gen
+from pyxtf.xtf_table import PacketTable, PingTable, concatenate_pings
+
+try:
+    from importlib.metadata import version, PackageNotFoundError
+except ImportError:  # Python < 3.8
+    version = None
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows, where the cache is not locked between processes
+    fcntl = None
+
+# Incremented when the arrays built from a file change (e.g. a decoding fix), so that older entries are rebuilt
+_cache_format = 2
+
+# Directory name of a cache entry, the key followed by the group
+_entry_name = re.compile(r'^[0-9a-f]{40}_[a-z]+$')
+
+
+def _pyxtf_version() -> str:
+    if version is None:
+        return 'unknown'
+    try:
+        return version('pyxtf')
+    except PackageNotFoundError:
+        return 'unknown'
+
+
+class XTFCache:
+    """
+    Cache directory of decoded XTF files.
+    Usage:
+        cache = XTFCache('/data/xtf_cache', max_bytes=50 * 1024 ** 3)
+        file_header, packets = cache.read(path)  # Dict of PacketTable, e.g. packets[XTFHeaderType.attitude]['Heading']
+        pings = cache.read_pings(path)  # PingTable, e.g. pings.waterfall(0)
+    """
+    manifest_name = 'manifest.json'
+    lock_name = '.lock'
+
+    def __init__(self, directory: str, max_bytes: int = 10 * 1024 ** 3):
+        """
+        :param directory: The cache directory (created if it does not exist)
+        :param max_bytes: The size limit of the cache, least recently used entries are removed beyond it
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def fingerprint(path: str) -> dict:
+        """
+        Returns the properties of the source file that identify a cache entry.
+        """
+        stat = os.stat(path)
+        return {'path': os.path.abspath(path), 'size': stat.st_size, 'mtime': stat.st_mtime_ns,
+                'version': _pyxtf_version(), 'format': _cache_format}
+
+    @staticmethod
+    def key(fingerprint: dict) -> str:
+        return hashlib.sha1(json.dumps(fingerprint, sort_keys=True).encode()).hexdigest()
+
+    def read(self, path: str, types: List[XTFHeaderType] = None) -> Tuple[XTFFileHeader, Dict[XTFHeaderType, PacketTable]]:
+        """
+        Returns the packets of the file as PacketTables (as xtf_read with columnar=True), from the cache if possible.
+        All packet types are cached, regardless of the types requested.
+        :param path: The path to the XTF file
+        :param types: Optional list of XTFHeaderTypes to return. Default (None) returns all types
+        :return: Tuple of the file header and a dictionary of PacketTable per type
+        """
+        arrays = self._entry(path, 'packets', self._build_packets)
+        file_header = XTFFileHeader.create_from_buffer(buffer=arrays['file_header'].tobytes())
+
+        packets = {}  # type: Dict[XTFHeaderType, PacketTable]
+        for name in arrays:
+            if not name.endswith('_headers'):
+                continue
+            p_headertype = XTFHeaderType(int(name.split('_')[0]))
+            if types and p_headertype not in types:
+                continue
+
+            prefix = name[:-len('headers')]
+            p_class = XTFPacketClasses.get(p_headertype, XTFUnknownPacket)
+            packets[p_headertype] = PacketTable(file_header=file_header, header_type=p_headertype,
+                                                packet_class=p_class,
+                                                headers=arrays[prefix + 'headers'],
+                                                offsets=arrays[prefix + 'offsets'],
+                                                payload=arrays[prefix + 'payload'],
+                                                locations=arrays[prefix + 'locations'])
+        return file_header, packets
+
+    def read_pings(self, path: str) -> PingTable:
+        """
+        Returns the sonar pings of the file as a PingTable, from the cache if possible.
+        :param path: The path to the XTF file
+        :return: PingTable
+        """
+        arrays = self._entry(path, 'pings', self._build_pings)
+        file_header = XTFFileHeader.create_from_buffer(buffer=arrays['file_header'].tobytes())
+        n_channels = arrays['offsets'].shape[0]
+        return PingTable(file_header=file_header,
+                         headers=arrays['headers'],
+                         chan_headers=arrays['chan_headers'],
+                         offsets=arrays['offsets'],
+                         samples=[arrays['samples_{}'.format(c)] for c in range(n_channels)])
+
+    def size(self) -> int:
+        """
+        Returns the number of bytes used by the cache entries.
+        """
+        with self._lock():
+            return sum(entry['bytes'] for entry in self._load_manifest().values())
+
+    def clear(self):
+        """
+        Removes all entries.
+        """
+        with self._lock():
+            manifest = self._load_manifest()
+            for group_key in list(manifest):
+                self._remove(manifest, group_key)
+            self._remove_orphans(manifest)
+            self._save_manifest(manifest)
+
+    @staticmethod
+    def _build_packets(path: str) -> Dict[str, np.ndarray]:
+        file_header, packets = xtf_read(path, columnar=True)
+        arrays = {'file_header': np.frombuffer(bytes(file_header), dtype=np.uint8)}
+        for p_headertype, table in packets.items():
+            prefix = '{}_'.format(int(p_headertype))
+            arrays[prefix + 'headers'] = table.headers
+            arrays[prefix + 'offsets'] = table.offsets
+            arrays[prefix + 'payload'] = table.payload
+            arrays[prefix + 'locations'] = table.locations
+        return arrays
+
+    @staticmethod
+    def _build_pings(path: str) -> Dict[str, np.ndarray]:
+        gen = xtf_read_gen(path, types=[XTFHeaderType.sonar])
+        file_header = next(gen)
+        pings = concatenate_pings(gen, file_header)
+        arrays = {'file_header': np.frombuffer(bytes(file_header), dtype=np.uint8),
+                  'headers': pings.headers,
+                  'chan_headers': pings.chan_headers,
+                  'offsets': pings.offsets}
+        for c, samples in enumerate(pings.samples):
+            arrays['samples_{}'.format(c)] = samples
+        return arrays
+
+    def _entry(self, path: str, group: str, build: Callable[[str], Dict[str, np.ndarray]]) -> Dict[str, np.ndarray]:
+        fingerprint = self.fingerprint(path)
+        group_key = '{}_{}'.format(self.key(fingerprint), group)
+        entry_dir = os.path.join(self.directory, group_key)
+
+        with self._lock():
+            manifest = self._load_manifest()
+            entry = manifest.get(group_key)
+            if entry is not None and os.path.isdir(entry_dir):
+                self.hits += 1
+                entry['last_used'] = time.time()
+                self._save_manifest(manifest)
+                return self._load_arrays(entry_dir, entry['arrays'])
+
+            # The arrays are written to a temporary directory first, so that an entry is never seen half written
+            (tmp_dir, f_tmp_lock) = self._create_tmp_dir()
+
+        self.misses += 1
+        try:
+            arrays = build(path)
+            for name, array in arrays.items():
+                np.save(os.path.join(tmp_dir, name + '.npy'), array)
+
+            with self._lock():
+                os.remove(os.path.join(tmp_dir, self.lock_name))
+                if os.path.isdir(entry_dir):
+                    shutil.rmtree(entry_dir)
+                os.replace(tmp_dir, entry_dir)
+
+                # Entries of older versions of the same file are not used anymore
+                manifest = self._load_manifest()
+                for other_key, other in list(manifest.items()):
+                    if other['source']['path'] == fingerprint['path'] and other['source'] != fingerprint:
+                        self._remove(manifest, other_key)
+
+                manifest[group_key] = {
+                    'source': fingerprint,
+                    'arrays': list(arrays),
+                    'bytes': sum(os.path.getsize(os.path.join(entry_dir, name + '.npy')) for name in arrays),
+                    'last_used': time.time()
+                }
+                self._evict(manifest, keep=group_key)
+                self._save_manifest(manifest)
+                return self._load_arrays(entry_dir, list(arrays))
+        except BaseException:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+        finally:
+            f_tmp_lock.close()
+
+    @staticmethod
+    def _load_arrays(entry_dir: str, names: List[str]) -> Dict[str, np.ndarray]:
+        return {name: np.load(os.path.join(entry_dir, name + '.npy'), mmap_mode='r') for name in names}
+
+    @contextmanager
+    def _lock(self):
+        # Serializes the changes to the manifest and entries between processes (and threads) using the directory
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(self.directory, self.lock_name), 'a') as f_lock:
+            fcntl.flock(f_lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f_lock, fcntl.LOCK_UN)
+
+    def _create_tmp_dir(self):
+        # The lock file in the directory is held while the entry is built, to tell it apart from the temporary
+        # directories left by killed processes (see _remove_orphans)
+        tmp_dir = tempfile.mkdtemp(dir=self.directory, prefix='.tmp_')
+        f_tmp_lock = open(os.path.join(tmp_dir, self.lock_name), 'w')
+        if fcntl is not None:
+            fcntl.flock(f_tmp_lock, fcntl.LOCK_EX)
+        return tmp_dir, f_tmp_lock
+
+    def _tmp_dir_in_use(self, tmp_dir: str) -> bool:
+        if fcntl is None:
+            return True  # Can not be determined
+        try:
+            with open(os.path.join(tmp_dir, self.lock_name), 'r') as f_tmp_lock:
+                fcntl.flock(f_tmp_lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except FileNotFoundError:
+            return False
+        except BlockingIOError:
+            return True
+        return False
+
+    def _remove_orphans(self, manifest: dict):
+        # Removes entries missing from the manifest (e.g. dropped by an older version without locking), and the
+        # temporary files of processes killed while writing. Other files in the directory are left as is.
+        for name in os.listdir(self.directory):
+            item_path = os.path.join(self.directory, name)
+            if name.startswith('.tmp_') and os.path.isdir(item_path):
+                if not self._tmp_dir_in_use(item_path):
+                    shutil.rmtree(item_path, ignore_errors=True)
+            elif name.startswith(self.manifest_name + '.tmp'):
+                os.remove(item_path)
+            elif _entry_name.match(name) and name not in manifest and os.path.isdir(item_path):
+                shutil.rmtree(item_path, ignore_errors=True)
+
+    def _evict(self, manifest: dict, keep: str):
+        # Remove least recently used entries until the cache is within its limit (except the entry just added)
+        self._remove_orphans(manifest)
+        n_bytes = sum(entry['bytes'] for entry in manifest.values())
+        for group_key in sorted(manifest, key=lambda k: manifest[k]['last_used']):
+            if n_bytes <= self.max_bytes:
+                break
+            if group_key != keep:
+                n_bytes -= manifest[group_key]['bytes']
+                self._remove(manifest, group_key)
+
+    def _remove(self, manifest: dict, group_key: str):
+        shutil.rmtree(os.path.join(self.directory, group_key), ignore_errors=True)
+        del manifest[group_key]
+
+    def _load_manifest(self) -> dict:
+        try:
+            with open(os.path.join(self.directory, self.manifest_name), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_manifest(self, manifest: dict):
+        # Replaced atomically, as other processes may read the manifest concurrently
+        manifest_path = os.path.join(self.directory, self.manifest_name)
+        tmp_path = manifest_path + '.tmp{}'.format(os.getpid())
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f, indent=1)
+        os.replace(tmp_path, manifest_path)
@@ -2,13 +2,13 @@ import ctypes
 from datetime import date
 from io import BytesIO
 from io import IOBase
-import itertools
+import pickle
 from typing import List
 from warnings import warn
 
 import numpy as np
 
-from pyxtf.enumerations import XTFHeaderType, XTFChannelType
+from pyxtf.enumerations import XTFHeaderType, XTFChannelType, XTFSampleFormat
 
 # General notes from the XTF format document (rev35)
 # 1. All structures should be zero-filled before use.
@@ -50,8 +50,10 @@ SampleFormat field added in X41
 8 = 1-byte integer
 """
 
-# Mapping from 'sample format' to the numpy type
+# Mapping from 'sample format' to the numpy type of the decoded samples
+# Note: IBM floats (1) are stored as uint32 words, and decoded to float32 with ibm_to_ieee
 sample_format_dtype = {
+    1: np.float32,
     2: np.uint32,
     3: np.uint16,
     5: np.float32,
@@ -59,6 +61,108 @@ sample_format_dtype = {
 }
 
 
+def ibm_to_ieee(ibm: np.ndarray) -> np.ndarray:
+    """
+    Converts 4-byte IBM floats (SampleFormat 1) to IEEE floats, operating on the whole array at once.
+    IBM floats are stored as sign (1 bit), base-16 exponent biased by 64 (7 bits) and fraction (24 bits).
+    Values outside the float32 range become +-inf.
+    :param ibm: The raw IBM floats as a uint32 array (native values, i.e. after np.frombuffer with '<u4')
+    :return: float32 array with the same shape
+    """
+    ibm = np.asarray(ibm, dtype=np.uint32)
+
+    # value = fraction * 2^-24 * 16^(exponent - 64) = fraction * 2^(4 * exponent - 280)
+    exponent = ((ibm >> 24) & 0x7F).astype(np.int32)
+    exponent *= 4
+    exponent -= 280
+    out = np.ldexp((ibm & 0x00FFFFFF).astype(np.float32), exponent)
+    np.negative(out, out=out, where=ibm >= 0x80000000)
+
+    return out
+
+# Cache of the numpy dtypes generated from ctypes structures, keyed on (ctype, byte_order)
+_ctypes_dtype_cache = {}
+
+
+def ctypes_to_dtype(ctype, byte_order: str = '<') -> np.dtype:
+    """
+    Creates a packed numpy dtype with the same memory layout as the ctypes type (structure, array or simple type).
+    This allows many structures to be decoded at once with np.frombuffer, rather than one ctypes object at a time.
+    :param ctype: The ctypes type to convert
+    :param byte_order: '<' for little-endian (XTF), '>' for big-endian
+    :return: The numpy dtype
+    """
+    key = (ctype, byte_order)
+    try:
+        return _ctypes_dtype_cache[key]
+    except KeyError:
+        pass
+
+    if issubclass(ctype, ctypes.Structure):
+        # Fields are accumulated through the class hierarchy (e.g. XTFPacketStart -> XTFPingHeader)
+        fields = []
+        for base in reversed(ctype.__mro__):
+            fields.extend(base.__dict__.get('_fields_', []))
+
+        dtype = np.dtype({
+            'names': [name for name, _ in fields],
+            'formats': [ctypes_to_dtype(field_type, byte_order) for _, field_type in fields],
+            'offsets': [getattr(ctype, name).offset for name, _ in fields],
+            'itemsize': ctypes.sizeof(ctype)
+        })
+    elif issubclass(ctype, ctypes.Array):
+        if ctype._type_ is ctypes.c_char:
+            dtype = np.dtype('S{}'.format(ctype._length_))
+        else:
+            dtype = np.dtype((ctypes_to_dtype(ctype._type_, byte_order), (ctype._length_,)))
+    elif ctype is ctypes.c_char:
+        dtype = np.dtype('S1')
+    else:
+        dtype = np.dtype(ctype._type_).newbyteorder(byte_order)
+
+    _ctypes_dtype_cache[key] = dtype
+    return dtype
+
+
+def _xtf_pickle_buffer(obj, protocol: int):
+    """
+    Returns the memory of a ctypes object to pickle. With pickle protocol 5, this is a PickleBuffer, which is passed
+    out-of-band (without copying) when pickle.dumps is given a buffer_callback, otherwise a copy of the bytes.
+    """
+    if protocol >= 5 and hasattr(pickle, 'PickleBuffer'):
+        return pickle.PickleBuffer(obj)
+    return bytes(obj)
+
+
+class _XTFPickledArray:
+    """
+    Pickles a ctypes array (e.g. the XTFBeamXYZA array of bathy pings), as its type is created dynamically.
+    """
+    def __init__(self, array: ctypes.Array):
+        self.array = array
+
+    def __reduce_ex__(self, protocol):
+        return _xtf_unpickle_array, (self.array._type_, len(self.array), _xtf_pickle_buffer(self.array, protocol))
+
+
+def _xtf_unpickle_array(element_type, length: int, buffer) -> ctypes.Array:
+    return (element_type * length).from_buffer_copy(buffer)
+
+
+def _xtf_pickle_state(obj) -> dict:
+    """
+    Returns the additional attributes of a structure (e.g. data and ping_chan_headers) to pickle.
+    Numpy arrays are pickled by numpy, which also passes them out-of-band with pickle protocol 5.
+    """
+    return {key: _XTFPickledArray(val) if isinstance(val, ctypes.Array) else val for key, val in obj.__dict__.items()}
+
+
+def _xtf_unpickle(cls, buffer, state: dict):
+    obj = cls.from_buffer_copy(buffer)
+    obj.__dict__.update(state)
+    return obj
+
+
 class XTFBase(ctypes.LittleEndianStructure):
     """
     Base class for all XTF ctypes.Structure children.
@@ -77,6 +181,14 @@ class XTFBase(ctypes.LittleEndianStructure):
         if type(buffer) in [bytes, bytearray]:
             buffer = BytesIO(buffer)
 
+        readinto = getattr(buffer, 'readinto', None)
+        if readinto is not None:
+            # Copy directly into the structure, without an intermediate bytes object
+            obj = cls.__new__(cls)
+            if readinto(obj) < ctypes.sizeof(cls):
+                raise RuntimeError('XTF file shorter than expected (end hit while reading {})'.format(cls.__name__))
+            return obj
+
         header_bytes = buffer.read(ctypes.sizeof(cls))
         if not header_bytes:
             raise RuntimeError('XTF file shorter than expected (end hit while reading {})'.format(cls.__name__))
@@ -93,6 +205,22 @@ class XTFBase(ctypes.LittleEndianStructure):
         """
         raise NotImplementedError("Views has not been implemented")
 
+    @classmethod
+    def np_dtype(cls, byte_order: str = '<') -> np.dtype:
+        """
+        Returns the packed numpy dtype of this structure (see ctypes_to_dtype).
+        :param byte_order: '<' for little-endian (XTF), '>' for big-endian
+        :return: The numpy dtype
+        """
+        return ctypes_to_dtype(cls, byte_order)
+
+    def __reduce_ex__(self, protocol):
+        """
+        Pickles the structure as its bytes, along with the additional attributes. With pickle protocol 5, the structure
+        and the numpy arrays (e.g. the samples of a ping) can be passed as out-of-band buffers, without copying.
+        """
+        return _xtf_unpickle, (type(self), _xtf_pickle_buffer(self, protocol), _xtf_pickle_state(self))
+
     def __str__(self):
         """
         Prints the fields in the class (with ctype-fields) in the order in which they appear in the structure.
@@ -127,8 +255,15 @@ class XTFBase(ctypes.LittleEndianStructure):
 
         return out
 
+    def to_buffers(self) -> list:
+        """
+        Returns the objects (supporting the buffer protocol) that make up the serialized structure, in file order.
+        Avoids copying large data arrays when the packet is written to file (see XTFWriter).
+        """
+        return [self]
+
     def to_bytes(self):
-        return bytes(self)
+        return b''.join(self.to_buffers())
 
 
 class XTFChanInfo(XTFBase):
@@ -226,6 +361,23 @@ class XTFFileHeader(XTFBase):
 
         return n_channels
 
+    def channel_info(self, p_chan: 'XTFPingChanHeader', i: int) -> XTFChanInfo:
+        """
+        Returns the XTFChanInfo of a channel in a sonar ping.
+        The ChannelNumber of the ping channel header indexes ChanInfo, which also covers subbottom channels (not part
+        of sonar_info). If it does not refer to a configured channel, the i-th sonar channel is used instead.
+        :param p_chan: The ping channel header
+        :param i: The position of the channel in the ping
+        :return: The channel info
+        """
+        chan_number = p_chan.ChannelNumber
+        if chan_number < len(self.ChanInfo) and self.ChanInfo[chan_number].BytesPerSample > 0:
+            return self.ChanInfo[chan_number]
+        if i < len(self.sonar_info):
+            return self.sonar_info[i]
+        raise RuntimeError('No channel info in the file header for ping channel {} (ChannelNumber {}).'.format(
+            i, chan_number))
+
     def __init__(self):
         super().__init__()
         self.FileFormat = 0x7B
@@ -345,6 +497,8 @@ class XTFUnknownPacket(XTFPacketStart):
 
         return obj
 
+    def to_buffers(self) -> list:
+        return [self, self.data]
 
 
 class XTFAttitudeData(XTFPacketStart):
@@ -411,7 +565,7 @@ class XTFRawSerialHeader(XTFPacketStart):
     def create_from_buffer(cls, buffer: IOBase, file_header: XTFFileHeader=None):
         obj = super().create_from_buffer(buffer)
         # TODO: Make getters/setters that updates StringSize when changed
-        obj.RawAsciiData = buffer.read(ctypes.sizeof(ctypes.c_char) * obj.StringSize.value)
+        obj.RawAsciiData = buffer.read(ctypes.sizeof(ctypes.c_char) * obj.StringSize)
 
         return obj
 
@@ -421,6 +575,9 @@ class XTFRawSerialHeader(XTFPacketStart):
         self.RawAsciiData = b''
         self.HeaderType = XTFHeaderType.raw_serial.value
 
+    def to_buffers(self) -> list:
+        return [self, self.RawAsciiData]
+
     # Serialport and subchannelnumber is the same variable
     # The documentation uses serialport, so this redirection is added to match the docs
     @property
@@ -583,29 +740,44 @@ class XTFPingHeader(XTFPacketStart):
                 obj.ping_chan_headers.append(p_chan)
                 bytes_remaining -= ctypes.sizeof(XTFPingChanHeader)
 
+                chan_info = file_header.channel_info(p_chan, i)
+
                 # Backwards-compatibility: retrive from NumSamples if possible, else use old field
-                n_samples = p_chan.NumSamples if p_chan.NumSamples > 0 else file_header.sonar_info[i].Reserved
+                n_samples = p_chan.NumSamples if p_chan.NumSamples > 0 else chan_info.Reserved
 
                 # Calculate number of bytes to read
-                n_bytes = n_samples * file_header.sonar_info[i].BytesPerSample
+                n_bytes = n_samples * chan_info.BytesPerSample
                 if n_bytes > bytes_remaining:
                     raise RuntimeError('Number of bytes to read exceeds the number of bytes remaining in packet.')
 
-                # Read the data and output as a numpy array of the specified bytes-per-sample
-                samples = buffer.read(n_bytes)
-                if n_bytes > 0 and not samples:
-                    raise RuntimeError('File ended while reading data packets (file corrupt?)')
-
-                bytes_remaining -= len(samples)
-
                 # Favor getting the sample format from the dedicated field added in X41.
                 # If the field is not populated deduce the type from the bytes per sample field.
-                try:
-                    sample_dtype = sample_format_dtype[file_header.sonar_info[i].SampleFormat]
-                except KeyError:
-                    sample_dtype = xtf_dtype[file_header.sonar_info[i].BytesPerSample]
+                sample_format = chan_info.SampleFormat
+                if sample_format == XTFSampleFormat.ibm_float:
+                    sample_dtype = None
+                else:
+                    try:
+                        sample_dtype = sample_format_dtype[sample_format]
+                    except KeyError:
+                        sample_dtype = xtf_dtype[chan_info.BytesPerSample]
+
+                if sample_dtype is not None and hasattr(buffer, 'read_array'):
+                    # The reader places the samples in memory it manages (see xtf_arena)
+                    samples = buffer.read_array(n_bytes, sample_dtype)
+                    bytes_remaining -= n_bytes
+                else:
+                    # Read the data and output as a numpy array of the specified bytes-per-sample
+                    samples = buffer.read(n_bytes)
+                    if n_bytes > 0 and not samples:
+                        raise RuntimeError('File ended while reading data packets (file corrupt?)')
+
+                    bytes_remaining -= len(samples)
+
+                    if sample_dtype is None:
+                        samples = ibm_to_ieee(np.frombuffer(samples, dtype=np.uint32))
+                    else:
+                        samples = np.frombuffer(samples, dtype=sample_dtype)
 
-                samples = np.frombuffer(samples, dtype=sample_dtype)
                 obj.data.append(samples)
 
         elif obj.HeaderType == XTFHeaderType.bathy_xyza:
@@ -659,12 +831,23 @@ class XTFPingHeader(XTFPacketStart):
         super().__init__()
         self.HeaderType = XTFHeaderType.sonar.value
 
-    def to_bytes(self):
-        return b''.join(
-            map(bytes,
-                itertools.chain((self,),
-                itertools.chain.from_iterable(
-                    zip(self.ping_chan_headers, self.data)))))
+    def to_buffers(self) -> list:
+        ping_chan_headers = getattr(self, 'ping_chan_headers', [])
+        data = getattr(self, 'data', None)
+
+        if self.HeaderType == XTFHeaderType.sonar:
+            # Each channel header is followed by the samples of that channel
+            buffers = [self]
+            for p_chan, samples in zip(ping_chan_headers, data or []):
+                buffers.append(p_chan)
+                buffers.append(np.ascontiguousarray(samples))
+            return buffers
+
+        buffers = [self]
+        buffers.extend(ping_chan_headers)
+        if data is not None:
+            buffers.append(data)
+        return buffers
 
 
 class XTFPosRawNavigation(XTFPacketStart):
@@ -822,6 +1005,9 @@ class XTFRawCustomHeader(XTFPacket):
         self.MagicNumber = 0xFACE
         self.HeaderType = XTFHeaderType.custom_vendor_data.value
 
+    def to_buffers(self) -> list:
+        return [self, self.data]
+
 
 class XTFHeaderNavigation(XTFPacket):
     _pack_ = 1
@@ -1006,15 +1192,15 @@ class SNP1(XTFBase):
 
 
 # Mapping from enumerated header type to the class implementation
-# TODO: XTF bathy snippets (SNP0/SNP1 etc) requires a custom implementation in xtf_read
 XTFPacketClasses = {
     XTFHeaderType.sonar: XTFPingHeader,
     XTFHeaderType.bathy: XTFPingHeader,
     XTFHeaderType.bathy_xyza: XTFPingHeader,
+    XTFHeaderType.bathy_snippet: XTFPingHeader,  # SNP0/SNP1 data returned as raw bytes, see concatenate_snippets
     XTFHeaderType.multibeam_raw_beam_angle: XTFPingHeader, # Raw vendor data is returned as raw bytes
-    XTFHeaderType.reson_7125_snippet: XTFPingHeader,  # The custom vendor data is returned as raw bytes
-    XTFHeaderType.reson_7125: XTFPingHeader,  # The custom vendor data is returned as raw bytes
-    XTFHeaderType.reson_7018_watercolumn: XTFPingHeader,  # The custom vendor data is returned as raw bytes
+    XTFHeaderType.reson_7125_snippet: XTFPingHeader,  # Raw vendor data, see vendors.reson.r7k_snippets
+    XTFHeaderType.reson_7125: XTFPingHeader,  # Raw vendor data, see vendors.reson.r7k_bathymetry
+    XTFHeaderType.reson_7018_watercolumn: XTFPingHeader,  # Raw vendor data, see vendors.reson.r7k_watercolumn
     XTFHeaderType.attitude: XTFAttitudeData,
     XTFHeaderType.notes: XTFNotesHeader,
     XTFHeaderType.raw_serial: XTFRawSerialHeader,
@@ -1,7 +1,7 @@
 import ctypes
 import numpy as np
 from io import IOBase, BytesIO
-from typing import List, Tuple, Dict, Callable, Any
+from typing import List, Tuple, Dict, Callable, Any, Generator, Iterable
 
 
 
@@ -29,6 +29,30 @@ class XTFBase(ctypes.LittleEndianStructure):
     def __init__(self, buffer=None, *args, **kwargs):
         pass
 
+    def __reduce_ex__(self, protocol: int) -> tuple:
+        pass
+
+    @classmethod
+    def create_from_buffer(cls, buffer: IOBase, file_header=None):
+        pass
+
+    @classmethod
+    def view_from_buffer(cls, buffer: IOBase, file_header=None):
+        pass
+
+    @classmethod
+    def np_dtype(cls, byte_order: str = '<') -> np.dtype:
+        pass
+
+
+def ibm_to_ieee(ibm: np.ndarray) -> np.ndarray:
+    pass
+
+
+def ctypes_to_dtype(ctype, byte_order: str = '<') -> np.dtype:
+    pass
+
+
 class XTFChanInfo(XTFBase):
     TypeOfChannel = None  # type: CField
     SubChannelNumber = None  # type: CField
@@ -74,6 +98,9 @@ class XTFChanInfo(XTFBase):
         self.BeamsPerArray = None  # type: ctypes.c_ushort
         self.SampleFormat = None  # type: ctypes.c_ubyte
         self.ReservedArea2 = None  # type: ctypes.Array[ctypes.c_ubyte]
+    def to_buffers(self) -> list:
+        pass
+
     def to_bytes(self):
         pass
 
@@ -151,6 +178,11 @@ class XTFFileHeader(XTFBase):
         self.ChanInfo = None  # type: ctypes.Array[XTFChanInfo]
     def channel_count(self, verbose: bool = False) -> int:
         pass
+    def channel_info(self, p_chan: 'XTFPingChanHeader', i: int) -> XTFChanInfo:
+        pass
+    def to_buffers(self) -> list:
+        pass
+
     def to_bytes(self):
         pass
 
@@ -158,6 +190,9 @@ class XTFFileHeader(XTFBase):
 class XTFPacket(XTFBase):
     def get_time(self):
         pass
+    def to_buffers(self) -> list:
+        pass
+
     def to_bytes(self):
         pass
 
@@ -179,6 +214,9 @@ class XTFPacketStart(XTFPacket):
         self.NumBytesThisRecord = None  # type: ctypes.c_uint
     def get_time(self):
         pass
+    def to_buffers(self) -> list:
+        pass
+
     def to_bytes(self):
         pass
 
@@ -200,6 +238,9 @@ class XTFUnknownPacket(XTFPacketStart):
         self.NumBytesThisRecord = None  # type: ctypes.c_uint
     def get_time(self):
         pass
+    def to_buffers(self) -> list:
+        pass
+
     def to_bytes(self):
         pass
 
@@ -243,6 +284,9 @@ class XTFAttitudeData(XTFPacketStart):
         self.Reserved3 = None  # type: ctypes.c_ubyte
     def get_time(self):
         pass
+    def to_buffers(self) -> list:
+        pass
+
     def to_bytes(self):
         pass
 
@@ -268,6 +312,9 @@ class XTFNotesHeader(XTFPacketStart):
         self.NotesText = None  # type: ctypes.Array[ctypes.c_char]
     def get_time(self):
         pass
+    def to_buffers(self) -> list:
+        pass
+
     def to_bytes(self):
         pass
 
@@ -299,6 +346,9 @@ class XTFRawSerialHeader(XTFPacketStart):
         self.RawAsciiData = None  # type: bytes
     def get_time(self):
         pass
+    def to_buffers(self) -> list:
+        pass
+
     def to_bytes(self):
         pass
 
@@ -354,6 +404,9 @@ class XTFPingChanHeader(XTFBase):
         self.FixedVSOP = None  # type: ctypes.c_float
         self.Weight = None  # type: ctypes.c_short
         self.ReservedSpace = None  # type: ctypes.Array[ctypes.c_ubyte]
+    def to_buffers(self) -> list:
+        pass
+
     def to_bytes(self):
         pass
 
@@ -511,6 +564,9 @@ class XTFPingHeader(XTFPacketStart):
         self.data = None  # type: List[np.ndarray]
     def get_time(self):
         pass
+    def to_buffers(self) -> list:
+        pass
+
     def to_bytes(self):
         pass
 
@@ -550,6 +606,9 @@ class XTFPosRawNavigation(XTFPacketStart):
         self.Reserved2 = None  # type: ctypes.c_ubyte
     def get_time(self):
         pass
+    def to_buffers(self) -> list:
+        pass
+
     def to_bytes(self):
         pass
 
@@ -587,6 +646,9 @@ class XTFQPSSingleBeam(XTFPacketStart):
         self.Reserved2 = None  # type: ctypes.Array[ctypes.c_ubyte]
     def get_time(self):
         pass
+    def to_buffers(self) -> list:
+        pass
+
     def to_bytes(self):
         pass
 
@@ -612,6 +674,9 @@ class XTFQPSMultiTXEntry(XTFBase):
         self.OffsetY = None  # type: ctypes.c_float
         self.OffsetZ = None  # type: ctypes.c_float
         self.Reserved = None  # type: ctypes.Array[ctypes.c_float]
+    def to_buffers(self) -> list:
+        pass
+
     def to_bytes(self):
         pass
 
@@ -635,6 +700,9 @@ class XTFQPSMBEEntry(XTFBase):
         self.BeamAngle = None  # type: ctypes.c_double
         self.TiltAngle = None  # type: ctypes.c_double
         self.Reserved = None  # type: ctypes.Array[ctypes.c_float]
+    def to_buffers(self) -> list:
+        pass
+
     def to_bytes(self):
         pass
 
@@ -684,6 +752,9 @@ class XTFRawCustomHeader(XTFPacket):
         self.Reserved3 = None  # type: ctypes.Array[ctypes.c_ubyte]
     def get_time(self):
         pass
+    def to_buffers(self) -> list:
+        pass
+
     def to_bytes(self):
         pass
 
@@ -729,6 +800,9 @@ class XTFHeaderNavigation(XTFPacket):
         self.Reserved2 = None  # type: ctypes.Array[ctypes.c_ubyte]
     def get_time(self):
         pass
+    def to_buffers(self) -> list:
+        pass
+
     def to_bytes(self):
         pass
 
@@ -770,6 +844,9 @@ class XTFHeaderGyro(XTFPacket):
         self.Reserved1 = None  # type: ctypes.Array[ctypes.c_ubyte]
     def get_time(self):
         pass
+    def to_buffers(self) -> list:
+        pass
+
     def to_bytes(self):
         pass
 
@@ -799,6 +876,9 @@ class XTFHighSpeedSensor(XTFPacketStart):
         self.Reserved3 = None  # type: ctypes.Array[ctypes.c_ubyte]
     def get_time(self):
         pass
+    def to_buffers(self) -> list:
+        pass
+
     def to_bytes(self):
         pass
 
@@ -818,6 +898,9 @@ class XTFBeamXYZA(XTFBase):
         self.dTime = None  # type: ctypes.c_double
         self.usAmpl = None  # type: ctypes.c_short
         self.ucQuality = None  # type: ctypes.c_ubyte
+    def to_buffers(self) -> list:
+        pass
+
     def to_bytes(self):
         pass
 
@@ -889,6 +972,9 @@ class SNP0(XTFBase):
         self.bFlags = None  # type: ctypes.Array[ctypes.c_ubyte]
         self.HeadTemp = None  # type: ctypes.c_short
         self.BeamCnt = None  # type: ctypes.c_ushort
+    def to_buffers(self) -> list:
+        pass
+
     def to_bytes(self):
         pass
 
@@ -916,6 +1002,9 @@ class SNP1(XTFBase):
         self.GainEnd = None  # type: ctypes.c_ushort
         self.FragOffset = None  # type: ctypes.c_ushort
         self.FragSamples = None  # type: ctypes.c_ushort
+    def to_buffers(self) -> list:
+        pass
+
     def to_bytes(self):
         pass
 
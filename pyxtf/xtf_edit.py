@@ -0,0 +1,344 @@
+"""
+Filtering, splitting and merging of XTF files without decoding the packets.
+The packets are located from the packet index, and their byte ranges are copied verbatim to the output file.
+"""
+
+import os
+from os.path import isfile, splitext
+import pickle
+from typing import Dict, List, Sequence, Tuple
+from warnings import warn
+
+import numpy as np
+
+from pyxtf.enumerations import XTFHeaderType
+from pyxtf.xtf_ctypes import XTFFileHeader, XTFPacketClasses, XTFPacketStart
+from pyxtf.xtf_io import xtf_read_index, xtf_index_path, xtf_scan
+
+
+def _pread(f, size: int, offset: int) -> bytes:
+    """
+    Reads size bytes at offset, without using the file position where os.pread is available.
+    """
+    if hasattr(os, 'pread'):
+        return os.pread(f.fileno(), size, offset)
+    f.seek(offset)
+    return f.read(size)
+
+
+def _write_all(fd: int, data: bytes):
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view):]
+
+
+def _copy_range(f_src, dst_fd: int, offset: int, size: int):
+    """
+    Copies size bytes at offset in the source file to the current position of the destination file.
+    Uses os.copy_file_range or os.sendfile where available (the data stays in the kernel), else reads and writes.
+    """
+    src_fd = f_src.fileno()
+    copied = 0
+
+    if hasattr(os, 'copy_file_range'):
+        try:
+            while copied < size:
+                n_bytes = os.copy_file_range(src_fd, dst_fd, size - copied, offset + copied)
+                if n_bytes == 0:
+                    break
+                copied += n_bytes
+        except OSError:
+            pass  # E.g. not supported by the file system, use the next method for the remainder
+
+    if copied < size and hasattr(os, 'sendfile'):
+        try:
+            while copied < size:
+                n_bytes = os.sendfile(dst_fd, src_fd, offset + copied, size - copied)
+                if n_bytes == 0:
+                    break
+                copied += n_bytes
+        except OSError:
+            pass
+
+    while copied < size:
+        data = _pread(f_src, min(size - copied, 16 * 1024 * 1024), offset + copied)
+        if not data:
+            raise RuntimeError('XTF file shorter than expected while copying packets.')
+        _write_all(dst_fd, data)
+        copied += len(data)
+
+
+# The XTFHeaderType of every header type value, as grouped in the packet index (unknown types are grouped together)
+_index_types = np.array([t if t in XTFHeaderType._value2member_map_ else XTFHeaderType.unknown for t in range(256)],
+                        dtype=np.int64)
+
+
+def _xtf_write_packets(f_src, out_path: str, file_header: XTFFileHeader, packets: np.ndarray, save_index: bool,
+                       xtf_idx: Dict[XTFHeaderType, List[int]] = None, append: bool = False):
+    """
+    Copies the byte range of each packet (xtf_scan_dtype) to the output file, following the file header (unless
+    appending). Returns the index of the output file.
+    """
+    if xtf_idx is None:
+        xtf_idx = {}  # type: Dict[XTFHeaderType, List[int]]
+
+    path_idx = xtf_index_path(out_path)
+    if isfile(path_idx):
+        os.remove(path_idx)
+
+    offsets = packets['offset']
+    sizes = packets['size'].astype(np.int64)
+
+    # Appending is done by seeking to the end, as os.copy_file_range does not accept files opened with O_APPEND
+    with open(out_path, 'r+b' if append else 'wb', buffering=0) as f_dst:
+        dst_fd = f_dst.fileno()
+        if not append:
+            _write_all(dst_fd, bytes(file_header))
+        dst_locs = os.lseek(dst_fd, 0, os.SEEK_END) + np.cumsum(sizes) - sizes
+
+        # Consecutive packets are copied as a single range
+        breaks = np.flatnonzero(offsets[1:] != offsets[:-1] + sizes[:-1]) + 1
+        for i, j in zip(np.append(0, breaks), np.append(breaks, len(packets))):
+            if j > i:
+                _copy_range(f_src, dst_fd, int(offsets[i]), int(dst_locs[j - 1] + sizes[j - 1] - dst_locs[i]))
+
+    # The types are added to the index in the order they first appear
+    index_types = _index_types[packets['type']]
+    (unique_types, first) = np.unique(index_types, return_index=True)
+    for p_headertype in unique_types[np.argsort(first)]:
+        type_locs = dst_locs[index_types == p_headertype].tolist()
+        try:
+            xtf_idx[XTFHeaderType(p_headertype)].extend(type_locs)
+        except KeyError:
+            xtf_idx[XTFHeaderType(p_headertype)] = type_locs
+
+    if save_index:
+        with open(path_idx, mode='wb') as f_idx:
+            pickle.dump(xtf_idx, f_idx)
+
+    return xtf_idx
+
+
+def _latest_time(times: np.ndarray) -> np.ndarray:
+    # Index of the latest packet with time at or before each packet (-1 before the first packet with time)
+    return np.maximum.accumulate(np.where(np.isnat(times), -1, np.arange(len(times))))
+
+
+def _in_time_range(times: np.ndarray, start: np.datetime64, end: np.datetime64) -> np.ndarray:
+    # Packets without time follow the previous packet with time
+    in_range = np.ones(len(times), dtype=bool)
+    if start is not None:
+        in_range &= times >= np.datetime64(start, 'us')
+    if end is not None:
+        in_range &= times < np.datetime64(end, 'us')
+
+    latest = _latest_time(times)
+    return np.where(latest >= 0, in_range[np.maximum(latest, 0)], True)
+
+
+def xtf_filter(path: str, out_path: str, types: List[XTFHeaderType] = None, exclude: List[XTFHeaderType] = None,
+               start: np.datetime64 = None, end: np.datetime64 = None, save_index: bool = True) -> int:
+    """
+    Writes the packets of an XTF file that match the given types and time range to a new file, without decoding them.
+    Packets without time fields (e.g. unknown packets) are kept if the previous packet with time is kept.
+    :param path: The path to the XTF file
+    :param out_path: The path of the output XTF file
+    :param types: Optional list of XTFHeaderTypes to keep. Default (None) keeps all types
+    :param exclude: Optional list of XTFHeaderTypes to drop
+    :param start: Optional start time (inclusive)
+    :param end: Optional end time (exclusive)
+    :param save_index: If true, the index of the output file is stored next to it
+    :return: The number of packets written
+    """
+    with open(path, 'rb', buffering=0) as f:
+        file_header = XTFFileHeader.create_from_buffer(buffer=f)
+        packets = xtf_scan(path, with_time=start is not None or end is not None)
+        keep = _in_time_range(packets['time'], start, end)
+
+        index_types = _index_types[packets['type']]
+        if types:
+            keep &= np.isin(index_types, [int(t) for t in types])
+        if exclude:
+            keep &= ~np.isin(index_types, [int(t) for t in exclude])
+        packets = packets[keep]
+
+        _xtf_write_packets(f, out_path, file_header, packets, save_index)
+
+    return len(packets)
+
+
+def xtf_split(path: str, interval: np.timedelta64, out_path: str = None, save_index: bool = True) -> List[str]:
+    """
+    Splits an XTF file into pieces covering fixed time intervals, without decoding the packets.
+    The intervals are aligned to multiples of the interval since 1970-01-01 (e.g. whole hours).
+    Packets without time fields follow the previous packet with time.
+    :param path: The path to the XTF file
+    :param interval: The duration of each piece, e.g. numpy.timedelta64(1, 'h')
+    :param out_path: Format string for the output paths, formatted with the piece number and the start time.
+                     Defaults to the input path with the piece number appended, e.g. 'line_000.xtf'
+    :param save_index: If true, the index of each output file is stored next to it
+    :return: List of the paths written
+    """
+    if out_path is None:
+        (path_root, path_ext) = splitext(path)
+        out_path = path_root + '_{0:03d}' + path_ext
+
+    interval = np.timedelta64(interval, 'us')
+    if interval <= np.timedelta64(0, 'us'):
+        raise RuntimeError('The split interval must be positive.')
+
+    out_paths = []
+    with open(path, 'rb', buffering=0) as f:
+        file_header = XTFFileHeader.create_from_buffer(buffer=f)
+        packets = xtf_scan(path, with_time=True)
+
+        # The interval of each packet, packets without time follow the previous packet with time
+        times = packets['time']
+        piece_starts = times - (times - np.datetime64(0, 'us')) % interval
+        latest = _latest_time(times)
+        piece_starts = np.where(latest >= 0, piece_starts[np.maximum(latest, 0)], np.datetime64('NaT'))
+
+        # Group consecutive packets belonging to the same interval (compared as integers, as NaT != NaT)
+        piece_keys = piece_starts.view(np.int64)
+        breaks = np.flatnonzero(piece_keys[1:] != piece_keys[:-1]) + 1
+
+        # Packets may jump back and forth in time, pieces of the same interval are appended to the same file
+        piece_idx = {}  # type: Dict[int, Tuple[Dict[XTFHeaderType, List[int]], str]]
+        for i, j in zip(np.append(0, breaks), np.append(breaks, len(packets))):
+            if j == i:
+                continue
+            piece_key = int(piece_keys[i])
+            append = piece_key in piece_idx
+            if not append:
+                piece_start = None if np.isnat(piece_starts[i]) else piece_starts[i]
+                piece_path = out_path.format(len(out_paths), piece_start)
+                out_paths.append(piece_path)
+                piece_idx[piece_key] = ({}, piece_path)
+            (xtf_idx, piece_path) = piece_idx[piece_key]
+
+            _xtf_write_packets(f, piece_path, file_header, packets[i:j], save_index, xtf_idx, append)
+
+    return out_paths
+
+
+def xtf_merge(paths: Sequence[str], out_path: str, file_header: XTFFileHeader = None, save_index: bool = True) -> int:
+    """
+    Concatenates the packets of several XTF files into a single file, without decoding them.
+    :param paths: The paths of the XTF files, in the order their packets are written
+    :param out_path: The path of the output XTF file
+    :param file_header: The file header of the output file. Defaults to the file header of the first file
+    :param save_index: If true, the index of the output file is stored next to it
+    :return: The number of packets written
+    """
+    xtf_idx = {}  # type: Dict[XTFHeaderType, List[int]]
+    n_packets = 0
+    for i, path in enumerate(paths):
+        with open(path, 'rb', buffering=0) as f:
+            path_header = XTFFileHeader.create_from_buffer(buffer=f)
+            if file_header is None:
+                file_header = path_header
+            elif bytes(path_header.ChanInfo) != bytes(file_header.ChanInfo):
+                warn('The channel configuration of {} differs from the output file header.'.format(path))
+
+            packets = xtf_scan(path)
+            _xtf_write_packets(f, out_path, file_header, packets, save_index, xtf_idx, append=i > 0)
+            n_packets += len(packets)
+
+    return n_packets
+
+
+class XTFHeaderMap:
+    """
+    Read-write memory map of the headers of one packet type in an XTF file. The header fields are accessed as columns
+    (one value per packet), and assigning a column writes the field of every packet in place, leaving the data as is.
+    Usage:
+        with XTFHeaderMap(path, XTFHeaderType.sonar) as headers:
+            headers['SensorXcoordinate'] = headers['SensorXcoordinate'] + 1e-5
+    """
+    def __init__(self, path: str, header_type: XTFHeaderType = XTFHeaderType.sonar, mode: str = 'r+'):
+        """
+        :param path: The path to the XTF file
+        :param header_type: The packet type to map, located from the packet index
+        :param mode: The numpy.memmap mode, 'r+' to write changes to file or 'r' for read-only
+        """
+        self.header_type = header_type
+        p_class = XTFPacketClasses.get(header_type, XTFPacketStart)
+        self.dtype = p_class.np_dtype()
+
+        xtf_idx = xtf_read_index(path)
+        self.offsets = np.array(xtf_idx.get(header_type, []), dtype=np.int64)
+        self._mmap = np.memmap(path, dtype=np.uint8, mode=mode)
+
+        if len(self.offsets) and self.offsets[-1] + self.dtype.itemsize > len(self._mmap):
+            raise RuntimeError('XTF file shorter than expected (index does not match the file?)')
+
+        # Packets of equal size (e.g. pings with a fixed number of samples) are mapped as a strided array
+        self._view = None
+        steps = np.diff(self.offsets)
+        if len(self.offsets) and np.all(steps == (steps[0] if len(steps) else 0)):
+            self._view = np.ndarray(shape=(len(self.offsets),), dtype=self.dtype, buffer=self._mmap,
+                                    offset=int(self.offsets[0]), strides=(int(steps[0]) if len(steps) else 0,))
+
+        if np.any(self['MagicNumber'] != 0xFACE):
+            raise RuntimeError('XTF packet does not start with the correct identifier (index does not match the file?)')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        """
+        Returns a copy of the values of the field in every packet.
+        """
+        if self._view is not None:
+            return np.array(self._view[name])
+
+        field_dtype = self.dtype.fields[name][0]
+        field_bytes = np.asarray(self._mmap[self._field_bytes(name)])
+        return field_bytes.view(field_dtype.base).reshape((len(self),) + field_dtype.shape)
+
+    def __setitem__(self, name: str, values):
+        """
+        Writes the values of the field in every packet, either one value per packet or a single value for all.
+        """
+        if self._view is not None:
+            self._view[name] = values
+            return
+
+        field_dtype = self.dtype.fields[name][0]
+        field_values = np.empty((len(self),) + field_dtype.shape, dtype=field_dtype.base)
+        field_values[...] = values
+        self._mmap[self._field_bytes(name)] = field_values.view(np.uint8).reshape(len(self), field_dtype.itemsize)
+
+    def keys(self) -> List[str]:
+        return list(self.dtype.names)
+
+    def update(self, fields: Dict[str, np.ndarray]):
+        """
+        Writes several fields, e.g. the time fields from xtf_time_fields.
+        """
+        for name, values in fields.items():
+            self[name] = values
+
+    def flush(self):
+        self._mmap.flush()
+
+    def close(self):
+        """
+        Flushes the changes to file, and releases the memory map.
+        """
+        if self._mmap is not None:
+            if self._mmap.mode != 'r':
+                self.flush()
+            self._view = None
+            self._mmap = None
+
+    def _field_bytes(self, name: str) -> np.ndarray:
+        # Byte positions of the field in every packet, (packets x field size)
+        field_dtype, field_offset = self.dtype.fields[name][:2]
+        return self.offsets[:, np.newaxis] + field_offset + np.arange(field_dtype.itemsize)
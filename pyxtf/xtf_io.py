@@ -1,26 +1,103 @@
+import bz2
+from contextlib import closing
 import ctypes
+import gzip
 from heapq import merge  # Used to merge sorted lists (file pos)
+from io import BytesIO, IOBase
 from itertools import repeat
+import os
 from os.path import isfile
 from os.path import splitext
+import lzma
 import pickle
 from typing import Any, Dict, Generator, Iterable, List, Tuple, Union
 from warnings import warn
 
 from pyxtf.enumerations import XTFHeaderType
 from pyxtf.xtf_ctypes import *
+from pyxtf.xtf_arena import XTFArena, XTFSpillArena
+from pyxtf.xtf_prefetch import PrefetchStream, prefetch_ranges
+from pyxtf.xtf_storage import XTFStorage, LocalStorage, StorageFile, storage_sibling_path
+from pyxtf.xtf_table import PacketTable
 
 
 def xtf_padding(size: int) -> int:
     """
-    Calculates the necessary padding to make the XTF packet align on a 64byte multiple.
+    Calculates the size of the XTF packet when padded to align on a 64byte multiple.
     This padding is optional, but can improve performance.
     :param size: The number of bytes of the packet.
-    :return: Padding required to align with a 64byte multiple.
+    :return: The packet size rounded up to a 64byte multiple.
     """
     return ((size + 63) // 64) * 64
 
 
+def xtf_index_path(path: str) -> str:
+    """
+    Returns the path of the index file stored next to the XTF file.
+    :param path: The path to the XTF file
+    :return: The path to the index file
+    """
+    (path_root, _) = splitext(path)
+    return path_root + '.pyxtf_idx'
+
+
+def _xtf_open_source(path: Union[str, XTFStorage]):
+    # Opens the XTF file for reading, either from a path or through a storage backend
+    if isinstance(path, XTFStorage):
+        return StorageFile(path)
+    return open(path, 'rb')
+
+
+class _IndexUnpickler(pickle.Unpickler):
+    """
+    Unpickler of index files, which only constructs the dictionary of header types and positions.
+    Any other global (i.e. anything that could run code, e.g. from an index file on a remote server) is refused.
+    """
+    def find_class(self, module: str, name: str):
+        if module == XTFHeaderType.__module__ and name == XTFHeaderType.__name__:
+            return XTFHeaderType
+        raise pickle.UnpicklingError('Index file refers to {}.{}, which is not allowed.'.format(module, name))
+
+
+def _xtf_unpickle_index(data: bytes) -> Dict[XTFHeaderType, List[int]]:
+    xtf_idx = _IndexUnpickler(BytesIO(data)).load()
+    if not isinstance(xtf_idx, dict) or not all(isinstance(locs, list) for locs in xtf_idx.values()):
+        raise RuntimeError('Index file does not contain a packet index (file corrupt?)')
+    try:
+        return {XTFHeaderType(p_headertype): locs for p_headertype, locs in xtf_idx.items()}
+    except ValueError:
+        raise RuntimeError('Index file contains an invalid header type (file corrupt?)')
+
+
+def _xtf_load_index(path: Union[str, XTFStorage]) -> Union[Dict[XTFHeaderType, List[int]], None]:
+    # Returns the index stored next to the XTF file, or None if there is no index file
+    if isinstance(path, XTFStorage):
+        storage_idx = path.sibling(storage_sibling_path(path.path, '.pyxtf_idx'))
+        try:
+            if not storage_idx.exists():
+                return None
+            return _xtf_unpickle_index(storage_idx.read_range(0, storage_idx.size()))
+        finally:
+            storage_idx.close()
+
+    path_idx = xtf_index_path(path)
+    if not isfile(path_idx):
+        return None
+    with open(path_idx, 'rb') as f_idx:
+        return _xtf_unpickle_index(f_idx.read())
+
+
+def _xtf_save_index(path: Union[str, XTFStorage], xtf_idx: Dict[XTFHeaderType, List[int]]):
+    if isinstance(path, LocalStorage):
+        path = path.path
+    elif isinstance(path, XTFStorage):
+        warn('The index file can not be stored through {}.'.format(type(path).__name__))
+        return
+
+    with open(xtf_index_path(path), mode='wb') as f_idx:
+        pickle.dump(xtf_idx, f_idx)
+
+
 def xtf_idx_pos_iter(
         xtf_idx: Dict[XTFHeaderType, List[int]],
         types: List[XTFHeaderType]) -> Iterable[Tuple[int, XTFHeaderType]]:
@@ -39,27 +116,78 @@ def xtf_idx_pos_iter(
     return merge(*xtf_idx_iters)
 
 
-def xtf_read_gen(path: str, types: List[XTFHeaderType]=None, save_index=False) \
+def xtf_read_index(path: Union[str, XTFStorage], save_index: bool = False) -> Dict[XTFHeaderType, List[int]]:
+    """
+    Returns the packet index of the XTF file, i.e. the file position of every packet grouped on header type.
+    The index file stored next to the XTF file is used if present, otherwise only the packet headers are scanned.
+    :param path: The path to the XTF file, or a storage backend (see xtf_storage)
+    :param save_index: If true, the index is stored next to the xtf file (same format as xtf_read_gen)
+    :return: The dictionary index object
+    """
+    xtf_idx = _xtf_load_index(path)
+    if xtf_idx is not None:
+        return xtf_idx
+
+    xtf_idx = {}  # type: Dict[XTFHeaderType, List[int]]
+    p_start = XTFPacketStart()
+    with _xtf_open_source(path) as f:
+        file_size = f.seek(0, os.SEEK_END)
+        packet_start_loc = ctypes.sizeof(XTFFileHeader)
+
+        while packet_start_loc < file_size:
+            f.seek(packet_start_loc)
+            bytes_read = f.readinto(p_start)
+            if bytes_read < ctypes.sizeof(XTFPacketStart):
+                raise RuntimeError('XTF file shorter than expected while reading packet.')
+            if p_start.NumBytesThisRecord == 0:
+                raise RuntimeError('XTF packet at {} has zero size (file corrupt?)'.format(packet_start_loc))
+
+            try:
+                p_headertype = XTFHeaderType(p_start.HeaderType)
+            except ValueError:
+                p_headertype = XTFHeaderType.unknown
+
+            try:
+                xtf_idx[p_headertype].append(packet_start_loc)
+            except KeyError:
+                xtf_idx[p_headertype] = [packet_start_loc]
+
+            packet_start_loc += p_start.NumBytesThisRecord
+
+    if save_index:
+        _xtf_save_index(path, xtf_idx)
+
+    return xtf_idx
+
+
+def xtf_read_gen(path: Union[str, XTFStorage], types: List[XTFHeaderType]=None, save_index=False,
+                 max_gap: int = 64 * 1024, max_read: int = 16 * 1024 * 1024, prefetch: int = 0,
+                 arena: XTFArena = None) \
                 -> Generator[Union[XTFFileHeader, XTFPacket], None, None]:
     """
     Generator object which iterates over the XTF file, return first the file header and then subsequent packets
-    :param path: The path to the XTF file
+    :param path: The path to the XTF file, or a storage backend (see xtf_storage)
     :param types: Optional list of XTFHeaderTypes to keep. Default (None) returns all types. Can improve performance
     :param save_index: If true, an index file is stored next to the xtf file, improving performance of repeated reads significantly.
+    :param max_gap: With an index, packets separated by at most this many bytes are read with a single read
+    :param max_read: With an index, the maximum number of bytes in a single read (unless a packet is larger)
+    :param prefetch: The number of reads a background thread runs ahead of the decoding (see xtf_prefetch),
+                     0 disables read-ahead. Without an index, the file is read in chunks of max_read bytes
+    :param arena: Optional XTFArena, records are then read into its pooled buffer and the sample arrays are carved
+                  out of its slabs, which avoids most per-packet allocations (see xtf_arena)
     :return: None
     """
     # Read index file if it exists
-    (path_root, _) = splitext(path)
-    path_idx = path_root + '.pyxtf_idx'
-    has_idx = isfile(path_idx)
-    if has_idx:
-        with open(path_idx, 'rb') as f_idx:
-            xtf_idx = pickle.load(f_idx)  # type: Dict[XTFHeaderType, List[int]]
-    else:
+    xtf_idx = _xtf_load_index(path)  # type: Dict[XTFHeaderType, List[int]]
+    has_idx = xtf_idx is not None
+    if not has_idx:
         xtf_idx = {}
 
+    # Constructs the file-like reader of a packet buffer passed to create_from_buffer
+    packet_reader = BufferReader if arena is None else arena.reader
+
     # Read XTF file
-    with open(path, 'rb') as f:
+    with _xtf_open_source(path) as f:
         # Read initial file header
         file_header = XTFFileHeader.create_from_buffer(buffer=f)
 
@@ -73,25 +201,61 @@ def xtf_read_gen(path: str, types: List[XTFHeaderType]=None, save_index=False) \
         # Loop through XTF packets and handle according to type
         if has_idx:
             # Only return packets that matches types arg (if None, return all)
-            for packet_start_loc, p_headertype in xtf_idx_pos_iter(xtf_idx, types):
-                f.seek(packet_start_loc)
-
-                # Get the class associated with this header type (if any)
-                # How to read and construct each type is implemented in the class (default impl. in XTFBase.__new__)
-                p_class = XTFPacketClasses.get(p_headertype, XTFUnknownPacket)
-                p_header = p_class.create_from_buffer(buffer=f, file_header=file_header)
-
-                # Warn on unknown packets
-                if p_class is XTFUnknownPacket:
-                    try:
-                        p_headertype = XTFHeaderType(p_header.HeaderType)
-                        warning_str = 'XTFHeaderType ({}) has no implementation. Returned as XTFUnknownPacket.'.format(p_headertype.name)
-                        warn(warning_str)
-                    except ValueError:
-                        warning_str = 'XTFHeaderType ({}) is not known. Returned as XTFUnknownPacket'.format(p_header.HeaderType)
-                        warn(warning_str)
+            selected = list(xtf_idx_pos_iter(xtf_idx, types))
+
+            # The packet ends at the start of the next packet (of any type) in the index, or at the end of the file
+            all_locs = np.fromiter((loc for loc, _ in xtf_idx_pos_iter(xtf_idx, None)), dtype=np.int64)
+            all_ends = np.append(all_locs[1:], f.seek(0, os.SEEK_END))
+            starts = np.array([loc for loc, _ in selected], dtype=np.int64)
+            ends = all_ends[np.searchsorted(all_locs, starts)].tolist()
+            starts = starts.tolist()
+
+            # Nearby packets are grouped into ranges (of packets i to j), each read with one call
+            groups = []
+            i = 0
+            while i < len(selected):
+                j = i + 1
+                while j < len(selected) and starts[j] - ends[j - 1] <= max_gap and ends[j] - starts[i] <= max_read:
+                    j += 1
+                groups.append((i, j))
+                i = j
+            ranges = [(starts[i], ends[j - 1] - starts[i]) for i, j in groups]
+
+            if prefetch:
+                range_buffers = prefetch_ranges(f, ranges, queue_size=prefetch)
+            else:
+                range_buffers = _xtf_read_ranges(f, ranges)
+
+            with closing(range_buffers):
+                for (i, j), (range_start, view) in zip(groups, range_buffers):
+                    view = memoryview(view)
+                    for (packet_start_loc, p_headertype), packet_end_loc in zip(selected[i:j], ends[i:j]):
+                        packet_view = view[packet_start_loc - range_start:packet_end_loc - range_start]
+
+                        # Get the class associated with this header type (if any)
+                        # How to read and construct each type is implemented in the class (default impl. in XTFBase.__new__)
+                        p_class = XTFPacketClasses.get(p_headertype, XTFUnknownPacket)
+                        p_header = p_class.create_from_buffer(buffer=packet_reader(packet_view), file_header=file_header)
+
+                        # Warn on unknown packets
+                        if p_class is XTFUnknownPacket:
+                            try:
+                                p_headertype = XTFHeaderType(p_header.HeaderType)
+                                warning_str = 'XTFHeaderType ({}) has no implementation. Returned as XTFUnknownPacket.'.format(p_headertype.name)
+                                warn(warning_str)
+                            except ValueError:
+                                warning_str = 'XTFHeaderType ({}) is not known. Returned as XTFUnknownPacket'.format(p_header.HeaderType)
+                                warn(warning_str)
+
+                        yield p_header
+        elif prefetch:
+            # The packets are parsed from large chunks read ahead by a background thread
+            with PrefetchStream(f, chunk_size=max_read, queue_size=prefetch) as stream:
+                yield from _xtf_stream_packets(stream, file_header, types, xtf_idx if save_index else None,
+                                               packet_reader)
 
-                yield p_header
+            if save_index:
+                _xtf_save_index(path, xtf_idx)
         else:
             # Preallocate, as it is assigned to at every iteration
             p_start = XTFPacketStart()
@@ -130,7 +294,15 @@ def xtf_read_gen(path: str, types: List[XTFHeaderType]=None, save_index=False) \
                         warning_str = 'XTFHeaderType ({}) has no implementation. Returned as XTFUnknownPacket.'.format(p_headertype.name)
                         warn(warning_str)
 
-                    p_header = p_class.create_from_buffer(buffer=f, file_header=file_header)
+                    if arena is None:
+                        p_header = p_class.create_from_buffer(buffer=f, file_header=file_header)
+                    else:
+                        # Read the whole record (including padding) into the pooled buffer of the arena
+                        n_bytes = max(p_start.NumBytesThisRecord, ctypes.sizeof(XTFPacketStart))
+                        record = arena.record(n_bytes)
+                        if _read_into(f, record) < n_bytes:
+                            raise RuntimeError('File ended while reading data packets (file corrupt?)')
+                        p_header = p_class.create_from_buffer(buffer=arena.reader(record), file_header=file_header)
 
                     yield p_header
 
@@ -146,21 +318,197 @@ def xtf_read_gen(path: str, types: List[XTFHeaderType]=None, save_index=False) \
 
             if save_index:
                 # Pickle index file
-                with open(path_idx, mode='wb') as f_idx:
-                    pickle.dump(xtf_idx, f_idx)
+                _xtf_save_index(path, xtf_idx)
+
+        return
+
+
+class BufferReader:
+    """
+    Minimal file-like object that reads from a buffer. Returns copies, as the buffer is reused for the next packet.
+    """
+    def __init__(self, buffer):
+        self._view = memoryview(buffer)
+        self._pos = 0
+
+    def read(self, size: int = -1) -> bytes:
+        end = len(self._view) if size is None or size < 0 else min(self._pos + size, len(self._view))
+        data = bytes(self._view[self._pos:end])
+        self._pos = end
+        return data
+
+
+def _read_into(stream, view: memoryview) -> int:
+    """
+    Fills the view from the stream, continuing on short reads (e.g. pipes and sockets).
+    Returns the number of bytes read, which is less than the size of the view only if the stream ended.
+    """
+    n_read = 0
+    while n_read < len(view):
+        if hasattr(stream, 'readinto'):
+            n_bytes = stream.readinto(view[n_read:])
+        else:
+            data = stream.read(len(view) - n_read)
+            n_bytes = len(data)
+            view[n_read:n_read + n_bytes] = data
+        if not n_bytes:
+            break
+        n_read += n_bytes
+    return n_read
+
 
+def xtf_open(path: str) -> IOBase:
+    """
+    Opens an XTF file for reading, decompressing on the fly if it is compressed (.gz, .xz, .lzma or .bz2).
+    :param path: The path to the XTF file
+    :return: Binary file object, only supporting forward reads for compressed files
+    """
+    ext = splitext(path)[1].lower()
+    if ext == '.gz':
+        return gzip.open(path, 'rb')
+    elif ext in ('.xz', '.lzma'):
+        return lzma.open(path, 'rb')
+    elif ext == '.bz2':
+        return bz2.open(path, 'rb')
+    return open(path, 'rb')
+
+
+def xtf_read_stream(stream: Union[str, IOBase], types: List[XTFHeaderType] = None) \
+                    -> Generator[Union[XTFFileHeader, XTFPacket], None, None]:
+    """
+    Generator object which reads the XTF file from a forward-only byte stream (e.g. compressed files, pipes or sockets),
+    returning first the file header and then subsequent packets. The file is never seeked.
+    Each packet (including padding) is read into a single buffer that is reused, so memory use is constant.
+    :param stream: The path to the XTF file (see xtf_open), or a binary file-like object with read or readinto
+    :param types: Optional list of XTFHeaderTypes to keep. Default (None) returns all types
+    :return: None
+    """
+    if isinstance(stream, str):
+        with xtf_open(stream) as f:
+            yield from xtf_read_stream(f, types)
         return
 
+    # Read initial file header
+    file_header_bytes = bytearray(ctypes.sizeof(XTFFileHeader))
+    if _read_into(stream, memoryview(file_header_bytes)) < len(file_header_bytes):
+        raise RuntimeError('XTF file shorter than expected (end hit while reading XTFFileHeader)')
+    file_header = XTFFileHeader.create_from_buffer(buffer=file_header_bytes)
 
-def xtf_read(path: str, types: List[XTFHeaderType] = None) -> Tuple[XTFFileHeader, Dict[XTFHeaderType, List[Any]]]:
+    n_channels = file_header.channel_count()
+    if n_channels > 6:
+        raise NotImplementedError("Support for more than 6 channels not implemented.")
+
+    yield file_header
+
+    yield from _xtf_stream_packets(stream, file_header, types)
+
+
+def _xtf_read_ranges(f, ranges: Iterable[Tuple[int, int]]) -> Generator[Tuple[int, memoryview], None, None]:
+    # Reads each (offset, size) range into a buffer that is reused for the next range
+    buffer = bytearray()
+    for offset, size in ranges:
+        if size > len(buffer):
+            buffer = bytearray(size)
+        view = memoryview(buffer)[:size]
+
+        f.seek(offset)
+        if _read_into(f, view) < size:
+            raise RuntimeError('XTF file shorter than expected while reading packet.')
+        yield offset, view
+
+
+def _xtf_stream_packets(stream, file_header: XTFFileHeader, types: List[XTFHeaderType] = None,
+                        xtf_idx: Dict[XTFHeaderType, List[int]] = None,
+                        packet_reader=BufferReader) -> Generator[XTFPacket, None, None]:
+    """
+    Parses the packets following the file header from a forward-only stream (see xtf_read_stream).
+    If xtf_idx is given, the position of every packet is added to it.
+    The packet_reader constructs the file-like reader of each packet buffer (e.g. XTFArena.reader).
+    """
+    # The buffer is grown to fit the largest packet
+    packet_buffer = bytearray(64 * 1024)
+    n_start = ctypes.sizeof(XTFPacketStart)
+    packet_start_loc = ctypes.sizeof(XTFFileHeader)
+
+    while True:
+        view = memoryview(packet_buffer)
+        bytes_read = _read_into(stream, view[:n_start])
+        if bytes_read == 0:
+            break
+        if bytes_read < n_start:
+            raise RuntimeError('XTF file shorter than expected while reading packet.')
+
+        p_start = XTFPacketStart.from_buffer_copy(packet_buffer)
+        n_bytes = p_start.NumBytesThisRecord
+        if n_bytes < n_start:
+            raise RuntimeError('XTF packet has invalid size ({} bytes, file corrupt?)'.format(n_bytes))
+
+        try:
+            p_headertype = XTFHeaderType(p_start.HeaderType)
+        except ValueError:
+            p_headertype = XTFHeaderType.unknown
+
+        if xtf_idx is not None:
+            try:
+                xtf_idx[p_headertype].append(packet_start_loc)
+            except KeyError:
+                xtf_idx[p_headertype] = [packet_start_loc]
+        packet_start_loc += n_bytes
+
+        if types and p_headertype not in types:
+            # Skip the packet by reading past it (in chunks the size of the buffer)
+            n_remaining = n_bytes - n_start
+            while n_remaining > 0:
+                n_chunk = min(n_remaining, len(view))
+                if _read_into(stream, view[:n_chunk]) < n_chunk:
+                    raise RuntimeError('XTF file shorter than expected while reading packet.')
+                n_remaining -= n_chunk
+            continue
+
+        if n_bytes > len(packet_buffer):
+            view.release()
+            packet_buffer.extend(bytes(max(n_bytes, 2 * len(packet_buffer)) - len(packet_buffer)))
+            view = memoryview(packet_buffer)
+
+        # Read the rest of the packet, including any padding
+        if _read_into(stream, view[n_start:n_bytes]) < n_bytes - n_start:
+            raise RuntimeError('File ended while reading data packets (file corrupt?)')
+
+        # Get the class associated with this header type (if any), else use XTFUnknownPacket
+        p_class = XTFPacketClasses.get(p_headertype, XTFUnknownPacket)
+
+        # Warn on unknown packets or missing implementations
+        if p_headertype == XTFHeaderType.unknown:
+            warn('XTFHeaderType ({}) is not known. Returned as XTFUnknownPacket'.format(p_start.HeaderType))
+        elif p_class is XTFUnknownPacket:
+            warn('XTFHeaderType ({}) has no implementation. Returned as XTFUnknownPacket.'.format(p_headertype.name))
+
+        yield p_class.create_from_buffer(buffer=packet_reader(view[:n_bytes]), file_header=file_header)
+        view.release()
+
+
+def xtf_read(path: Union[str, XTFStorage], types: List[XTFHeaderType] = None, columnar: bool = False,
+             max_memory: int = None, spill_dir: str = None) -> Tuple[XTFFileHeader, Dict[XTFHeaderType, List[Any]]]:
     """
     Wrapper around the read generator object, which sorts the packet types into a dictionary
     :param path: The path of the XTF file
     :param types: Optional list of XTFHeaderTypes to keep. Default (None) returns all types. Can improve performance
+    :param columnar: If true, each packet type is returned as a PacketTable (columns of the packet headers and a
+                     buffer of the data following them) instead of a list of packet objects. PacketTable.objects()
+                     gives the packet objects, constructed when accessed
+    :param max_memory: Optional number of bytes of sample data (or PacketTable data) kept in memory, the rest is
+                       placed in memory-mapped temporary files, which are deleted when the arrays are released.
+                       Default (None) keeps all data in memory
+    :param spill_dir: The directory of the temporary files, None for the default (see tempfile.gettempdir)
     :return:
     """
+    arena = None if max_memory is None else XTFSpillArena(max_memory, spill_dir)
+
+    if columnar:
+        return _xtf_read_columnar(path, types, arena)
+
     # Intialize generator and read file header (first item)
-    gen = xtf_read_gen(path, types)
+    gen = xtf_read_gen(path, types, arena=arena)
     file_header = next(gen)
 
     # Loop through XTF packets, sort into dict
@@ -178,6 +526,249 @@ def xtf_read(path: str, types: List[XTFHeaderType] = None) -> Tuple[XTFFileHeade
     return file_header, packets
 
 
+def _xtf_read_columnar(path: Union[str, XTFStorage], types: List[XTFHeaderType] = None, arena: XTFArena = None) \
+        -> Tuple[XTFFileHeader, Dict[XTFHeaderType, PacketTable]]:
+    """
+    Reads the packets of each type into a PacketTable, gathering the headers of all packets with numpy indexing.
+    If an arena is given, the payload buffers are allocated from it (e.g. to spill to disk, see XTFSpillArena).
+    """
+    xtf_idx = xtf_read_index(path)
+
+    if isinstance(path, XTFStorage):
+        raw = np.frombuffer(path.read_range(0, path.size()), dtype=np.uint8)
+    else:
+        raw = np.memmap(path, dtype=np.uint8, mode='r')
+    file_header = _xtf_file_header(raw)
+
+    (all_locs, all_ends) = _xtf_packet_ends(xtf_idx, len(raw))
+
+    packets = {}  # type: Dict[XTFHeaderType, PacketTable]
+    for p_headertype, locs in xtf_idx.items():
+        if types and p_headertype not in types:
+            continue
+
+        locs = np.array(locs, dtype=np.int64)
+        ends = all_ends[np.searchsorted(all_locs, locs)]
+        packets[p_headertype] = _xtf_packet_table(raw, locs, ends, locs, p_headertype, file_header, arena)
+
+    return file_header, packets
+
+
+def xtf_read_batches(path: Union[str, XTFStorage], types: List[XTFHeaderType] = None, batch_size: int = 4096,
+                     max_gap: int = 64 * 1024) -> Generator[PacketTable, None, None]:
+    """
+    Generator of batches of up to batch_size packets of one type, as PacketTables (see xtf_read with columnar=True).
+    The packets of a batch are gathered with numpy indexing, so the Python overhead is per batch rather than per packet,
+    and only one batch is held in memory at a time. The batches are returned in the order they are completed when
+    going through the file, and the packets of each type are in file order. The file header is in each PacketTable.
+    :param path: The path to the XTF file, or a storage backend (see xtf_storage)
+    :param types: Optional list of XTFHeaderTypes to keep. Default (None) returns all types
+    :param batch_size: The maximum number of packets in a batch
+    :param max_gap: With a storage backend, packets separated by at most this many bytes are read with a single read
+    :return: None
+    """
+    xtf_idx = xtf_read_index(path)
+
+    if isinstance(path, XTFStorage):
+        file_size = path.size()
+        file_header = _xtf_file_header(np.frombuffer(path.read_range(0, ctypes.sizeof(XTFFileHeader)), dtype=np.uint8))
+        raw = None
+    else:
+        raw = np.memmap(path, dtype=np.uint8, mode='r')
+        file_size = len(raw)
+        file_header = _xtf_file_header(raw)
+
+    (all_locs, all_ends) = _xtf_packet_ends(xtf_idx, file_size)
+
+    # Split the packets of each type into batches, ordered by their last packet
+    batches = []
+    for p_headertype, locs in xtf_idx.items():
+        if types and p_headertype not in types:
+            continue
+        locs = np.array(locs, dtype=np.int64)
+        for i in range(0, len(locs), batch_size):
+            batches.append((locs[min(i + batch_size, len(locs)) - 1], p_headertype, locs[i:i + batch_size]))
+    batches.sort(key=lambda batch: batch[0])
+
+    for _, p_headertype, locs in batches:
+        ends = all_ends[np.searchsorted(all_locs, locs)]
+        if raw is not None:
+            yield _xtf_packet_table(raw, locs, ends, locs, p_headertype, file_header)
+            continue
+
+        # Only the packets of the batch are read (nearby packets with a single read) into a compact buffer
+        groups = []
+        i = 0
+        while i < len(locs):
+            j = i + 1
+            while j < len(locs) and locs[j] - ends[j - 1] <= max_gap:
+                j += 1
+            groups.append((i, j))
+            i = j
+
+        # The ranges of the batch are requested together, so that a CachedStorage fetches their blocks coalesced
+        pieces = path.read_ranges([(int(locs[i]), int(ends[j - 1] - locs[i])) for i, j in groups])
+        positions = np.empty(len(locs), dtype=np.int64)
+        n_bytes = 0
+        for (i, j), piece in zip(groups, pieces):
+            positions[i:j] = n_bytes + locs[i:j] - locs[i]
+            n_bytes += len(piece)
+
+        data = np.frombuffer(b''.join(pieces), dtype=np.uint8)
+        yield _xtf_packet_table(data, positions, positions + (ends - locs), locs, p_headertype, file_header)
+
+
+xtf_scan_dtype = np.dtype([
+    ('offset', '<i8'),  # Position of the packet in the file
+    ('size', '<u4'),  # NumBytesThisRecord
+    ('type', '<u1'),  # The header type as stored in the packet
+    ('time', '<M8[us]')  # NaT for packets without time fields (or if with_time is false)
+])
+
+
+def xtf_scan(path: str, with_time: bool = False) -> np.ndarray:
+    """
+    Returns the position, size, header type and (optionally) time of every packet in file order, without decoding
+    the packets. The packet headers are gathered from a memory map of the file with numpy indexing, one type at a time.
+    :param path: The path to the XTF file
+    :param with_time: If true, the time of each packet is calculated from its header (see XTFPacket.get_time)
+    :return: Array of xtf_scan_dtype
+    """
+    xtf_idx = xtf_read_index(path)
+    raw = np.memmap(path, dtype=np.uint8, mode='r')
+    (all_locs, _) = _xtf_packet_ends(xtf_idx, len(raw))
+
+    packets = np.zeros(len(all_locs), dtype=xtf_scan_dtype)
+    packets['offset'] = all_locs
+    packets['time'] = np.datetime64('NaT')
+    for p_headertype, locs in xtf_idx.items():
+        locs = np.array(locs, dtype=np.int64)
+        rows = np.searchsorted(all_locs, locs)
+
+        # NumBytesThisRecord and HeaderType are located at the same position in all packet types
+        headers = _xtf_gather_headers(raw, locs, XTFPacketStart)
+        packets['size'][rows] = headers['NumBytesThisRecord']
+        packets['type'][rows] = headers['HeaderType']
+
+        p_class = XTFPacketClasses.get(p_headertype, XTFUnknownPacket)
+        if with_time and 'Year' in p_class.np_dtype().names:
+            # Packets too short to hold the full header have no time
+            fits = locs + ctypes.sizeof(p_class) <= len(raw)
+            packets['time'][rows[fits]] = _xtf_packet_times(_xtf_gather_headers(raw, locs[fits], p_class))
+
+    return packets
+
+
+def _xtf_file_header(raw: np.ndarray) -> XTFFileHeader:
+    n_file_header = ctypes.sizeof(XTFFileHeader)
+    if len(raw) < n_file_header:
+        raise RuntimeError('XTF file shorter than expected (end hit while reading XTFFileHeader)')
+    return XTFFileHeader.create_from_buffer(buffer=raw[:n_file_header].tobytes())
+
+
+def _xtf_packet_ends(xtf_idx: Dict[XTFHeaderType, List[int]], file_size: int) -> Tuple[np.ndarray, np.ndarray]:
+    # The packet ends at the start of the next packet (of any type) in the index, or at the end of the file
+    all_locs = np.fromiter((loc for loc, _ in xtf_idx_pos_iter(xtf_idx, None)), dtype=np.int64)
+    return all_locs, np.append(all_locs[1:], file_size)
+
+
+def _xtf_gather_headers(data: np.ndarray, positions: np.ndarray, p_class: type) -> np.ndarray:
+    """
+    Gathers the headers of packets of one class from data (uint8), as an array of the packed structured dtype.
+    :param positions: The position of each packet in data
+    """
+    n_header = ctypes.sizeof(p_class)
+    if np.any(positions + n_header > len(data)):
+        raise RuntimeError('XTF file shorter than expected while reading packet.')
+
+    # Gather the headers of all packets as rows of n_header bytes, and view them as the packed structured dtype.
+    # Evenly spaced packets are copied from a strided view, others are indexed by row in a view with a row starting
+    # at every byte (an index per packet rather than per byte)
+    steps = np.diff(positions)
+    if len(positions) > 1 and np.all(steps == steps[0]) and steps[0] > 0:
+        rows = np.lib.stride_tricks.as_strided(data[positions[0]:], shape=(len(positions), n_header),
+                                               strides=(int(steps[0]), 1), writeable=False)
+        headers = rows.copy()
+    elif len(positions):
+        rows = np.lib.stride_tricks.as_strided(data, shape=(len(data) - n_header + 1, n_header), strides=(1, 1),
+                                               writeable=False)
+        headers = rows[positions]
+    else:
+        headers = np.empty((0, n_header), dtype=np.uint8)
+    return headers.view(p_class.np_dtype()).reshape(-1)
+
+
+def _xtf_packet_times(headers: np.ndarray) -> np.ndarray:
+    """
+    Calculates the time of packets from their header fields (see XTFPacket.get_time) as datetime64[us].
+    Packets without time fields, or with an invalid date, get NaT.
+    """
+    names = headers.dtype.names
+    times = np.full(len(headers), np.datetime64('NaT'), dtype='datetime64[us]')
+    if 'Year' not in names:
+        return times
+
+    year = headers['Year'].astype(np.int64)
+    month = headers['Month'].astype(np.int64)
+    day = headers['Day'].astype(np.int64)
+    valid = (year >= 1) & (year <= 9999) & (month >= 1) & (month <= 12) & (day >= 1)
+
+    # The day must be within the month (datetime.date raises ValueError for e.g. February 30)
+    month_start = np.where(valid, year - 1970, 0).astype('datetime64[Y]').astype('datetime64[M]') + \
+        np.where(valid, month - 1, 0)
+    date = month_start.astype('datetime64[D]') + np.where(valid, day - 1, 0)
+    valid &= date < (month_start + 1).astype('datetime64[D]')
+
+    times = date.astype('datetime64[us]') + \
+        headers['Hour'].astype(np.int64) * np.timedelta64(3600, 's') + \
+        headers['Minute'].astype(np.int64) * np.timedelta64(60, 's') + \
+        headers['Second'].astype(np.int64) * np.timedelta64(1, 's')
+    if 'HSeconds' in names:
+        times += headers['HSeconds'].astype(np.int64) * np.timedelta64(10, 'ms')
+    else:
+        if 'Millisecond' in names:
+            times += headers['Millisecond'].astype(np.int64) * np.timedelta64(1, 'ms')
+        if 'Microsecond' in names:
+            times += headers['Microsecond'].astype(np.int64) * np.timedelta64(1, 'us')
+    times[~valid] = np.datetime64('NaT')
+
+    # A non-zero epoch time takes precedence over the date fields
+    if 'SourceEpoch' in names:
+        epoch_times = headers['SourceEpoch'].astype(np.int64).astype('datetime64[s]').astype('datetime64[us]')
+        if 'EpochMicroseconds' in names:
+            epoch_times += headers['EpochMicroseconds'].astype(np.int64) * np.timedelta64(1, 'us')
+        times = np.where(headers['SourceEpoch'] != 0, epoch_times, times)
+
+    return times
+
+
+def _xtf_packet_table(data: np.ndarray, positions: np.ndarray, limits: np.ndarray, locs: np.ndarray,
+                      p_headertype: XTFHeaderType, file_header: XTFFileHeader, arena: XTFArena = None) -> PacketTable:
+    """
+    Gathers packets of one type from data (uint8) into a PacketTable.
+    :param positions: The position of each packet in data
+    :param limits: The position in data where each packet ends at the latest (the start of the next packet)
+    :param locs: The position of each packet in the file
+    """
+    p_class = XTFPacketClasses.get(p_headertype, XTFUnknownPacket)
+    n_header = ctypes.sizeof(p_class)
+    headers = _xtf_gather_headers(data, positions, p_class)
+
+    # The data following the header, up to the end of the packet (as given by NumBytesThisRecord)
+    starts = positions + n_header
+    ends = np.minimum(positions + headers['NumBytesThisRecord'].astype(np.int64), np.minimum(limits, len(data)))
+    counts = np.maximum(ends - starts, 0)
+    offsets = np.zeros(len(positions) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+
+    payload = np.empty(offsets[-1], dtype=np.uint8) if arena is None else arena.allocate(int(offsets[-1]))
+    for start, offset, count in zip(starts[counts > 0], offsets[:-1][counts > 0], counts[counts > 0]):
+        payload[offset:offset + count] = data[start:start + count]
+
+    return PacketTable(file_header=file_header, header_type=p_headertype, packet_class=p_class,
+                       headers=headers, offsets=offsets, payload=payload, locations=locs)
+
+
 def concatenate_channel(
         pings: List[XTFPingHeader],
         file_header: XTFFileHeader,
@@ -203,9 +794,9 @@ def concatenate_channel(
         out_array = np.vstack([ping.data[channel] for ping in pings[::-1]])
     else:
         # Get type of this channel
-        chan_type = file_header.ChanInfo[pings[0].ping_chan_headers[channel].ChannelNumber].TypeOfChannel
+        chan_type = file_header.channel_info(pings[0].ping_chan_headers[channel], channel).TypeOfChannel
 
-        out_array = np.empty(shape=(len(pings), max_sz), dtype=pings[0].data[0].dtype)
+        out_array = np.empty(shape=(len(pings), max_sz), dtype=pings[0].data[channel].dtype)
         for i, ping in enumerate(pings[::-1]):
             sz = ping.data[channel].shape[0]
 
@@ -0,0 +1,148 @@
+"""
+Read-ahead of XTF files in a background thread, so that reading (waiting on the disk or network) overlaps with
+decoding the packets. The thread fills a bounded queue of buffers, which limits the memory used.
+"""
+
+import queue
+import threading
+from typing import Generator, Iterable, Tuple
+
+
+class _PrefetchThread:
+    """
+    Background thread that reads into buffers and passes them through a bounded queue.
+    The reader function is called with the stop event, and returns an iterator of items to put in the queue.
+    An exception raised in the thread is passed on, and raised when the item is received.
+    """
+    _end = object()
+
+    def __init__(self, reader, queue_size: int):
+        self._queue = queue.Queue(maxsize=max(1, queue_size))
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(reader,), daemon=True)
+        self._thread.start()
+
+    def _put(self, item) -> bool:
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _run(self, reader):
+        try:
+            for item in reader(self._stop):
+                if not self._put(item):
+                    return
+            self._put(self._end)
+        except BaseException as e:
+            self._put(e)
+
+    def get(self):
+        """
+        Returns the next item, or None when the reader is exhausted.
+        """
+        item = self._queue.get()
+        if item is self._end:
+            self._queue.put(item)  # Following calls also return None
+            return None
+        if isinstance(item, BaseException):
+            raise item
+        return item
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+
+
+class PrefetchStream:
+    """
+    Forward-only file object that reads the underlying file in large chunks in a background thread.
+    Used with xtf_read_stream, or by xtf_read_gen (prefetch=True) for files without an index.
+    """
+    def __init__(self, f, chunk_size: int = 4 * 1024 * 1024, queue_size: int = 4):
+        """
+        :param f: The binary file object to read from (from its current position)
+        :param chunk_size: The number of bytes in each read
+        :param queue_size: The maximum number of chunks read ahead
+        """
+        self.chunk_size = chunk_size
+
+        def reader(stop: threading.Event):
+            while not stop.is_set():
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    return
+                yield chunk
+
+        self._thread = _PrefetchThread(reader, queue_size)
+        self._chunk = memoryview(b'')
+        self._chunk_pos = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        """
+        Stops the background thread. The underlying file is not closed.
+        """
+        self._thread.close()
+
+    def readinto(self, buffer) -> int:
+        view = memoryview(buffer).cast('B')
+        if self._chunk_pos >= len(self._chunk):
+            chunk = self._thread.get()
+            if chunk is None:
+                return 0
+            self._chunk, self._chunk_pos = memoryview(chunk), 0
+
+        n_bytes = min(len(view), len(self._chunk) - self._chunk_pos)
+        view[:n_bytes] = self._chunk[self._chunk_pos:self._chunk_pos + n_bytes]
+        self._chunk_pos += n_bytes
+        return n_bytes
+
+    def read(self, size: int = -1) -> bytes:
+        out = bytearray()
+        while size is None or size < 0 or len(out) < size:
+            n_chunk = self.chunk_size if size is None or size < 0 else size - len(out)
+            data = bytearray(n_chunk)
+            n_bytes = self.readinto(data)
+            if not n_bytes:
+                break
+            out += data[:n_bytes]
+        return bytes(out)
+
+
+def prefetch_ranges(f, ranges: Iterable[Tuple[int, int]], queue_size: int = 4) \
+        -> Generator[Tuple[int, bytearray], None, None]:
+    """
+    Generator of the (offset, size) ranges of the file, read by a background thread ahead of the consumer.
+    :param f: The binary file object to read from (not to be used by the caller until the generator is closed)
+    :param ranges: The ranges to read, in the order they are consumed
+    :param queue_size: The maximum number of ranges read ahead
+    :return: Tuples of (offset, buffer)
+    """
+    def reader(stop: threading.Event):
+        for offset, size in ranges:
+            if stop.is_set():
+                return
+            f.seek(offset)
+            buffer = f.read(size)
+            if len(buffer) < size:
+                raise RuntimeError('XTF file shorter than expected while reading packet.')
+            yield offset, buffer
+
+    thread = _PrefetchThread(reader, queue_size)
+    try:
+        while True:
+            item = thread.get()
+            if item is None:
+                return
+            yield item
+    finally:
+        thread.close()
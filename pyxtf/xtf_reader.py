@@ -0,0 +1,246 @@
+"""
+Random access to the packets of an XTF file, safe to share between threads.
+"""
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import ctypes
+import threading
+from typing import Dict, List, Sequence, Tuple, Union
+from warnings import warn
+
+import numpy as np
+
+from pyxtf.enumerations import XTFHeaderType
+from pyxtf.xtf_ctypes import XTFFileHeader, XTFPacket, XTFPacketClasses, XTFUnknownPacket
+from pyxtf.xtf_io import BufferReader, xtf_idx_pos_iter, xtf_read_index
+from pyxtf.xtf_storage import XTFStorage, LocalStorage, MmapStorage
+
+
+class XTFReader:
+    """
+    Reader handle for random access to the packets of an XTF file, located through the packet index.
+    Each packet is read with a single positional read (os.pread) or from a memory map, so there is no shared file
+    position, and many threads can read and decode packets through the same handle at once.
+    Decoded packets can be kept in an LRU cache limited by a byte budget (e.g. for a waterfall viewer scrolling back
+    and forth), optionally reading ahead in the direction of consecutive reads. Cached packets are shared between
+    reads, and should not be modified.
+    Usage:
+        with XTFReader(path, cache_bytes=256 * 1024 ** 2, read_ahead=32) as reader:
+            ping = reader.read(XTFHeaderType.sonar, 10)
+    """
+    def __init__(self, path: Union[str, XTFStorage], use_mmap: bool = False, save_index: bool = False,
+                 cache_bytes: int = 0, read_ahead: int = 0):
+        """
+        :param path: The path to the XTF file, or a storage backend (see xtf_storage)
+        :param use_mmap: If true, the file is read through a memory map instead of positional reads
+        :param save_index: If true, the index is stored next to the xtf file if it had to be built
+        :param cache_bytes: The size of the decoded packet cache (counted as the size of the packets in the file),
+                            0 disables the cache
+        :param read_ahead: The number of packets (of the same type) decoded ahead by a background thread in the
+                           direction of the last two reads (see read), 0 disables read-ahead. Requires the cache
+        """
+        self._own_storage = not isinstance(path, XTFStorage)
+        if self._own_storage:
+            self.storage = MmapStorage(path) if use_mmap else LocalStorage(path)
+        else:
+            self.storage = path
+
+        # Opens the file before the handle is shared between threads
+        file_size = self.storage.size()
+
+        self.file_header = XTFFileHeader.create_from_buffer(
+            buffer=self.storage.read_range(0, ctypes.sizeof(XTFFileHeader)))
+        if self.file_header.channel_count() > 6:
+            raise NotImplementedError("Support for more than 6 channels not implemented.")
+
+        self.index = xtf_read_index(self.storage, save_index=save_index)  # type: Dict[XTFHeaderType, List[int]]
+        self.offsets = {key: np.array(val, dtype=np.int64) for key, val in self.index.items()}
+
+        # The packet ends at the start of the next packet (of any type), or at the end of the file
+        self._locs = np.fromiter((loc for loc, _ in xtf_idx_pos_iter(self.index, None)), dtype=np.int64)
+        self._ends = np.append(self._locs[1:], file_size)
+
+        self.cache_bytes = cache_bytes
+        self.read_ahead = read_ahead
+        self.hits = 0
+        self.misses = 0
+        self.n_read_ahead = 0
+        self._cache = OrderedDict()  # Offset -> (packet, size), in order of use (least recently used first)
+        self._cache_size = 0
+        self._cache_lock = threading.Lock()
+        self._last_read = {}  # type: Dict[XTFHeaderType, int]
+        self._pending = {}  # type: Dict[int, threading.Event]  # Offsets being read ahead, set when done
+        self._executor = ThreadPoolExecutor(max_workers=1) if read_ahead > 0 and cache_bytes > 0 else None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        with self._cache_lock:
+            executor = self._executor
+            self._executor = None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+        # A storage passed by the caller is left open
+        if self._own_storage:
+            self.storage.close()
+
+    @property
+    def cache_size(self) -> int:
+        """
+        The number of bytes of the packets in the cache.
+        """
+        return self._cache_size
+
+    def clear_cache(self):
+        with self._cache_lock:
+            self._cache.clear()
+            self._cache_size = 0
+
+    def count(self, header_type: XTFHeaderType) -> int:
+        """
+        Returns the number of packets of the given type.
+        """
+        return len(self.offsets.get(header_type, ()))
+
+    def packet_size(self, offset: int) -> int:
+        """
+        Returns the number of bytes from the packet at offset to the next packet.
+        """
+        i = np.searchsorted(self._locs, offset)
+        if i >= len(self._locs) or self._locs[i] != offset:
+            raise RuntimeError('No packet starts at {} in the index.'.format(offset))
+        return int(self._ends[i] - offset)
+
+    def read_at(self, offset: int) -> XTFPacket:
+        """
+        Reads and decodes the packet starting at the given file position (from the index).
+        :param offset: The file position of the packet
+        :return: The packet
+        """
+        if self.cache_bytes <= 0:
+            return self._read(offset)[0]
+
+        with self._cache_lock:
+            packet = self._cache_lookup(offset)
+            pending = self._pending.get(offset) if packet is None else None
+
+        if pending is not None:
+            # The packet is being read ahead, wait for that read instead of reading it again
+            pending.wait()
+            with self._cache_lock:
+                packet = self._cache_lookup(offset)
+
+        if packet is not None:
+            return packet
+
+        with self._cache_lock:
+            self.misses += 1
+        (packet, size) = self._read(offset)
+        self._cache_put(offset, packet, size)
+        return packet
+
+    def read(self, header_type: XTFHeaderType, i: int) -> XTFPacket:
+        """
+        Reads and decodes the i-th packet of the given type.
+        :param header_type: The packet type
+        :param i: The packet number (within the type, in file order)
+        :return: The packet
+        """
+        offsets = self.offsets[header_type]
+        if i < 0:
+            i += len(offsets)
+        packet = self.read_at(int(offsets[i]))
+
+        if self._executor is not None:
+            # Read ahead in the direction from the previous packet read of this type
+            with self._cache_lock:
+                last_i = self._last_read.get(header_type)
+                self._last_read[header_type] = i
+            if last_i is not None and last_i != i:
+                step = 1 if i > last_i else -1
+                ahead = range(i + step, i + step * (self.read_ahead + 1), step)
+                self._start_read_ahead([int(offsets[j]) for j in ahead if 0 <= j < len(offsets)])
+
+        return packet
+
+    def read_many(self, header_type: XTFHeaderType, indices: Sequence[int]) -> List[XTFPacket]:
+        """
+        Reads and decodes several packets of the given type.
+        """
+        return [self.read(header_type, i) for i in indices]
+
+    def _read(self, offset: int) -> Tuple[XTFPacket, int]:
+        size = self.packet_size(offset)
+        packet_bytes = self.storage.read_range(offset, size)
+        if len(packet_bytes) < size:
+            raise RuntimeError('XTF file shorter than expected while reading packet.')
+        return self._decode(packet_bytes), size
+
+    def _cache_lookup(self, offset: int) -> Union[XTFPacket, None]:
+        # Called with the cache lock held
+        item = self._cache.get(offset)
+        if item is None:
+            return None
+        self._cache.move_to_end(offset)
+        self.hits += 1
+        return item[0]
+
+    def _cache_put(self, offset: int, packet: XTFPacket, size: int):
+        if size > self.cache_bytes:
+            return
+
+        with self._cache_lock:
+            if offset in self._cache:
+                return
+            self._cache[offset] = (packet, size)
+            self._cache_size += size
+
+            # Remove least recently used packets until the cache is within its budget
+            while self._cache_size > self.cache_bytes:
+                (_, (_, evicted_size)) = self._cache.popitem(last=False)
+                self._cache_size -= evicted_size
+
+    def _start_read_ahead(self, offsets: List[int]):
+        with self._cache_lock:
+            if self._executor is None:
+                return  # Closed
+            offsets = [offset for offset in offsets if offset not in self._cache and offset not in self._pending]
+            if not offsets:
+                return
+            for offset in offsets:
+                self._pending[offset] = threading.Event()
+            self._executor.submit(self._read_ahead, offsets)
+
+    def _read_ahead(self, offsets: List[int]):
+        # Errors are not raised here, but when the packet is read
+        for offset in offsets:
+            try:
+                (packet, size) = self._read(offset)
+                self._cache_put(offset, packet, size)
+                with self._cache_lock:
+                    self.n_read_ahead += 1
+            except Exception:
+                pass
+            finally:
+                with self._cache_lock:
+                    self._pending.pop(offset).set()
+
+    def _decode(self, packet_bytes: bytes) -> XTFPacket:
+        try:
+            p_headertype = XTFHeaderType(packet_bytes[2])
+        except ValueError:
+            p_headertype = XTFHeaderType.unknown
+
+        p_class = XTFPacketClasses.get(p_headertype, XTFUnknownPacket)
+        if p_headertype == XTFHeaderType.unknown:
+            warn('XTFHeaderType ({}) is not known. Returned as XTFUnknownPacket'.format(packet_bytes[2]))
+        elif p_class is XTFUnknownPacket:
+            warn('XTFHeaderType ({}) has no implementation. Returned as XTFUnknownPacket.'.format(p_headertype.name))
+
+        return p_class.create_from_buffer(buffer=BufferReader(packet_bytes), file_header=self.file_header)
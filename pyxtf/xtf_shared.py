@@ -0,0 +1,203 @@
+"""
+Publication of decoded sonar waterfalls in named shared memory, so that several processes can use the same decoded
+file without decoding it again. The publishing process creates the segments and passes a small descriptor (a JSON
+compatible dict) to the other processes, which attach to the segments without copying.
+The segments exist until they are unlinked by the publisher, regardless of the processes using them.
+"""
+
+import os
+import secrets
+from typing import List
+
+import numpy as np
+
+from pyxtf.xtf_ctypes import XTFFileHeader, XTFPingHeader, XTFPingChanHeader
+from pyxtf.xtf_table import PingTable
+
+try:
+    from multiprocessing import shared_memory, resource_tracker
+except ImportError:  # Python < 3.8
+    shared_memory = None
+
+
+def _tracker_id():
+    """
+    Identifies the resource tracker of this process, which child processes share with their parent (the pipe to the
+    tracker is inherited). None where segments are not tracked.
+    """
+    if not getattr(shared_memory, '_USE_POSIX', False):
+        return None
+    stat = os.fstat(resource_tracker.getfd())
+    return [stat.st_dev, stat.st_ino]
+
+
+def _attach_segment(name: str, tracker=None):
+    """
+    Opens an existing segment without leaving it registered with the resource tracker, which would otherwise remove the
+    segment (owned by the publisher) when this process exits.
+    :param name: The segment name
+    :param tracker: The resource tracker of the publisher (see _tracker_id)
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:  # Python < 3.13 registers every segment opened
+        pass
+
+    segment = shared_memory.SharedMemory(name=name)
+
+    # A tracker shared with the publisher already has the segment registered (by the publisher, who unlinks it),
+    # unregistering it here would remove that registration
+    tracker_id = _tracker_id()
+    if tracker_id is not None and tracker_id != tracker:
+        resource_tracker.unregister(segment._name, 'shared_memory')
+    return segment
+
+
+class XTFSharedWaterfall:
+    """
+    The waterfall images (one dense array per channel) and the ping header columns of a PingTable, in named shared
+    memory segments.
+    Usage:
+        # Publishing process
+        shared = XTFSharedWaterfall.publish(pings)
+        send_to_workers(shared.descriptor)
+        ...
+        shared.close()
+        shared.unlink()  # When all workers are done
+
+        # Worker process
+        with XTFSharedWaterfall.attach(descriptor) as shared:
+            image = shared.waterfall(0)
+            slant_range = shared.chan_headers[:, 0]['SlantRange']
+    The arrays are views of the shared memory, and must be released before close().
+    """
+    def __init__(self, descriptor: dict, segments: list, owner: bool):
+        self.descriptor = descriptor
+        self.owner = owner
+        self._segments = segments
+        self._owned_segments = segments if owner else []
+
+        arrays = {}
+        for (name, (_, dtype, shape)), segment in zip(descriptor['arrays'].items(), segments):
+            n_bytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+            arrays[name] = np.frombuffer(segment.buf, dtype=np.uint8, count=n_bytes)
+
+        self.file_header = XTFFileHeader.create_from_buffer(buffer=arrays['file_header'].tobytes())
+        self.headers = arrays['headers'].view(XTFPingHeader.np_dtype())  # type: np.ndarray
+        self.chan_headers = arrays['chan_headers'].view(XTFPingChanHeader.np_dtype()).reshape(
+            len(self.headers), descriptor['n_channels'])  # type: np.ndarray
+        self.waterfalls = []  # type: List[np.ndarray]
+        for c in range(descriptor['n_channels']):
+            (_, dtype, shape) = descriptor['arrays']['waterfall_{}'.format(c)]
+            self.waterfalls.append(arrays['waterfall_{}'.format(c)].view(dtype).reshape(shape))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        if self.owner:
+            self.unlink()
+
+    def __len__(self):
+        return len(self.headers)
+
+    def __getitem__(self, key: str) -> np.ndarray:
+        """
+        Returns a column of the ping headers.
+        """
+        return self.headers[key]
+
+    def waterfall(self, channel: int) -> np.ndarray:
+        """
+        Returns the dense waterfall image (pings, samples) of a channel (see PingTable.waterfall).
+        """
+        return self.waterfalls[channel]
+
+    @classmethod
+    def publish(cls, pings: PingTable, prefix: str = None) -> 'XTFSharedWaterfall':
+        """
+        Copies the waterfalls and ping headers of a PingTable into new shared memory segments.
+        :param pings: The sonar pings (see concatenate_pings)
+        :param prefix: The prefix of the segment names, a random name by default
+        :return: XTFSharedWaterfall, owning the segments (see unlink)
+        """
+        if shared_memory is None:
+            raise RuntimeError('Shared memory requires Python 3.8 or newer.')
+        if prefix is None:
+            prefix = 'xtf' + secrets.token_hex(6)
+
+        arrays = {'file_header': np.frombuffer(bytes(pings.file_header), dtype=np.uint8),
+                  'headers': pings.headers,
+                  'chan_headers': pings.chan_headers}
+        for c in range(pings.n_channels):
+            arrays['waterfall_{}'.format(c)] = pings.waterfall(c)
+
+        descriptor = {'n_channels': pings.n_channels, 'tracker': _tracker_id(), 'arrays': {}}
+        segments = []
+        try:
+            for name, array in arrays.items():
+                # Segments can not be empty
+                segment = shared_memory.SharedMemory(name='{}_{}'.format(prefix, name), create=True,
+                                                     size=max(array.nbytes, 1))
+                segments.append(segment)
+                segment.buf[:array.nbytes] = np.ascontiguousarray(array).view(np.uint8).reshape(-1)
+                descriptor['arrays'][name] = [segment.name, array.dtype.str, list(array.shape)]
+        except BaseException:
+            for segment in segments:
+                segment.close()
+                segment.unlink()
+            raise
+
+        return cls(descriptor, segments, owner=True)
+
+    @classmethod
+    def attach(cls, descriptor: dict) -> 'XTFSharedWaterfall':
+        """
+        Attaches to the segments published by another process.
+        :param descriptor: The descriptor of the published waterfall (XTFSharedWaterfall.descriptor)
+        :return: XTFSharedWaterfall, not owning the segments
+        """
+        if shared_memory is None:
+            raise RuntimeError('Shared memory requires Python 3.8 or newer.')
+
+        segments = []
+        try:
+            for segment_name, _, _ in descriptor['arrays'].values():
+                segments.append(_attach_segment(segment_name, descriptor.get('tracker')))
+        except BaseException:
+            for segment in segments:
+                segment.close()
+            raise
+
+        return cls(descriptor, segments, owner=False)
+
+    def close(self):
+        """
+        Closes the shared memory in this process. All arrays from this object must be released first.
+        """
+        self.headers = self.chan_headers = None
+        self.waterfalls = []
+        # All segments are closed before raising, the segments in use are kept for another close()
+        in_use = []
+        for segment in self._segments:
+            try:
+                segment.close()
+            except BufferError:
+                in_use.append(segment)
+        self._segments = in_use
+        if in_use:
+            raise RuntimeError('Arrays of the shared waterfall are still in use, release them before close().')
+
+    def unlink(self):
+        """
+        Removes the shared memory segments (by the publisher, once all processes are done with them).
+        """
+        if not self.owner:
+            raise RuntimeError('Only the publisher of the shared waterfall can unlink it.')
+        for segment in self._owned_segments:
+            try:
+                segment.unlink()
+            except FileNotFoundError:
+                pass
+        self._owned_segments = []
@@ -0,0 +1,159 @@
+"""
+Decoding of XTF bathy snippet packets (XTFHeaderType.bathy_snippet).
+Each packet consists of an XTFPingHeader, followed by a SNP0 header and SNP0.BeamCnt fragments.
+Each fragment is a SNP1 header followed by SNP1.FragSamples 16-bit samples.
+"""
+
+import ctypes
+import struct
+from typing import List
+from warnings import warn
+
+import numpy as np
+
+from pyxtf.xtf_ctypes import XTFPingHeader, SNP0, SNP1
+
+SNP0_ID = 0x534E5030
+SNP1_ID = 0x534E5031
+
+# The leading fields shared by SNP0 and SNP1 (ID, HeaderSize, DataSize)
+_snp_start = struct.Struct('<IHH')
+
+
+class XTFSnippets:
+    """
+    The snippets of a sequence of bathy snippet packets, stored in flat arrays instead of per-fragment objects.
+    The samples of fragment i are samples[offsets[i]:offsets[i + 1]].
+    The fragments of ping j are fragments[ping_offsets[j]:ping_offsets[j + 1]].
+    """
+    def __init__(self, pings: np.ndarray, fragments: np.ndarray, ping_offsets: np.ndarray,
+                 offsets: np.ndarray, samples: np.ndarray):
+        self.pings = pings  # SNP0 headers, one per packet
+        self.fragments = fragments  # SNP1 headers, one per fragment
+        self.ping_offsets = ping_offsets
+        self.offsets = offsets
+        self.samples = samples
+
+    def __len__(self):
+        return len(self.fragments)
+
+    @property
+    def beam(self) -> np.ndarray:
+        """
+        The beam number of each fragment.
+        """
+        return self.fragments['Beam']
+
+    @property
+    def ping(self) -> np.ndarray:
+        """
+        The (packet) index of the ping that each fragment belongs to.
+        """
+        return np.repeat(np.arange(len(self.pings)), np.diff(self.ping_offsets))
+
+    def fragment_samples(self, i: int) -> np.ndarray:
+        """
+        Returns a view of the samples of a single fragment.
+        :param i: The fragment index
+        :return: The samples as a numpy array
+        """
+        return self.samples[self.offsets[i]:self.offsets[i + 1]]
+
+    def gain(self) -> np.ndarray:
+        """
+        Calculates the gain (dB) of every sample, by interpolating linearly from GainStart to GainEnd over each fragment.
+        Fragments where both GainStart and GainEnd are zero (ignore) get zero gain.
+        :return: Array of the same length as samples
+        """
+        counts = np.diff(self.offsets)
+        gain_start = self.fragments['GainStart'].astype(np.float32) * 0.01
+        gain_end = self.fragments['GainEnd'].astype(np.float32) * 0.01
+
+        # Position of each sample within its fragment, scaled to [0, 1]
+        pos = np.arange(len(self.samples), dtype=np.float32) - np.repeat(self.offsets[:-1], counts)
+        pos /= np.repeat(np.maximum(counts - 1, 1), counts)
+
+        slope = np.repeat(gain_end - gain_start, counts)
+        return np.repeat(gain_start, counts) + slope * pos
+
+
+def concatenate_snippets(pings: List[XTFPingHeader]) -> XTFSnippets:
+    """
+    Decodes the SNP0/SNP1 structures of a list of bathy snippet packets, and concatenates all snippet samples into a
+    single contiguous buffer. Packets that can not be decoded are kept (without fragments) to preserve the ping order.
+    :param pings: A list of bathy snippet packets (the raw data following the XTFPingHeader in the data field)
+    :return: XTFSnippets
+    """
+    snp0_size = ctypes.sizeof(SNP0)
+    snp1_size = ctypes.sizeof(SNP1)
+
+    payloads = [ping.data for ping in pings]
+    raw = np.frombuffer(b''.join(payloads), dtype=np.uint8)
+
+    # Walk the headers to find the location of each SNP0 and SNP1 structure in the joined buffer
+    ping_pos = []
+    ping_valid = []
+    frag_pos = []
+    frag_header_size = []
+    frag_data_size = []
+    ping_offsets = [0]
+    base = 0
+    for i, payload in enumerate(payloads):
+        n_payload = len(payload)
+        snp0_id, pos, _ = _snp_start.unpack_from(payload) if n_payload >= snp0_size else (None, 0, 0)
+        if snp0_id == SNP0_ID:
+            ping_pos.append(base)
+            ping_valid.append(i)
+
+            n_beams = int.from_bytes(payload[SNP0.BeamCnt.offset:SNP0.BeamCnt.offset + SNP0.BeamCnt.size], 'little')
+            for _ in range(n_beams):
+                if pos + snp1_size > n_payload:
+                    warn('Bathy snippet packet {} ended before all SNP1 fragments were read.'.format(i))
+                    break
+
+                frag_id, header_size, data_size = _snp_start.unpack_from(payload, pos)
+                if frag_id != SNP1_ID:
+                    warn('Bathy snippet packet {} contains an invalid SNP1 identifier.'.format(i))
+                    break
+
+                # A corrupt header size would place the samples inside the header, or beyond the end of the packet
+                if header_size < snp1_size or pos + header_size > n_payload:
+                    warn('Bathy snippet packet {} contains an invalid SNP1 header size.'.format(i))
+                    break
+
+                frag_pos.append(base + pos)
+                frag_header_size.append(header_size)
+                frag_data_size.append(min(data_size, n_payload - pos - header_size))
+                pos += header_size + data_size
+        else:
+            warn('Bathy snippet packet {} does not start with a SNP0 structure.'.format(i))
+
+        ping_offsets.append(len(frag_pos))
+        base += n_payload
+
+    # Gather the structures with fancy indexing, and view the bytes as the packed structured dtypes
+    snp0_pings = np.zeros(len(payloads), dtype=SNP0.np_dtype())
+    if ping_pos:
+        snp0_bytes = raw[np.array(ping_pos)[:, np.newaxis] + np.arange(snp0_size)]
+        snp0_pings[ping_valid] = snp0_bytes.view(SNP0.np_dtype())[:, 0]
+
+    frag_pos = np.array(frag_pos, dtype=np.int64)
+    snp1_bytes = raw[frag_pos[:, np.newaxis] + np.arange(snp1_size)]
+    fragments = snp1_bytes.view(SNP1.np_dtype()).reshape(-1)
+
+    # The number of samples is limited by the data actually present in the fragment
+    counts = np.minimum(fragments['FragSamples'], np.array(frag_data_size, dtype=np.int64) // 2)
+    offsets = np.zeros(len(fragments) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+
+    # Gather the sample bytes of all fragments into one contiguous buffer
+    starts = frag_pos + np.array(frag_header_size, dtype=np.int64)
+    n_sample_bytes = 2 * offsets[-1]
+    byte_idx = np.repeat(starts - 2 * offsets[:-1], 2 * counts) + np.arange(n_sample_bytes)
+    samples = raw[byte_idx].view('<u2')
+
+    return XTFSnippets(pings=snp0_pings,
+                       fragments=fragments,
+                       ping_offsets=np.array(ping_offsets, dtype=np.int64),
+                       offsets=offsets,
+                       samples=samples)
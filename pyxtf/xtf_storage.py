@@ -0,0 +1,349 @@
+"""
+Storage backends for reading XTF files from other sources than the local file system, e.g. object stores with
+HTTP range requests (S3 compatible). A storage is a random access byte source, which can be wrapped in a
+CachedStorage to read in large aligned blocks with an LRU cache, and in a StorageFile to be used as a file object.
+"""
+
+from collections import OrderedDict
+import mmap
+import os
+from os.path import splitext
+import threading
+from typing import List, Tuple
+from urllib.error import HTTPError
+from urllib.parse import urlsplit, urlunsplit
+from urllib.request import Request, urlopen
+
+
+class XTFStorage:
+    """
+    Base class of the storage backends. Subclasses implement size and read_range.
+    """
+    def __init__(self, path: str):
+        self.path = path
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def size(self) -> int:
+        """
+        Returns the size of the file in bytes.
+        """
+        raise NotImplementedError()
+
+    def read_range(self, offset: int, size: int) -> bytes:
+        """
+        Reads size bytes at offset, returns fewer bytes only if the end of the file is reached.
+        """
+        raise NotImplementedError()
+
+    def read_ranges(self, ranges: List[Tuple[int, int]]) -> List[bytes]:
+        """
+        Reads several (offset, size) ranges, see read_range.
+        """
+        return [self.read_range(offset, size) for offset, size in ranges]
+
+    def exists(self) -> bool:
+        """
+        Returns true if the file exists.
+        """
+        raise NotImplementedError()
+
+    def sibling(self, path: str) -> 'XTFStorage':
+        """
+        Returns a storage of the same kind for another file (e.g. the index file next to the XTF file).
+        """
+        raise NotImplementedError()
+
+    def close(self):
+        pass
+
+
+class LocalStorage(XTFStorage):
+    """
+    Storage of a file in the local file system, read with positional reads.
+    """
+    def __init__(self, path: str):
+        super().__init__(path)
+        self._file = None
+
+    def _fd(self) -> int:
+        # Note: Opened on first use, call size() before sharing the storage between threads
+        if self._file is None:
+            self._file = open(self.path, 'rb', buffering=0)
+        return self._file.fileno()
+
+    def size(self) -> int:
+        return os.fstat(self._fd()).st_size
+
+    def read_range(self, offset: int, size: int) -> bytes:
+        if hasattr(os, 'pread'):
+            return os.pread(self._fd(), size, offset)
+        self._fd()
+        self._file.seek(offset)
+        return self._file.read(size)
+
+    def exists(self) -> bool:
+        return os.path.isfile(self.path)
+
+    def sibling(self, path: str) -> 'LocalStorage':
+        return LocalStorage(path)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class HTTPStorage(XTFStorage):
+    """
+    Storage of a file served over HTTP(S) by a server supporting range requests (e.g. S3 compatible object stores,
+    using public or pre-signed URLs).
+    """
+    def __init__(self, url: str, headers: dict = None, timeout: float = 60.0):
+        """
+        :param url: The URL of the file
+        :param headers: Additional request headers (e.g. authorization)
+        :param timeout: The timeout of each request [s]
+        """
+        super().__init__(url)
+        self.headers = dict(headers) if headers else {}
+        self.timeout = timeout
+        self.n_requests = 0
+        self._size = None
+
+    def size(self) -> int:
+        if self._size is None:
+            self.n_requests += 1
+            with urlopen(Request(self.path, headers=self.headers, method='HEAD'), timeout=self.timeout) as response:
+                self._size = int(response.headers['Content-Length'])
+        return self._size
+
+    def read_range(self, offset: int, size: int) -> bytes:
+        if size <= 0:
+            return b''
+
+        headers = dict(self.headers)
+        headers['Range'] = 'bytes={}-{}'.format(offset, offset + size - 1)
+        self.n_requests += 1
+        try:
+            with urlopen(Request(self.path, headers=headers), timeout=self.timeout) as response:
+                if response.status != 206:
+                    raise RuntimeError('HTTP server does not support range requests ({}).'.format(self.path))
+                return response.read()
+        except HTTPError as e:
+            if e.code == 416:  # Range not satisfiable, i.e. reading past the end of the file
+                return b''
+            raise
+
+    def exists(self) -> bool:
+        try:
+            self.size()
+            return True
+        except HTTPError as e:
+            if e.code in (403, 404):
+                return False
+            raise
+
+    def sibling(self, path: str) -> 'HTTPStorage':
+        return HTTPStorage(path, self.headers, self.timeout)
+
+
+def storage_sibling_path(path: str, ext: str) -> str:
+    """
+    Replaces the extension of a path or URL (ignoring any query string), e.g. to locate the index file.
+    :param path: The path or URL
+    :param ext: The new extension, including the leading dot
+    :return: The new path or URL
+    """
+    parts = urlsplit(path)
+    if parts.scheme in ('http', 'https'):
+        return urlunsplit(parts._replace(path=splitext(parts.path)[0] + ext))
+    return splitext(path)[0] + ext
+
+
+class CachedStorage(XTFStorage):
+    """
+    Wraps a storage to read in large aligned blocks, kept in an LRU cache limited by a byte budget.
+    Reads of nearby data (e.g. consecutive packets) are served from the same block, and missing consecutive blocks
+    are fetched with a single range read. The cache is shared safely between threads (reads are serialized).
+    """
+    def __init__(self, storage: XTFStorage, block_size: int = 1024 * 1024, max_bytes: int = 64 * 1024 * 1024):
+        """
+        :param storage: The storage to read from
+        :param block_size: The size (and alignment) of each read
+        :param max_bytes: The maximum number of bytes kept in the cache
+        """
+        super().__init__(storage.path)
+        self.storage = storage
+        self.block_size = block_size
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._blocks = OrderedDict()  # Block number -> bytes, in order of use (least recently used first)
+        self._n_bytes = 0
+        self._size = None
+        self._lock = threading.RLock()
+
+    def size(self) -> int:
+        if self._size is None:
+            self._size = self.storage.size()
+        return self._size
+
+    def exists(self) -> bool:
+        return self.storage.exists()
+
+    def sibling(self, path: str) -> 'CachedStorage':
+        return CachedStorage(self.storage.sibling(path), self.block_size, self.max_bytes)
+
+    def close(self):
+        with self._lock:
+            self._blocks.clear()
+            self._n_bytes = 0
+        self.storage.close()
+
+    def read_range(self, offset: int, size: int) -> bytes:
+        size = max(0, min(size, self.size() - offset))
+        if size == 0:
+            return b''
+
+        first = offset // self.block_size
+        last = (offset + size - 1) // self.block_size
+        with self._lock:
+            blocks = self._get_blocks(first, last)
+
+        start = offset - first * self.block_size
+        if first == last:
+            return blocks[0][start:start + size]
+        return b''.join(blocks)[start:start + size]
+
+    def read_ranges(self, ranges: List[Tuple[int, int]]) -> List[bytes]:
+        """
+        Reads several (offset, size) ranges, fetching all blocks they touch before reading any of them,
+        so that missing blocks of nearby ranges are coalesced into as few reads as possible.
+        """
+        needed = set()
+        for offset, size in ranges:
+            if size > 0:
+                needed.update(range(offset // self.block_size, (offset + size - 1) // self.block_size + 1))
+        with self._lock:
+            self._fetch(sorted(b for b in needed if b not in self._blocks))
+            return [self.read_range(offset, size) for offset, size in ranges]
+
+    def _get_blocks(self, first: int, last: int) -> List[bytes]:
+        missing = [b for b in range(first, last + 1) if b not in self._blocks]
+        self.hits += last - first + 1 - len(missing)
+        self._fetch(missing)
+
+        blocks = []
+        for b in range(first, last + 1):
+            self._blocks.move_to_end(b)
+            blocks.append(self._blocks[b])
+        self._evict(keep=last - first + 1)
+        return blocks
+
+    def _fetch(self, missing: List[int]):
+        # Consecutive missing blocks are read with a single request
+        self.misses += len(missing)
+        i = 0
+        while i < len(missing):
+            j = i
+            while j + 1 < len(missing) and missing[j + 1] == missing[j] + 1:
+                j += 1
+
+            data = self.storage.read_range(missing[i] * self.block_size, (j - i + 1) * self.block_size)
+            for k, b in enumerate(missing[i:j + 1]):
+                block = data[k * self.block_size:(k + 1) * self.block_size]
+                self._blocks[b] = block
+                self._n_bytes += len(block)
+            i = j + 1
+
+    def _evict(self, keep: int = 0):
+        # Remove least recently used blocks, but never the last keep blocks (in use by the current read)
+        while self._n_bytes > self.max_bytes and len(self._blocks) > keep:
+            (_, block) = self._blocks.popitem(last=False)
+            self._n_bytes -= len(block)
+
+
+class StorageFile:
+    """
+    Read-only file object over a storage, to be used where a binary file is expected (e.g. xtf_read_gen).
+    Closing the file does not close the storage.
+    """
+    def __init__(self, storage: XTFStorage):
+        self.storage = storage
+        self.closed = False
+        self._pos = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        self.closed = True
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        if whence == os.SEEK_CUR:
+            offset += self._pos
+        elif whence == os.SEEK_END:
+            offset += self.storage.size()
+        self._pos = offset
+        return self._pos
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            size = self.storage.size() - self._pos
+        data = self.storage.read_range(self._pos, size)
+        self._pos += len(data)
+        return data
+
+    def readinto(self, buffer) -> int:
+        view = memoryview(buffer).cast('B')
+        data = self.read(len(view))
+        view[:len(data)] = data
+        return len(data)
+
+    def peek(self, size: int = 1) -> bytes:
+        return self.storage.read_range(self._pos, max(size, 1))
+
+
+class MmapStorage(XTFStorage):
+    """
+    Storage of a file in the local file system, read through a read-only memory map.
+    """
+    def __init__(self, path: str):
+        super().__init__(path)
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+
+    def size(self) -> int:
+        return len(self._mmap)
+
+    def read_range(self, offset: int, size: int) -> bytes:
+        return self._mmap[offset:offset + size]
+
+    def exists(self) -> bool:
+        return True
+
+    def sibling(self, path: str) -> XTFStorage:
+        # The index file is small, and read once
+        return LocalStorage(path)
+
+    def close(self):
+        if isinstance(self._mmap, mmap.mmap):
+            self._mmap.close()
@@ -0,0 +1,255 @@
+"""
+Compact in-memory storage of many packets, in flat arrays instead of one Python object per packet.
+"""
+
+import ctypes
+from io import BytesIO
+from typing import Iterable, List, Type, Union
+
+import numpy as np
+
+from pyxtf.enumerations import XTFChannelType, XTFHeaderType
+from pyxtf.xtf_ctypes import XTFFileHeader, XTFPacket, XTFPingHeader, XTFPingChanHeader
+
+
+class PingTable:
+    """
+    The sonar pings of an XTF file, stored in a few arrays instead of per-ping objects.
+    The ping headers are stored in one structured array, the channel headers in another (one row per ping, unused
+    channels are zero), and the samples of each channel in one contiguous buffer (CSR layout):
+    The samples of channel c in ping i are samples[c][offsets[c, i]:offsets[c, i + 1]].
+    Indexing the table returns a XTFPingHeader object, with the samples as views of the buffers.
+    """
+    def __init__(self, file_header: XTFFileHeader, headers: np.ndarray, chan_headers: np.ndarray,
+                 offsets: np.ndarray, samples: List[np.ndarray]):
+        self.file_header = file_header
+        self.headers = headers  # XTFPingHeader, one per ping
+        self.chan_headers = chan_headers  # XTFPingChanHeader, shape (pings, channels)
+        self.offsets = offsets  # Shape (channels, pings + 1)
+        self.samples = samples  # One array per channel
+
+    def __len__(self):
+        return len(self.headers)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __getitem__(self, i: int) -> XTFPingHeader:
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('Ping index out of range.')
+
+        ping = XTFPingHeader.from_buffer_copy(self.headers[i:i + 1])
+        n_chans = min(ping.NumChansToFollow, self.n_channels)
+        ping.ping_chan_headers = [XTFPingChanHeader.from_buffer_copy(self.chan_headers[i, c:c + 1])
+                                  for c in range(n_chans)]
+        ping.data = [self.channel_samples(i, c) for c in range(n_chans)]
+        return ping
+
+    @property
+    def n_channels(self) -> int:
+        return self.chan_headers.shape[1]
+
+    def channel_samples(self, i: int, channel: int) -> np.ndarray:
+        """
+        Returns a view of the samples of a single channel of a ping.
+        :param i: The ping index
+        :param channel: The channel number (in the ping)
+        :return: The samples as a numpy array
+        """
+        return self.samples[channel][self.offsets[channel, i]:self.offsets[channel, i + 1]]
+
+    def channel_type(self, channel: int) -> Union[XTFChannelType, None]:
+        """
+        Returns the type of a channel, from the file header entry of its ChannelNumber (see XTFFileHeader.channel_info),
+        or None if the channel has no samples or no channel info.
+        :param channel: The channel number (in the ping)
+        """
+        pings = np.flatnonzero(np.diff(self.offsets[channel]))
+        if len(pings) == 0:
+            return None
+        p_chan = XTFPingChanHeader.from_buffer_copy(self.chan_headers[pings[0], channel:channel + 1])
+        try:
+            return XTFChannelType(self.file_header.channel_info(p_chan, channel).TypeOfChannel)
+        except (RuntimeError, ValueError):
+            return None
+
+    def waterfall(self, channel: int) -> np.ndarray:
+        """
+        Returns the samples of a channel as a dense array (pings, samples), in file order.
+        This is a view of the samples if all pings have the same number of samples, otherwise shorter pings are padded
+        with zeros on the outer side (port pings are aligned right, starboard pings left, other types centered).
+        :param channel: The channel number (in the ping)
+        :return: The sonar image as a dense numpy array
+        """
+        counts = np.diff(self.offsets[channel])
+        samples = self.samples[channel]
+        if len(counts) == 0:
+            return samples.reshape(0, 0)
+
+        max_sz = int(counts.max())
+        if np.all(counts == max_sz):
+            return samples.reshape(len(counts), max_sz)
+
+        # The position of each sample in the dense array
+        chan_type = self.channel_type(channel)
+        if chan_type is XTFChannelType.stbd:
+            pad = np.zeros_like(counts)
+        elif chan_type is XTFChannelType.port:
+            pad = max_sz - counts
+        else:
+            pad = (max_sz - counts) // 2
+        rows = np.repeat(np.arange(len(counts)), counts)
+        cols = np.arange(len(samples)) - np.repeat(self.offsets[channel, :-1] - pad, counts)
+
+        out_array = np.zeros((len(counts), max_sz), dtype=samples.dtype)
+        out_array[rows, cols] = samples
+        return out_array
+
+
+def concatenate_pings(pings: Iterable[XTFPingHeader], file_header: XTFFileHeader) -> PingTable:
+    """
+    Stores sonar pings in a PingTable. The pings can be given by a generator, so that only one ping object exists at
+    a time, e.g. when reading a file:
+        gen = xtf_read_gen(path, types=[XTFHeaderType.sonar])
+        file_header = next(gen)
+        table = concatenate_pings(gen, file_header)
+    :param pings: The sonar pings (other packets are ignored)
+    :param file_header: The file header
+    :return: PingTable
+    """
+    # The number of channels is given by the pings (NumChansToFollow), as subbottom or bathymetry channels are not
+    # part of the sonar channels of the file header. Channels are added as pings with more channels are found.
+    chan_header_size = ctypes.sizeof(XTFPingChanHeader)
+
+    headers = bytearray()
+    chan_headers = []  # type: List[bytearray]
+    samples = []  # type: List[bytearray]
+    counts = []  # type: List[List[int]]
+    dtypes = []
+    n_pings = 0
+
+    for ping in pings:
+        if not isinstance(ping, XTFPingHeader) or ping.HeaderType != XTFHeaderType.sonar:
+            continue
+
+        n_chans = min(ping.NumChansToFollow, len(ping.ping_chan_headers), len(ping.data))
+        while len(chan_headers) < n_chans:
+            chan_headers.append(bytearray(n_pings * chan_header_size))
+            samples.append(bytearray())
+            counts.append([0] * n_pings)
+            dtypes.append(None)
+
+        headers += memoryview(ping).cast('B')
+        for c in range(len(chan_headers)):
+            if c < n_chans:
+                chan_headers[c] += memoryview(ping.ping_chan_headers[c]).cast('B')
+
+                data = np.ascontiguousarray(ping.data[c])
+                if dtypes[c] is None:
+                    dtypes[c] = data.dtype
+                elif data.dtype != dtypes[c]:
+                    raise RuntimeError('Sample type of channel {} changes between pings ({} and {}).'.format(
+                        c, dtypes[c], data.dtype))
+                samples[c] += memoryview(data).cast('B')
+                counts[c].append(len(data))
+            else:
+                chan_headers[c] += bytes(chan_header_size)
+                counts[c].append(0)
+        n_pings += 1
+
+    n_channels = len(chan_headers)
+    offsets = np.zeros((n_channels, n_pings + 1), dtype=np.int64)
+    for c in range(n_channels):
+        np.cumsum(counts[c], out=offsets[c, 1:])
+
+    # The channel headers are stored per ping (one row of all channels per ping)
+    chan_dtype = XTFPingChanHeader.np_dtype()
+    chan_array = np.empty((n_pings, n_channels), dtype=chan_dtype)
+    for c in range(n_channels):
+        chan_array[:, c] = np.frombuffer(chan_headers[c], dtype=chan_dtype)
+
+    # The sample buffers are used by the arrays directly, without copying
+    return PingTable(file_header=file_header,
+                     headers=np.frombuffer(headers, dtype=XTFPingHeader.np_dtype()),
+                     chan_headers=chan_array,
+                     offsets=offsets,
+                     samples=[np.frombuffer(s, dtype=dt if dt is not None else np.uint8)
+                              for s, dt in zip(samples, dtypes)])
+
+
+class PacketTable:
+    """
+    The packets of one type, stored in columns instead of per-packet objects (see xtf_read with columnar=True).
+    The fixed headers are stored in one structured array, and the variable-length data following each header in one
+    contiguous buffer: The data of packet i is payload[offsets[i]:offsets[i + 1]].
+    Columns are accessed by field name, e.g. table['Heading'], and objects() gives a lazy sequence of packet objects.
+    """
+    def __init__(self, file_header: XTFFileHeader, header_type: XTFHeaderType, packet_class: Type[XTFPacket],
+                 headers: np.ndarray, offsets: np.ndarray, payload: np.ndarray, locations: np.ndarray = None):
+        self.file_header = file_header
+        self.header_type = header_type
+        self.packet_class = packet_class
+        self.headers = headers  # packet_class.np_dtype(), one per packet
+        self.offsets = offsets
+        self.payload = payload  # uint8
+        self.locations = locations  # Position of each packet in the file
+
+    def __len__(self):
+        return len(self.headers)
+
+    def __getitem__(self, key: str) -> np.ndarray:
+        return self.headers[key]
+
+    def keys(self) -> List[str]:
+        return list(self.headers.dtype.names)
+
+    def packet_payload(self, i: int) -> np.ndarray:
+        """
+        Returns a view of the data following the header of a single packet.
+        """
+        return self.payload[self.offsets[i]:self.offsets[i + 1]]
+
+    def packet_bytes(self, i: int) -> bytes:
+        """
+        Returns the bytes of a single packet (header and data).
+        """
+        return self.headers[i:i + 1].tobytes() + self.packet_payload(i).tobytes()
+
+    def packet(self, i: int) -> XTFPacket:
+        """
+        Constructs the packet object of a single packet.
+        """
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('Packet index out of range.')
+        return self.packet_class.create_from_buffer(buffer=BytesIO(self.packet_bytes(i)), file_header=self.file_header)
+
+    def objects(self) -> 'PacketObjects':
+        """
+        Returns a lazy sequence of the packet objects, which are constructed when accessed.
+        """
+        return PacketObjects(self)
+
+
+class PacketObjects:
+    """
+    Lazy sequence of the packet objects of a PacketTable, in place of the list returned by xtf_read.
+    """
+    def __init__(self, table: PacketTable):
+        self.table = table
+
+    def __len__(self):
+        return len(self.table)
+
+    def __getitem__(self, i: Union[int, slice]) -> Union[XTFPacket, List[XTFPacket]]:
+        if isinstance(i, slice):
+            return [self.table.packet(j) for j in range(*i.indices(len(self.table)))]
+        return self.table.packet(i)
+
+    def __iter__(self):
+        for i in range(len(self.table)):
+            yield self.table.packet(i)
@@ -0,0 +1,321 @@
+"""
+Writing of XTF files. The record size, channel counts and alignment padding of each packet is filled in automatically.
+"""
+
+import os
+from os.path import isfile
+import pickle
+from typing import Any, Dict, List, Sequence
+
+import numpy as np
+
+from pyxtf.enumerations import XTFHeaderType
+from pyxtf.xtf_ctypes import XTFFileHeader, XTFPacket, XTFPingHeader, XTFPingChanHeader, XTFRawSerialHeader
+from pyxtf.xtf_io import xtf_padding, xtf_index_path
+
+# The maximum number of buffers passed to a single os.writev call
+try:
+    _iov_max = os.sysconf('SC_IOV_MAX')
+except (AttributeError, ValueError, OSError):
+    _iov_max = 1024
+
+
+def xtf_time_fields(time: np.ndarray) -> Dict[str, np.ndarray]:
+    """
+    Splits an array of times into the XTFPingHeader time fields (Year, Month, Day, Hour, Minute, Second, HSeconds,
+    JulianDay), e.g. to be passed as ping_fields to XTFWriter.write_sonar_arrays.
+    :param time: Array of numpy.datetime64
+    :return: Dictionary of field name and values
+    """
+    time = np.asarray(time, dtype='datetime64[ms]')
+    year = time.astype('datetime64[Y]')
+    month = time.astype('datetime64[M]')
+    day = time.astype('datetime64[D]')
+    ms = (time - day).astype(np.int64)
+
+    return {
+        'Year': year.astype(np.int64) + 1970,
+        'Month': (month - year).astype(np.int64) + 1,
+        'Day': (day - month).astype(np.int64) + 1,
+        'Hour': ms // 3600000,
+        'Minute': ms // 60000 % 60,
+        'Second': ms // 1000 % 60,
+        'HSeconds': ms % 1000 // 10,
+        'JulianDay': (day - year).astype(np.int64) + 1
+    }
+
+
+class XTFWriter:
+    """
+    Writes an XTF file, starting with the file header and followed by the packets passed to write.
+    The output is collected in a buffer and written to file in large chunks.
+    With zero_copy, the packet structures and sample arrays are not copied, but passed to os.writev (scatter-gather).
+    Usage:
+        with XTFWriter('out.xtf', file_header) as writer:
+            for packet in packets:
+                writer.write(packet)
+    """
+    def __init__(self, path: str, file_header: XTFFileHeader, save_index: bool = False, pad: bool = True,
+                 buffer_size: int = 4 * 1024 * 1024, zero_copy: bool = False):
+        """
+        :param path: The path of the XTF file to write (overwritten if it exists)
+        :param file_header: The file header, written at the start of the file
+        :param save_index: If true, the packet index is stored next to the xtf file when closed (see xtf_read_gen)
+        :param pad: If true, each packet is padded with zeros to align on a 64byte multiple
+        :param buffer_size: The number of bytes to collect before writing to file
+        :param zero_copy: If true, memoryviews of the written packets and their data are collected instead of copies,
+                          and written with os.writev. The packets (and data) must not be modified until flush is
+                          called (or the writer is closed). Falls back to copying if os.writev is not available.
+        """
+        self.path = path
+        self.save_index = save_index
+        self.pad = pad
+        self.buffer_size = buffer_size
+        self.zero_copy = zero_copy and hasattr(os, 'writev')
+        self.index = {}  # type: Dict[XTFHeaderType, List[int]]
+
+        # An index from a previous file at this path would no longer match the contents
+        path_idx = xtf_index_path(path)
+        if isfile(path_idx):
+            os.remove(path_idx)
+
+        self._file = open(path, 'wb')
+        self._buffer = bytearray()
+        self._views = []  # type: List[memoryview]
+        self._views_size = 0
+        self._pos = 0
+        self._zeros = bytes(64)
+
+        self._append(file_header.to_buffers())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close(save_index=exc_type is None and self.save_index)
+
+    def tell(self) -> int:
+        """
+        Returns the file position of the next packet.
+        """
+        return self._pos
+
+    def write(self, packet: XTFPacket) -> int:
+        """
+        Writes a packet to the file. NumBytesThisRecord is set from the size of the packet and its data,
+        in addition to the channel count and sample counts of sonar pings and the string size of raw serial packets.
+        :param packet: The packet to write
+        :return: The file position of the packet
+        """
+        if isinstance(packet, XTFPingHeader) and packet.HeaderType == XTFHeaderType.sonar:
+            packet.NumChansToFollow = len(packet.ping_chan_headers)
+            for p_chan, samples in zip(packet.ping_chan_headers, packet.data):
+                p_chan.NumSamples = len(samples)
+        elif isinstance(packet, XTFRawSerialHeader):
+            packet.StringSize = len(packet.RawAsciiData)
+
+        # The views are taken before the size is set, but reflect the change as they share memory with the packet
+        views = [memoryview(b).cast('B') for b in packet.to_buffers()]
+        size = sum(view.nbytes for view in views)
+        n_bytes = xtf_padding(size) if self.pad else size
+        packet.NumBytesThisRecord = n_bytes
+
+        if n_bytes > size:
+            views.append(memoryview(self._zeros)[:n_bytes - size])
+
+        try:
+            p_headertype = XTFHeaderType(packet.HeaderType)
+        except ValueError:
+            p_headertype = XTFHeaderType.unknown
+
+        packet_start_loc = self._pos
+        try:
+            self.index[p_headertype].append(packet_start_loc)
+        except KeyError:
+            self.index[p_headertype] = [packet_start_loc]
+
+        self._append(views)
+        return packet_start_loc
+
+    def write_sonar(self, data: Sequence[np.ndarray], ping: XTFPingHeader = None,
+                    ping_chan_headers: Sequence[XTFPingChanHeader] = None) -> int:
+        """
+        Writes a sonar ping from the sample arrays of each channel.
+        :param data: The samples of each channel, with the dtype matching BytesPerSample of the channel
+        :param ping: The ping header, a default XTFPingHeader is used if not given
+        :param ping_chan_headers: The ping channel headers, default headers numbered by channel if not given
+        :return: The file position of the packet
+        """
+        if ping is None:
+            ping = XTFPingHeader()
+        if ping_chan_headers is None:
+            ping_chan_headers = [XTFPingChanHeader() for _ in data]
+            for i, p_chan in enumerate(ping_chan_headers):
+                p_chan.ChannelNumber = i
+        elif len(ping_chan_headers) != len(data):
+            raise RuntimeError('The number of ping channel headers does not match the number of data channels.')
+
+        ping.HeaderType = XTFHeaderType.sonar.value
+        ping.ping_chan_headers = list(ping_chan_headers)
+        ping.data = list(data)
+
+        return self.write(ping)
+
+    def write_sonar_arrays(self, data: Sequence[np.ndarray], ping_fields: Dict[str, Any] = None,
+                           chan_fields: Sequence[Dict[str, Any]] = None, ping: XTFPingHeader = None) -> np.ndarray:
+        """
+        Writes a sequence of sonar pings from 2D sample arrays (pings x samples), one per channel.
+        The packets are laid out in blocks of about buffer_size bytes using the packed numpy dtypes of the headers,
+        and each block is written to file with a single call.
+        :param data: The samples of each channel, with the dtype matching BytesPerSample of the channel
+        :param ping_fields: XTFPingHeader field name and values, either one value per ping or a single value for all
+                            (see xtf_time_fields for the time fields)
+        :param chan_fields: XTFPingChanHeader field name and values, one dictionary per channel (same format)
+        :param ping: Template for the fields of the ping header not given in ping_fields
+        :return: Array of the file position of each packet
+        """
+        data = [np.asarray(samples) for samples in data]
+        if any(samples.ndim != 2 for samples in data):
+            raise RuntimeError('The data of each channel must be a 2D array (pings x samples).')
+        n_pings = data[0].shape[0] if data else 0
+        if any(samples.shape[0] != n_pings for samples in data):
+            raise RuntimeError('The number of pings differ between the data channels.')
+        if chan_fields is not None and len(chan_fields) != len(data):
+            raise RuntimeError('The number of channel fields does not match the number of data channels.')
+
+        # Packed layout of a single packet: ping header, then channel header and samples per channel
+        header_dtype = XTFPingHeader.np_dtype()
+        chan_dtype = XTFPingChanHeader.np_dtype()
+        names, formats, offsets = ['header'], [header_dtype], [0]
+        size = header_dtype.itemsize
+        for i, samples in enumerate(data):
+            sample_dtype = samples.dtype.newbyteorder('<')
+            names += ['chan{}'.format(i), 'data{}'.format(i)]
+            formats += [chan_dtype, (sample_dtype, samples.shape[1])]
+            offsets += [size, size + chan_dtype.itemsize]
+            size += chan_dtype.itemsize + sample_dtype.itemsize * samples.shape[1]
+
+        n_bytes = xtf_padding(size) if self.pad else size
+        record_dtype = np.dtype({'names': names, 'formats': formats, 'offsets': offsets, 'itemsize': n_bytes})
+
+        # Header templates, the remaining fields are filled per block
+        if ping is None:
+            ping = XTFPingHeader()
+        ping.HeaderType = XTFHeaderType.sonar.value
+        ping.NumChansToFollow = len(data)
+        ping.NumBytesThisRecord = n_bytes
+        header = np.frombuffer(bytes(ping), dtype=header_dtype)[0]
+
+        chan_headers = []
+        for i, samples in enumerate(data):
+            p_chan = XTFPingChanHeader()
+            p_chan.ChannelNumber = i
+            p_chan.NumSamples = samples.shape[1]
+            chan_headers.append(np.frombuffer(bytes(p_chan), dtype=chan_dtype)[0])
+
+        ping_fields = {} if ping_fields is None else ping_fields
+        chan_fields = [{}] * len(data) if chan_fields is None else chan_fields
+
+        # The padding bytes are never assigned, and remain zero when the block is reused
+        block_size = max(1, self.buffer_size // n_bytes)
+        block = np.zeros(min(block_size, n_pings), dtype=record_dtype)
+
+        positions = self._pos + np.arange(n_pings, dtype=np.int64) * n_bytes
+        for start in range(0, n_pings, block_size):
+            stop = min(start + block_size, n_pings)
+            out = block[:stop - start]
+
+            out['header'] = header
+            for name, values in ping_fields.items():
+                out['header'][name] = values if np.ndim(values) == 0 else values[start:stop]
+
+            for i, samples in enumerate(data):
+                out['chan{}'.format(i)] = chan_headers[i]
+                for name, values in chan_fields[i].items():
+                    out['chan{}'.format(i)][name] = values if np.ndim(values) == 0 else values[start:stop]
+                out['data{}'.format(i)] = samples[start:stop]
+
+            # The block is about the size of the buffer, and is written without copying
+            self._write_direct(out.view(np.uint8))
+
+        try:
+            self.index[XTFHeaderType.sonar].extend(positions.tolist())
+        except KeyError:
+            self.index[XTFHeaderType.sonar] = positions.tolist()
+
+        return positions
+
+    def flush(self):
+        """
+        Writes the buffered output to file.
+        """
+        self._write_buffered()
+        self._file.flush()
+
+    def close(self, save_index: bool = None):
+        """
+        Flushes the buffered output and closes the file.
+        :param save_index: Overrides the save_index argument given to the constructor
+        """
+        if self._file.closed:
+            return
+
+        self.flush()
+        self._file.close()
+
+        if self.save_index if save_index is None else save_index:
+            with open(xtf_index_path(self.path), mode='wb') as f_idx:
+                pickle.dump(self.index, f_idx)
+
+    def _append(self, views: List[memoryview]):
+        for view in views:
+            view = memoryview(view).cast('B')
+
+            if self.zero_copy:
+                self._views.append(view)
+                self._views_size += view.nbytes
+                self._pos += view.nbytes
+                if self._views_size >= self.buffer_size:
+                    self._write_buffered()
+                continue
+
+            if view.nbytes >= self.buffer_size:
+                # Large data is written directly instead of being copied to the buffer
+                self._write_direct(view)
+                continue
+
+            if len(self._buffer) + view.nbytes > self.buffer_size:
+                self._write_buffered()
+
+            self._buffer += view
+            self._pos += view.nbytes
+
+    def _write_direct(self, view):
+        self._write_buffered()
+        self._file.write(view)
+        self._pos += view.nbytes
+
+    def _write_buffered(self):
+        if self._buffer:
+            self._file.write(self._buffer)
+            self._buffer.clear()
+
+        if self._views:
+            # os.writev bypasses the file object buffer
+            self._file.flush()
+            fd = self._file.fileno()
+
+            views = self._views
+            i = 0
+            while i < len(views):
+                n_written = os.writev(fd, views[i:i + _iov_max])
+
+                # Skip the views that were written, and continue from the remainder on partial writes
+                while i < len(views) and n_written >= views[i].nbytes:
+                    n_written -= views[i].nbytes
+                    i += 1
+                if n_written:
+                    views[i] = views[i][n_written:]
+
+            self._views = []
+            self._views_size = 0
@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+
+from pyxtf import XTFAttitudeData, XTFChannelType, XTFFileHeader, XTFHeaderNavigation, XTFPingHeader, \
+    XTFPingChanHeader, XTFSampleFormat, XTFWriter
+
+
+def sample_file_header(n_channels: int = 2) -> XTFFileHeader:
+    file_header = XTFFileHeader()
+    file_header.NumberOfSonarChannels = n_channels
+    for i in range(n_channels):
+        file_header.ChanInfo[i].TypeOfChannel = (XTFChannelType.port if i % 2 == 0 else XTFChannelType.stbd).value
+        file_header.ChanInfo[i].BytesPerSample = 2
+        file_header.ChanInfo[i].SampleFormat = XTFSampleFormat.word.value
+    return file_header
+
+
+def set_time(packet, second: int):
+    packet.Year, packet.Month, packet.Day = 2020, 1, 2
+    packet.Hour, packet.Minute, packet.Second = 3, second // 60, second % 60
+    packet.JulianDay = 2
+
+
+def write_sample_xtf(path: str, n_pings: int = 40, n_samples: int = None, attitude: bool = True,
+                     save_index: bool = False) -> str:
+    """
+    Writes a file of sonar pings one second apart, each followed by a navigation packet and (optionally) two attitude
+    packets. The pings have a varying number of samples unless n_samples is given.
+    """
+    with XTFWriter(path, sample_file_header(), save_index=save_index) as writer:
+        for i in range(n_pings):
+            ping = XTFPingHeader()
+            set_time(ping, i)
+            ping.PingNumber = i
+            ping.SensorXcoordinate = 10.0 + i
+            ping.SensorYcoordinate = 60.0 - i
+            n = n_samples if n_samples is not None else 100 + 7 * (i % 5)
+            chans = [XTFPingChanHeader() for _ in range(2)]
+            for c, p_chan in enumerate(chans):
+                p_chan.ChannelNumber = c
+                p_chan.SlantRange = 50.0
+            writer.write_sonar([(np.arange(n) + i * 3 + c).astype(np.uint16) for c in range(2)], ping=ping,
+                               ping_chan_headers=chans)
+
+            nav = XTFHeaderNavigation()
+            set_time(nav, i)
+            nav.RawXcoordinate = i
+            nav.RawYcoordinate = -i
+            writer.write(nav)
+
+            if attitude:
+                for j in range(2):
+                    att = XTFAttitudeData()
+                    set_time(att, i)
+                    att.Pitch = i + 0.5 * j
+                    att.Roll = -i
+                    att.Heading = 10.0 * j
+                    writer.write(att)
+    return path
+
+
+@pytest.fixture
+def sample_xtf(tmp_path) -> str:
+    return write_sample_xtf(str(tmp_path / 'sample.xtf'))
@@ -0,0 +1,117 @@
+import pickle
+import struct
+import warnings
+
+import numpy as np
+import pytest
+
+from pyxtf.vendors.kongsberg import KMDatagramType, KMOutputDatagramHeader, KMRawRangeAngle78, km_byte_order, \
+    km_decode_datagrams
+
+# Layout of the raw range and angle 78 datagram, written with struct (independent of the ctypes structures)
+_header = 'IBBHII'
+_body = 'HHHHHHfI'
+_tx = 'hHfffHBBf'
+_rx = 'hBBHBbfhbB'
+_tail = 'BBH'
+
+
+def raw_range_angle(byte_order: str, n_tx: int = 2, n_rx: int = 3, padding: int = 0) -> bytes:
+    tx = [(-150 + i, 0, 0.001, 0.0001 * i, 300e3 + i, 8000, 0, i, 2500.0) for i in range(n_tx)]
+    rx = [(-6000 + 100 * i, i % n_tx, 0, 50, 10, -1, 0.01 * (i + 1), -200 - i, 0, 0) for i in range(n_rx)]
+    fmt = byte_order + _header + _body + _tx * n_tx + _rx * n_rx + _tail
+    n_bytes = struct.calcsize(fmt) - 4
+
+    values = [n_bytes, 0x02, KMDatagramType.raw_range_and_angle_78.value, 2040, 20200102, 3600000,
+              17, 101, 14950, n_tx, n_rx, n_rx - 1, 25000.0, 1]
+    for entry in tx + rx:
+        values.extend(entry)
+    datagram = struct.pack(fmt, *values, 0, 0x03, 0)
+
+    # The checksum is the sum of the bytes from the datagram type up to the end identifier
+    checksum = sum(datagram[5:-3]) & 0xFFFF
+    return datagram[:-2] + struct.pack(byte_order + 'H', checksum) + bytes(padding)
+
+
+def check_datagram(datagram: KMRawRangeAngle78):
+    assert datagram.NumberOfBytes == len(bytes(datagram)) - 4
+    assert (datagram.DatagramType, datagram.EMModelNumber) == (KMDatagramType.raw_range_and_angle_78, 2040)
+    assert (datagram.Date, datagram.Time, datagram.PingCounter, datagram.SoundSpeed) == (20200102, 3600000, 17, 14950)
+    assert (datagram.Ntx, datagram.Nrx, datagram.SamplingFrequency) == (2, 3, 25000.0)
+    assert [tx.TiltAngle for tx in datagram.TX] == [-150, -149]
+    assert [tx.CentreFrequency for tx in datagram.TX] == [300e3, 300e3 + 1]
+    assert [rx.BeamAngle for rx in datagram.RX] == [-6000, -5900, -5800]
+    assert [rx.Reflectivity for rx in datagram.RX] == [-200, -201, -202]
+    np.testing.assert_allclose([rx.TravelTime for rx in datagram.RX], [0.01, 0.02, 0.03], rtol=1e-6)
+    assert datagram.EndID == 0x03
+
+
+@pytest.mark.parametrize('padding', [0, 64], ids=['exact', 'padded'])
+def test_byte_order_detection(padding):
+    little = raw_range_angle('<', padding=padding)
+    big = raw_range_angle('>', padding=padding)
+    assert km_byte_order(little) == '<'
+    assert km_byte_order(big) == '>'
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')  # Checksum failures
+        decoded = [KMRawRangeAngle78.create_from_buffer(d) for d in [little, big]]
+    for datagram in decoded:
+        check_datagram(datagram)
+    assert bytes(decoded[0]) == bytes(decoded[1]) == little[:len(little) - padding]
+
+    # The byte order given explicitly is used as is
+    assert bytes(KMRawRangeAngle78.create_from_buffer(big, byte_order='>')) == bytes(decoded[0])
+
+
+def test_byte_order_from_model_number():
+    # The length field is inconclusive for the header only, as both byte orders exceed the available bytes
+    for byte_order in ['<', '>']:
+        header = raw_range_angle(byte_order)[:KMRawRangeAngle78.TX.offset]
+        assert km_byte_order(header) == byte_order
+
+        # Neither byte order fits when the length is zero
+        header = struct.pack(byte_order + _header, 0, 0x02, KMDatagramType.clock.value, 2040, 20200102, 0)
+        assert km_byte_order(header) == byte_order
+        datagram = KMOutputDatagramHeader.create_from_buffer(header)
+        assert (datagram.EMModelNumber, datagram.Date) == (2040, 20200102)
+
+    with pytest.raises(RuntimeError):
+        km_byte_order(bytes(4))
+
+
+def test_decode_datagrams():
+    big = [raw_range_angle('>'), raw_range_angle('>', n_tx=1, n_rx=5)]
+    little = [raw_range_angle('<'), raw_range_angle('<', n_tx=1, n_rx=5)]
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        decoded_big = list(km_decode_datagrams(big))
+        decoded_little = list(km_decode_datagrams(little))
+
+    check_datagram(decoded_big[0])
+    assert [(d.Ntx, d.Nrx) for d in decoded_big] == [(2, 3), (1, 5)]
+    assert [bytes(d) for d in decoded_big] == [bytes(d) for d in decoded_little] == little
+    assert type(decoded_big[1]) is KMRawRangeAngle78.sized_class(1, 5)
+
+    # Datagram types without an implementation only decode the common header
+    header = struct.pack('>' + _header, 12, 0x02, KMDatagramType.clock.value, 2040, 20200102, 5)
+    (clock,) = km_decode_datagrams([header])
+    assert type(clock) is KMOutputDatagramHeader
+    assert (clock.NumberOfBytes, clock.DatagramType, clock.Time) == (12, KMDatagramType.clock, 5)
+
+
+@pytest.mark.parametrize('protocol', [2, 4, 5])
+def test_pickle_sized_datagram(protocol):
+    # The class of the datagram is created for its number of TX and RX entries, and recreated when unpickled
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        datagrams = list(km_decode_datagrams([raw_range_angle('>'), raw_range_angle('>', n_tx=1, n_rx=5)]))
+
+    buffers = []
+    data = pickle.dumps(datagrams, protocol=protocol, buffer_callback=buffers.append if protocol >= 5 else None)
+    assert len(buffers) == (len(datagrams) if protocol >= 5 else 0)
+    loaded = pickle.loads(data, buffers=buffers)
+
+    check_datagram(loaded[0])
+    assert [type(d) for d in loaded] == [KMRawRangeAngle78.sized_class(2, 3), KMRawRangeAngle78.sized_class(1, 5)]
+    assert [bytes(d) for d in loaded] == [bytes(d) for d in datagrams]
@@ -0,0 +1,236 @@
+import ctypes
+
+import numpy as np
+import pytest
+
+from pyxtf import XTFHeaderType, XTFPingChanHeader, XTFPingHeader, XTFWriter, xtf_read
+from pyxtf.vendors.reson import R7kBathymetricHeader, R7kBeamformedHeader, R7kBeamGeometryHeader, R7kDataRecordFrame, \
+    R7kRawDetectionHeader, R7kRecordType, R7kSnippetBeam, R7kSnippetHeader, r7k_bathymetry, r7k_beamformed_dtype, \
+    r7k_snippets, r7k_watercolumn, r7k_watercolumn_volume
+
+from conftest import sample_file_header
+
+
+def record(record_type: R7kRecordType, rth, data: bytes, rth_gap: int = 0) -> bytes:
+    """
+    Builds a 7k record: the data record frame (DRF), the record type header (RTH), the record data and the checksum.
+    With rth_gap, the RTH is placed after a gap given by the DRF Offset field, instead of straight after the DRF.
+    """
+    drf = R7kDataRecordFrame()
+    drf.ProtocolVersion = 5
+    drf.SyncPattern = 0x0000FFFF
+    drf.RecordTypeIdentifier = record_type.value
+    if rth_gap:
+        drf.Offset = ctypes.sizeof(R7kDataRecordFrame) - R7kDataRecordFrame.SyncPattern.offset + rth_gap
+    drf.Size = ctypes.sizeof(R7kDataRecordFrame) + rth_gap + ctypes.sizeof(rth) + len(data) + 4
+    return bytes(drf) + bytes(rth_gap) + bytes(rth) + data + bytes(4)
+
+
+def geometry(n_beams: int) -> bytes:
+    # 7004 record type header followed by the four arrays of beam angles
+    rth = R7kBeamGeometryHeader()
+    rth.Beams = n_beams
+    return bytes(rth) + np.arange(4 * n_beams, dtype='<f4').tobytes()
+
+
+def beamformed(ping_number: int, n_beams: int, n_samples: int) -> np.ndarray:
+    # Amplitude encodes the beam and sample, phase the ping
+    samples = np.zeros((n_beams, n_samples), dtype=r7k_beamformed_dtype)
+    samples['Amplitude'] = np.arange(n_beams)[:, np.newaxis] * 1000 + np.arange(n_samples)
+    samples['Phase'] = -ping_number
+    return samples
+
+
+def watercolumn_packet(ping_number: int, n_beams: int, n_samples: int, rth_gap: int = 0) -> XTFPingHeader:
+    rth = R7kBeamformedHeader()
+    rth.PingNumber = ping_number
+    rth.Beams = n_beams
+    rth.Samples = n_samples
+
+    # The samples are stored sample by sample
+    samples = beamformed(ping_number, n_beams, n_samples)
+    data = record(R7kRecordType.beamformed_data, rth, samples.T.tobytes(), rth_gap=rth_gap) + geometry(n_beams)
+
+    ping = XTFPingHeader()
+    ping.HeaderType = XTFHeaderType.reson_7018_watercolumn.value
+    ping.PingNumber = ping_number
+    ping.ping_chan_headers = [XTFPingChanHeader()]
+    ping.data = data
+    return ping
+
+
+def vendor_packet(header_type: XTFHeaderType, data: bytes) -> XTFPingHeader:
+    ping = XTFPingHeader()
+    ping.HeaderType = header_type.value
+    ping.data = data
+    return ping
+
+
+def write_packets(path: str, packets: list) -> str:
+    with XTFWriter(path, sample_file_header()) as writer:
+        for packet in packets:
+            writer.write(packet)
+    return path
+
+
+def test_watercolumn(tmp_path):
+    sizes = [(4, 6), (3, 9), (4, 2)]
+    packets = [watercolumn_packet(i, n_beams, n_samples, rth_gap=8 * i) for i, (n_beams, n_samples) in enumerate(sizes)]
+    path = write_packets(str(tmp_path / 'watercolumn.xtf'), packets)
+    (_, packets) = xtf_read(path)
+
+    for i, (ping, (n_beams, n_samples)) in enumerate(zip(packets[XTFHeaderType.reson_7018_watercolumn], sizes)):
+        rth, samples = r7k_watercolumn(ping)
+        assert (rth.PingNumber, rth.Beams, rth.Samples) == (i, n_beams, n_samples)
+        assert samples.shape == (n_beams, n_samples)
+        np.testing.assert_array_equal(samples, beamformed(i, n_beams, n_samples))
+
+    # The volume is padded to the largest number of beams and samples
+    ping_headers, rth_headers, volume = r7k_watercolumn_volume(path, volume_path=str(tmp_path / 'volume.dat'))
+    assert volume.shape == (3, 4, 9)
+    np.testing.assert_array_equal(ping_headers['PingNumber'], [0, 1, 2])
+    np.testing.assert_array_equal(rth_headers['Beams'], [4, 3, 4])
+    np.testing.assert_array_equal(rth_headers['Samples'], [6, 9, 2])
+    for i, (n_beams, n_samples) in enumerate(sizes):
+        np.testing.assert_array_equal(volume[i, :n_beams, :n_samples], beamformed(i, n_beams, n_samples))
+        assert not volume[i, n_beams:].view(np.uint8).any()
+        assert not volume[i, :, n_samples:].view(np.uint8).any()
+
+    # Temporary volume
+    _, _, temp_volume = r7k_watercolumn_volume(path)
+    np.testing.assert_array_equal(temp_volume, volume)
+
+
+def test_watercolumn_wrong_record():
+    ping = watercolumn_packet(0, 2, 2)
+    ping.data = record(R7kRecordType.side_scan, R7kBeamformedHeader(), b'')
+    with pytest.raises(RuntimeError):
+        r7k_watercolumn(ping)
+
+
+def test_watercolumn_volume_empty(sample_xtf):
+    ping_headers, rth_headers, volume = r7k_watercolumn_volume(sample_xtf)
+    assert len(ping_headers) == len(rth_headers) == 0
+    assert volume.shape == (0, 0, 0)
+
+
+# Layout of the 7027 detection entries, the older entries end after Uncertainty (22 bytes)
+detection_dtype = np.dtype([('BeamDescriptor', '<u2'), ('DetectionPoint', '<f4'), ('RxAngle', '<f4'), ('Flags', '<u4'),
+                            ('Quality', '<u4'), ('Uncertainty', '<f4'), ('Intensity', '<f4'), ('MinLimit', '<f4'),
+                            ('MaxLimit', '<f4')])
+old_detection_dtype = np.dtype(detection_dtype.descr[:6])
+
+
+def raw_detection(ping_number: int, n_detections: int, dtype: np.dtype) -> bytes:
+    rth = R7kRawDetectionHeader()
+    rth.PingNumber = ping_number
+    rth.Detections = n_detections
+    rth.DataFieldSize = dtype.itemsize
+    rth.SamplingRate = 1000.0
+    detections = np.zeros(n_detections, dtype=dtype)
+    detections['BeamDescriptor'] = np.arange(n_detections) * 2
+    detections['DetectionPoint'] = np.arange(n_detections) * 10 + 100
+    detections['RxAngle'] = np.linspace(-1, 1, n_detections)
+    detections['Quality'] = 3
+    if 'Intensity' in dtype.names:
+        detections['Intensity'] = np.arange(n_detections) + 0.5
+    return record(R7kRecordType.raw_detection, rth, detections.tobytes())
+
+
+def bathymetric(ping_number: int, n_beams: int, with_geometry: bool) -> bytes:
+    rth = R7kBathymetricHeader()
+    rth.PingNumber = ping_number
+    rth.Beams = n_beams
+    data = np.arange(n_beams, dtype='<f4').tobytes() + np.full(n_beams, 7, dtype='<u1').tobytes() + \
+        (np.arange(n_beams, dtype='<f4') + 0.25).tobytes() + bytes(8 * n_beams)
+    data = record(R7kRecordType.bathymetric_data, rth, data, rth_gap=4)
+    return data + geometry(n_beams) if with_geometry else data
+
+
+def test_bathymetry(tmp_path):
+    data = [raw_detection(10, 5, detection_dtype), raw_detection(11, 3, old_detection_dtype),
+            bathymetric(12, 4, with_geometry=True), bathymetric(13, 2, with_geometry=False)]
+    path = write_packets(str(tmp_path / 'bathy.xtf'), [vendor_packet(XTFHeaderType.reson_7125, d) for d in data])
+    (_, packets) = xtf_read(path)
+
+    beams = r7k_bathymetry(packets[XTFHeaderType.reson_7125])
+    assert beams.shape == (5 + 3 + 4 + 2,)
+    np.testing.assert_array_equal(beams['Ping'], np.repeat([0, 1, 2, 3], [5, 3, 4, 2]))
+    np.testing.assert_array_equal(beams['PingNumber'], np.repeat([10, 11, 12, 13], [5, 3, 4, 2]))
+
+    # 7027 raw detections, the travel time is given by the detection point and the sampling rate
+    np.testing.assert_array_equal(beams['Beam'][:8], [0, 2, 4, 6, 8, 0, 2, 4])
+    np.testing.assert_allclose(beams['TravelTime'][:8], [0.1, 0.11, 0.12, 0.13, 0.14, 0.1, 0.11, 0.12], rtol=1e-6)
+    np.testing.assert_allclose(beams['Angle'][:8], np.concatenate([np.linspace(-1, 1, 5), np.linspace(-1, 1, 3)]))
+    np.testing.assert_array_equal(beams['Quality'][:8], 3)
+    np.testing.assert_array_equal(beams['Intensity'][:5], np.arange(5) + 0.5)
+    assert np.isnan(beams['Intensity'][5:8]).all()
+
+    # 7006 bathymetric data, with the angles from the appended 7004 record when present
+    np.testing.assert_array_equal(beams['Beam'][8:], [0, 1, 2, 3, 0, 1])
+    np.testing.assert_array_equal(beams['TravelTime'][8:], [0, 1, 2, 3, 0, 1])
+    np.testing.assert_array_equal(beams['Quality'][8:], 7)
+    np.testing.assert_array_equal(beams['Intensity'][8:], [0.25, 1.25, 2.25, 3.25, 0.25, 1.25])
+    np.testing.assert_array_equal(beams['Angle'][8:12], [0, 1, 2, 3])
+    assert np.isnan(beams['Angle'][12:]).all()
+
+    assert r7k_bathymetry([]).shape == (0,)
+    with pytest.raises(RuntimeError):
+        r7k_bathymetry([vendor_packet(XTFHeaderType.reson_7125, record(R7kRecordType.side_scan, rth=R7kBathymetricHeader(),
+                                                                         data=bytes(100)))])
+
+
+def snippet_record(ping_number: int, beam_ranges: list, sample_type: int = 0x22) -> bytes:
+    """
+    Builds a 7008 record (RTH, beam descriptors and samples ordered beam by beam) followed by a 7004 record.
+    The amplitude of each sample is 100 * beam number + sample number.
+    """
+    rth = R7kSnippetHeader()
+    rth.PingNumber = ping_number
+    rth.Beams = len(beam_ranges)
+    rth.DataSampleType = sample_type
+    data = bytes(rth)
+
+    amplitudes = []
+    for beam_number, begin, end in beam_ranges:
+        beam = R7kSnippetBeam()
+        beam.BeamNumber, beam.BeginSample, beam.EndSample = beam_number, begin, end
+        data += bytes(beam)
+        amplitudes.append(100 * beam_number + np.arange(begin, end + 1))
+
+    sample_dtype = np.dtype([('Amplitude', '<u2'), ('Phase', '<i2')] if sample_type == 0x22 else [('Amplitude', '<u2')])
+    samples = np.zeros(sum(len(a) for a in amplitudes), dtype=sample_dtype)
+    samples['Amplitude'] = np.concatenate(amplitudes)
+    if 'Phase' in sample_dtype.names:
+        samples['Phase'] = -1
+    return data + samples.tobytes() + geometry(len(beam_ranges))
+
+
+def test_snippets(tmp_path):
+    # The first packet holds the records of two sonar heads
+    data = [snippet_record(1, [(0, 5, 8), (3, 0, 1)]) + snippet_record(1, [(7, 2, 2)], sample_type=0x02),
+            snippet_record(2, [(1, 10, 19)])]
+    path = write_packets(str(tmp_path / 'snippets.xtf'),
+                         [vendor_packet(XTFHeaderType.reson_7125_snippet, d) for d in data])
+    (_, packets) = xtf_read(path)
+
+    snippets = r7k_snippets(packets[XTFHeaderType.reson_7125_snippet])
+    assert len(snippets) == 4
+    np.testing.assert_array_equal(snippets.records['PingNumber'], [1, 1, 2])
+    np.testing.assert_array_equal(snippets.record_ping, [0, 0, 1])
+    np.testing.assert_array_equal(snippets.record_offsets, [0, 2, 3, 4])
+    np.testing.assert_array_equal(snippets.beams['BeamNumber'], [0, 3, 7, 1])
+    np.testing.assert_array_equal(snippets.offsets, [0, 4, 6, 7, 17])
+    assert snippets.samples.dtype == np.uint16
+    np.testing.assert_array_equal(snippets.beam_samples(0), [5, 6, 7, 8])
+    np.testing.assert_array_equal(snippets.beam_samples(1), [300, 301])
+    np.testing.assert_array_equal(snippets.beam_samples(2), [702])
+    np.testing.assert_array_equal(snippets.beam_samples(3), 100 + np.arange(10, 20))
+
+    # Records ordered by sample are skipped
+    rth = R7kSnippetHeader()
+    rth.Beams = 1
+    rth.RowColumnFlag = 1
+    with pytest.warns(UserWarning):
+        snippets = r7k_snippets([vendor_packet(XTFHeaderType.reson_7125_snippet, bytes(rth) + bytes(100))])
+    assert len(snippets) == 0 and len(snippets.records) == 0
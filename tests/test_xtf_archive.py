@@ -0,0 +1,119 @@
+import ctypes
+import warnings
+import zlib
+
+import numpy as np
+import pytest
+
+from pyxtf import XTFArchive, XTFHeaderType, XTFPacketStart, XTFPingChanHeader, XTFPingHeader, xtf_compress, \
+    xtf_decompress, xtf_read_gen
+from pyxtf.xtf_io import xtf_padding
+
+from conftest import write_sample_xtf
+
+
+def read_bytes(path: str) -> bytes:
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+@pytest.fixture
+def archive_xtf(tmp_path) -> str:
+    # Sample file ending with two packets of an unknown type (without time fields)
+    path = write_sample_xtf(str(tmp_path / 'archive.xtf'))
+    with open(path, 'ab') as f:
+        for i in range(2):
+            packet = XTFPacketStart()
+            packet.MagicNumber = 0xFACE
+            packet.HeaderType = 200
+            packet.NumBytesThisRecord = xtf_padding(ctypes.sizeof(XTFPacketStart) + 10)
+            f.write(bytes(packet) + bytes([i]) * (packet.NumBytesThisRecord - ctypes.sizeof(XTFPacketStart)))
+    return path
+
+
+def read_all(path: str, **kwargs) -> list:
+    gen = xtf_read_gen(path, **kwargs)
+    next(gen)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        return [bytes(p) for p in gen]
+
+
+@pytest.mark.parametrize('codec', ['zlib', 'lzma'])
+@pytest.mark.parametrize('shuffle', [0, 2, 3])
+@pytest.mark.parametrize('block_size', [1, 4096, 4 * 1024 * 1024])
+def test_round_trip(archive_xtf, tmp_path, codec, shuffle, block_size):
+    archive_path = str(tmp_path / 'archive.xtfz')
+    n_packets = xtf_compress(archive_xtf, archive_path, codec=codec, shuffle=shuffle, block_size=block_size)
+    assert n_packets == 40 * 4 + 2
+
+    out_path = str(tmp_path / 'out.xtf')
+    xtf_decompress(archive_path, out_path)
+    assert read_bytes(out_path) == read_bytes(archive_xtf)
+
+    with XTFArchive(archive_path) as archive:
+        assert len(archive) == n_packets
+        assert archive.shuffle == shuffle
+        assert (len(archive.blocks) == 1) == (block_size > len(read_bytes(archive_xtf)))
+        assert archive.packets['type'][-1] == 200
+        assert np.isnat(archive.packets['time'][-1])
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            assert [bytes(p) for p in archive.read()] == read_all(archive_xtf)
+
+
+def test_select(archive_xtf, tmp_path):
+    archive_path = str(tmp_path / 'archive.xtfz')
+    xtf_compress(archive_xtf, archive_path, shuffle=2, block_size=4096)
+
+    start, end = np.datetime64('2020-01-02T03:00:10'), np.datetime64('2020-01-02T03:00:20')
+    with XTFArchive(archive_path) as archive:
+        # Only the blocks with packets in the selection are decompressed
+        blocks_read = []
+        read_block = archive.read_block
+        archive.read_block = lambda i: blocks_read.append(i) or read_block(i)
+
+        packets = list(archive.read(types=[XTFHeaderType.attitude], start=start, end=end))
+        assert len(packets) == 20
+        assert all(p.HeaderType == XTFHeaderType.attitude for p in packets)
+        assert all(start <= p.get_time() < end for p in packets)
+        expected = read_all(archive_xtf, types=[XTFHeaderType.attitude])[20:40]
+        assert [bytes(p) for p in packets] == expected
+        selected_blocks = np.unique(archive.packets['block'][archive.select([XTFHeaderType.attitude], start, end)])
+        assert blocks_read == selected_blocks.tolist()
+        assert len(blocks_read) < len(archive.blocks)
+
+        # Packets without time follow the previous packet with time
+        assert len(archive.select(start=np.datetime64('2020-01-02T03:00:39'))) == 4 + 2
+        assert len(archive.select(end=np.datetime64('2020-01-02T03:00:39'))) == 39 * 4
+
+
+def test_shuffle_samples_only(archive_xtf, tmp_path):
+    archive_path = str(tmp_path / 'archive.xtfz')
+    xtf_compress(archive_xtf, archive_path, shuffle=2, block_size=4096)
+    xtf_bytes = read_bytes(archive_xtf)
+
+    # The sample table lists the sample arrays of the sonar pings
+    gen = xtf_read_gen(archive_xtf, types=[XTFHeaderType.sonar])
+    next(gen)
+    pings = list(gen)
+    with XTFArchive(archive_path) as archive:
+        assert len(archive.samples) == 2 * len(pings)
+        block_starts = archive.packets['xtf_offset'][np.searchsorted(archive.packets['block'],
+                                                                     np.arange(len(archive.blocks)))]
+        sample_starts = block_starts[archive.samples['block']] + archive.samples['offset']
+        expected = [samples.tobytes() for ping in pings for samples in ping.data]
+        assert [xtf_bytes[start:start + size] for start, size in zip(sample_starts, archive.samples['size'])] == \
+            expected
+
+        # The headers are stored unchanged at the start of the block, followed by the shuffled samples
+        block_samples = archive.samples[archive.samples['block'] == 0]
+        (offset, size, raw_size) = archive.blocks[0]
+        stored = zlib.decompress(read_bytes(archive_path)[offset:offset + size])
+        block = xtf_bytes[block_starts[0]:block_starts[0] + raw_size]
+        n_ping = ctypes.sizeof(XTFPingHeader) + ctypes.sizeof(XTFPingChanHeader)
+        assert stored[:n_ping] == block[:n_ping]
+        n_samples = int(block_samples['size'].sum())
+        samples = b''.join(block[o:o + n] for o, n in zip(block_samples['offset'], block_samples['size']))
+        samples = np.frombuffer(samples, dtype=np.uint16)
+        assert stored[len(stored) - n_samples:] == samples.view(np.uint8).reshape(-1, 2).T.tobytes()
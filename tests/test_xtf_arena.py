@@ -0,0 +1,77 @@
+import os
+
+import numpy as np
+import pytest
+
+from pyxtf import XTFArena, XTFHeaderType, XTFSpillArena, xtf_read_gen
+
+from conftest import write_sample_xtf
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+
+def packet_bytes(packets) -> list:
+    # The headers and data of each packet (the file header first)
+    return [type(p).__name__.encode() + p.to_bytes() for p in packets]
+
+
+@pytest.mark.parametrize('index', [True, False], ids=['index', 'no_index'])
+@pytest.mark.parametrize('prefetch', [0, 2])
+@pytest.mark.parametrize('slab_size,copy', [(4 * 1024 * 1024, False), (1000, False), (4096, True)],
+                         ids=['slab', 'small_slab', 'copy'])
+def test_arena_matches_plain(tmp_path, index, prefetch, slab_size, copy):
+    path = write_sample_xtf(str(tmp_path / 'arena.xtf'), save_index=index)
+    expected = packet_bytes(xtf_read_gen(path))
+
+    # The packets are all kept, so the arrays carved out of the slabs must not be overwritten by later packets
+    arena = XTFArena(slab_size=slab_size, copy=copy)
+    packets = list(xtf_read_gen(path, prefetch=prefetch, max_read=1000, arena=arena))
+    assert packet_bytes(packets) == expected
+
+    pings = [p for p in packets[1:] if p.HeaderType == XTFHeaderType.sonar]
+    assert all(not samples.flags.owndata for ping in pings for samples in ping.data)
+    assert arena.n_packets == len(packets) - 1
+    if not copy and slab_size > 1000:
+        # A few record buffers and slabs rather than an allocation per sample array
+        assert arena.allocations_per_packet < 0.1
+
+
+def test_arena_types(sample_xtf):
+    arena = XTFArena()
+    expected = packet_bytes(xtf_read_gen(sample_xtf, types=[XTFHeaderType.sonar]))
+    assert packet_bytes(xtf_read_gen(sample_xtf, types=[XTFHeaderType.sonar], arena=arena)) == expected
+    assert arena.n_packets == len(expected) - 1
+
+
+@pytest.mark.parametrize('max_memory', [0, 10000, 2 ** 30])
+def test_spill_arena_matches_plain(sample_xtf, tmp_path, max_memory):
+    expected = packet_bytes(xtf_read_gen(sample_xtf))
+    arena = XTFSpillArena(max_memory=max_memory, spill_dir=str(tmp_path), slab_size=4096)
+    assert packet_bytes(xtf_read_gen(sample_xtf, arena=arena)) == expected
+
+    assert arena.n_bytes_memory <= max_memory
+    assert (arena.n_bytes_spilled > 0) == (max_memory < 2 ** 30)
+
+
+@pytest.mark.skipif(resource is None or not os.path.isdir('/proc/self/fd'), reason='Needs resource limits and /proc')
+def test_spill_arena_file_descriptors(tmp_path):
+    # More spilled slabs than the process may open files, the slabs share a few memory-mapped files
+    n_open = len(os.listdir('/proc/self/fd'))
+    (soft, hard) = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (n_open + 32, hard))
+    try:
+        arena = XTFSpillArena(max_memory=0, spill_dir=str(tmp_path), slab_size=4096, spill_size=1024 * 1024)
+        slabs = [arena.allocate(4096) for _ in range(2 * (n_open + 32))]
+        for i, slab in enumerate(slabs):
+            slab[:] = i % 256
+    finally:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (soft, hard))
+
+    assert all(np.all(slab == i % 256) for i, slab in enumerate(slabs))
+    assert arena.n_bytes_memory == 0
+    assert arena.n_bytes_spilled == 4096 * len(slabs)
+    assert arena.n_spill_files == -(-4096 * len(slabs) // (1024 * 1024))
+    assert len(os.listdir('/proc/self/fd')) <= n_open + arena.n_spill_files
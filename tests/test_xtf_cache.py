@@ -0,0 +1,98 @@
+import json
+import multiprocessing
+import os
+
+import numpy as np
+import pytest
+
+from pyxtf import XTFCache, XTFHeaderType, xtf_read
+
+from conftest import write_sample_xtf
+
+
+def entry_dirs(directory: str) -> list:
+    return sorted(name for name in os.listdir(directory) if os.path.isdir(os.path.join(directory, name)))
+
+
+def manifest_keys(directory: str) -> list:
+    with open(os.path.join(directory, XTFCache.manifest_name)) as f:
+        return sorted(json.load(f))
+
+
+def test_cache_read(sample_xtf, tmp_path):
+    cache = XTFCache(str(tmp_path / 'cache'))
+    (_, tables) = xtf_read(sample_xtf, columnar=True)
+    for _ in range(2):
+        (_, cached) = cache.read(sample_xtf)
+        assert set(cached) == set(tables)
+        for p_headertype, table in tables.items():
+            np.testing.assert_array_equal(cached[p_headertype].headers, table.headers)
+            np.testing.assert_array_equal(cached[p_headertype].payload, table.payload)
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    pings = cache.read_pings(sample_xtf)
+    assert len(pings) == len(tables[XTFHeaderType.sonar])
+
+    # A changed file replaces its entries
+    write_sample_xtf(sample_xtf, n_pings=10)
+    os.utime(sample_xtf, ns=(0, 0))
+    (_, cached) = cache.read(sample_xtf)
+    assert len(cached[XTFHeaderType.sonar]) == 10
+    assert len(manifest_keys(cache.directory)) == 1
+    assert entry_dirs(cache.directory) == manifest_keys(cache.directory)
+
+
+def _fill(directory: str, paths: list):
+    cache = XTFCache(directory)
+    for path in paths:
+        cache.read(path)
+
+
+@pytest.mark.skipif('fork' not in multiprocessing.get_all_start_methods(), reason='Requires fork')
+def test_cache_concurrent_processes(tmp_path):
+    paths = [write_sample_xtf(str(tmp_path / 'file{}.xtf'.format(i)), n_pings=5 + i) for i in range(8)]
+    directory = str(tmp_path / 'cache')
+    XTFCache(directory)
+
+    # Every process fills the cache with all files, in a different order
+    ctx = multiprocessing.get_context('fork')
+    processes = [ctx.Process(target=_fill, args=(directory, paths[i:] + paths[:i])) for i in range(4)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+        assert process.exitcode == 0
+
+    # No entry is lost from the manifest, and every entry directory is listed
+    assert len(manifest_keys(directory)) == len(paths)
+    assert entry_dirs(directory) == manifest_keys(directory)
+
+
+def test_cache_removes_orphans(sample_xtf, tmp_path):
+    directory = str(tmp_path / 'cache')
+    cache = XTFCache(directory)
+    cache.read(sample_xtf)
+
+    # An entry missing from the manifest, the temporary directory of a killed process, and one being written
+    orphan = os.path.join(directory, '0' * 40 + '_packets')
+    os.makedirs(orphan)
+    np.save(os.path.join(orphan, 'headers.npy'), np.zeros(1000))
+    stale_tmp = os.path.join(directory, '.tmp_stale')
+    os.makedirs(stale_tmp)
+    open(os.path.join(stale_tmp, XTFCache.lock_name), 'w').close()
+    (active_tmp, f_active_lock) = cache._create_tmp_dir()
+    unrelated = os.path.join(directory, 'notes')
+    os.makedirs(unrelated)
+
+    try:
+        cache.read_pings(sample_xtf)
+        assert not os.path.exists(orphan)
+        assert not os.path.exists(stale_tmp)
+        assert os.path.isdir(active_tmp)
+        assert os.path.isdir(unrelated)
+    finally:
+        f_active_lock.close()
+
+    cache.clear()
+    assert entry_dirs(directory) == ['notes']
+    assert cache.size() == 0
@@ -0,0 +1,67 @@
+import tracemalloc
+
+import numpy as np
+import pytest
+
+from pyxtf import LocalStorage, XTFAttitudeData, XTFHeaderType, XTFWriter, xtf_read, xtf_read_batches
+
+from conftest import sample_file_header, write_sample_xtf
+
+
+def check_table(table, packets):
+    # The table holds the same headers and data as the packet objects read by xtf_read
+    assert len(table) == len(packets)
+    for i, packet in enumerate(packets):
+        assert table.packet_bytes(i) == table.headers[i:i + 1].tobytes() + table.packet_payload(i).tobytes()
+        assert table.headers[i:i + 1].tobytes() == bytes(packet)[:table.headers.dtype.itemsize]
+        assert bytes(table.packet(i)) == bytes(packet)
+    for name in ['NumBytesThisRecord', 'HeaderType']:
+        np.testing.assert_array_equal(table[name], [getattr(p, name) for p in packets])
+
+
+@pytest.mark.parametrize('n_samples', [120, None], ids=['even', 'uneven'])
+@pytest.mark.parametrize('storage', [False, True], ids=['path', 'storage'])
+def test_columnar_matches_objects(tmp_path, n_samples, storage):
+    path = write_sample_xtf(str(tmp_path / 'columnar.xtf'), n_samples=n_samples)
+    (_, packets) = xtf_read(path)
+    source = LocalStorage(path) if storage else path
+    (_, tables) = xtf_read(source, columnar=True)
+
+    assert set(tables) == set(packets)
+    for p_headertype, table in tables.items():
+        check_table(table, packets[p_headertype])
+        for ping, table_ping in zip(packets[p_headertype], table.objects()):
+            if p_headertype == XTFHeaderType.sonar:
+                for samples, table_samples in zip(ping.data, table_ping.data):
+                    np.testing.assert_array_equal(samples, table_samples)
+
+    # The batches together hold the same packets
+    batches = {}
+    for table in xtf_read_batches(source, batch_size=7):
+        assert len(table) <= 7
+        batches.setdefault(table.header_type, []).append(table)
+    for p_headertype, type_batches in batches.items():
+        np.testing.assert_array_equal(np.concatenate([t.headers for t in type_batches]), tables[p_headertype].headers)
+        np.testing.assert_array_equal(np.concatenate([t.payload for t in type_batches]), tables[p_headertype].payload)
+
+
+def test_columnar_memory(tmp_path):
+    # Gathering the headers must not build an index per header byte
+    path = str(tmp_path / 'attitude.xtf')
+    n_packets = 20000
+    with XTFWriter(path, sample_file_header(), save_index=True) as writer:
+        for i in range(n_packets):
+            att = XTFAttitudeData()
+            att.Pitch = i
+            writer.write(att)
+
+    tracemalloc.start()
+    try:
+        (_, tables) = xtf_read(path, types=[XTFHeaderType.attitude], columnar=True)
+        (_, peak) = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    table = tables[XTFHeaderType.attitude]
+    np.testing.assert_array_equal(table['Pitch'], np.arange(n_packets))
+    assert peak < 4 * (table.headers.nbytes + table.payload.nbytes)
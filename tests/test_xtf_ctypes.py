@@ -0,0 +1,90 @@
+import pickle
+
+import numpy as np
+import pytest
+
+from pyxtf import XTFChannelType, XTFFileHeader, XTFHeaderType, XTFPingHeader, XTFSampleFormat, XTFWriter, \
+    concatenate_channel, xtf_read
+from pyxtf.xtf_ctypes import ibm_to_ieee
+
+
+def to_ibm(values: np.ndarray) -> np.ndarray:
+    # Reference encoder, one value at a time
+    out = []
+    for value in values:
+        if value == 0:
+            out.append(0)
+            continue
+        sign = 0x80000000 if value < 0 else 0
+        value, exponent = abs(value), 64
+        while value >= 1:
+            value /= 16
+            exponent += 1
+        while value < 1 / 16:
+            value *= 16
+            exponent -= 1
+        out.append(sign | (exponent << 24) | int(round(value * 2 ** 24)) & 0xFFFFFF)
+    return np.array(out, dtype=np.uint32)
+
+
+def test_ibm_to_ieee():
+    values = np.array([0, 1, -1, 0.5, 118.625, -3.75e-5, 12345.5], dtype=np.float32)
+    out = ibm_to_ieee(to_ibm(values))
+    assert out.dtype == np.float32
+    np.testing.assert_allclose(out, values, rtol=1e-6)
+    assert ibm_to_ieee(np.array([0xC276A000], dtype=np.uint32))[0] == -118.625
+
+
+def test_subbottom_ibm_pings(tmp_path):
+    # A single subbottom channel is not part of sonar_info, and is found through the channel number
+    file_header = XTFFileHeader()
+    file_header.ChanInfo[0].TypeOfChannel = XTFChannelType.subbottom.value
+    file_header.ChanInfo[0].BytesPerSample = 4
+    file_header.ChanInfo[0].SampleFormat = XTFSampleFormat.ibm_float.value
+
+    values = [np.linspace(-100, 100, 50 + i, dtype=np.float32) for i in range(4)]
+    path = str(tmp_path / 'subbottom.xtf')
+    with XTFWriter(path, file_header) as writer:
+        for i, samples in enumerate(values):
+            ping = XTFPingHeader()
+            ping.Year, ping.Month, ping.Day, ping.Second = 2020, 1, 1, i
+            writer.write_sonar([to_ibm(samples)], ping=ping)
+
+    file_header, packets = xtf_read(path)
+    assert file_header.sonar_info == []
+    pings = packets[XTFHeaderType.sonar]
+    assert len(pings) == len(values)
+    for ping, samples in zip(pings, values):
+        assert ping.data[0].dtype == np.float32
+        np.testing.assert_allclose(ping.data[0], samples, rtol=1e-6, atol=1e-5)
+
+    waterfall = concatenate_channel(pings, file_header, 0)
+    assert waterfall.dtype == np.float32
+    assert waterfall.shape == (len(values), 53)
+
+
+@pytest.mark.parametrize('protocol,out_of_band', [(2, False), (4, False), (5, False), (5, True)],
+                         ids=['2', '4', '5', '5_out_of_band'])
+def test_pickle_pings(sample_xtf, protocol, out_of_band):
+    (_, packets) = xtf_read(sample_xtf)
+    pings = packets[XTFHeaderType.sonar]
+
+    buffers = []
+    data = pickle.dumps(pings, protocol=protocol, buffer_callback=buffers.append if out_of_band else None)
+    if out_of_band:
+        # The structures and the sample arrays are passed as buffers, without copying them into the pickle
+        n_samples = sum(samples.nbytes for ping in pings for samples in ping.data)
+        assert len(buffers) == sum(1 + len(ping.ping_chan_headers) + len(ping.data) for ping in pings)
+        assert len(data) < n_samples
+        loaded = pickle.loads(data, buffers=buffers)
+    else:
+        loaded = pickle.loads(data)
+
+    assert len(loaded) == len(pings)
+    for ping, loaded_ping in zip(pings, loaded):
+        assert type(loaded_ping) is XTFPingHeader
+        assert bytes(loaded_ping) == bytes(ping)
+        assert [bytes(c) for c in loaded_ping.ping_chan_headers] == [bytes(c) for c in ping.ping_chan_headers]
+        for samples, loaded_samples in zip(ping.data, loaded_ping.data):
+            assert loaded_samples.dtype == samples.dtype
+            np.testing.assert_array_equal(loaded_samples, samples)
@@ -0,0 +1,186 @@
+import os
+import pickle
+
+import numpy as np
+import pytest
+
+from pyxtf import XTFAttitudeData, XTFHeaderType, XTFNotesHeader, XTFPingHeader, XTFWriter, xtf_filter, xtf_merge, \
+    xtf_read, xtf_read_gen, xtf_read_index, xtf_scan, xtf_split
+from pyxtf.xtf_io import xtf_index_path
+
+from conftest import sample_file_header, set_time
+
+
+def read_bytes(path: str) -> bytes:
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def check_index(path: str):
+    # The index written with the file must match the index found by scanning the packet headers
+    path_idx = xtf_index_path(path)
+    with open(path_idx, 'rb') as f:
+        saved_idx = pickle.load(f)
+    os.remove(path_idx)
+    scanned_idx = xtf_read_index(path)
+    assert {k: list(v) for k, v in saved_idx.items()} == scanned_idx
+
+
+def count_calls(monkeypatch, name: str) -> list:
+    calls = []
+    func = getattr(os, name)
+
+    def wrapper(*args):
+        calls.append(args)
+        return func(*args)
+
+    monkeypatch.setattr(os, name, wrapper)
+    return calls
+
+
+def disable(monkeypatch, name: str):
+    def fail(*args):
+        pytest.fail('os.{} used as fallback'.format(name))
+
+    if hasattr(os, name):
+        monkeypatch.setattr(os, name, fail)
+
+
+def test_scan(sample_xtf, tmp_path):
+    path = str(tmp_path / 'times.xtf')
+    with XTFWriter(path, sample_file_header()) as writer:
+        ping = XTFPingHeader()
+        set_time(ping, 3)
+        ping.HSeconds = 45
+        writer.write_sonar([np.zeros(10, dtype=np.uint16)] * 2, ping=ping)
+
+        # An invalid date has no time
+        ping.Month, ping.Day = 2, 30
+        writer.write_sonar([np.zeros(10, dtype=np.uint16)] * 2, ping=ping)
+
+        # The epoch time takes precedence over the date fields
+        att = XTFAttitudeData()
+        set_time(att, 4)
+        att.Millisecond = 250
+        writer.write(att)
+        att.SourceEpoch, att.EpochMicroseconds = 1577934000, 12
+        writer.write(att)
+
+        notes = XTFNotesHeader()
+        set_time(notes, 5)
+        writer.write(notes)
+
+    for scan_path in [sample_xtf, path]:
+        packets = [p for p in xtf_read_gen(scan_path)][1:]
+        scanned = xtf_scan(scan_path, with_time=True)
+        assert list(scanned['offset']) == sorted(loc for locs in xtf_read_index(scan_path).values() for loc in locs)
+        assert list(scanned['size']) == [p.NumBytesThisRecord for p in packets]
+        assert list(scanned['type']) == [p.HeaderType for p in packets]
+        for p, p_time in zip(packets, scanned['time']):
+            try:
+                assert p_time == np.datetime64(p.get_time(), 'us')
+            except ValueError:
+                assert np.isnat(p_time)
+        assert np.all(np.isnat(xtf_scan(scan_path)['time']))
+
+    assert np.isnat(scanned['time'][1])
+    assert scanned['time'][3] == np.datetime64('2020-01-02T03:00:00.000012')
+
+
+def test_split_merge_round_trip(sample_xtf, tmp_path):
+    out_paths = xtf_split(sample_xtf, np.timedelta64(10, 's'), out_path=str(tmp_path / 'piece_{0:03d}.xtf'))
+    assert len(out_paths) == 4
+    for path in out_paths:
+        check_index(path)
+
+    merged_path = str(tmp_path / 'merged.xtf')
+    n_packets = xtf_merge(out_paths, merged_path)
+    assert n_packets == sum(len(v) for v in xtf_read_index(sample_xtf).values())
+    assert read_bytes(merged_path) == read_bytes(sample_xtf)
+    check_index(merged_path)
+
+
+def test_split_appends_to_earlier_piece(tmp_path, monkeypatch):
+    # The pings jump back and forth between two intervals, the pieces of each interval go to the same file
+    seconds = [0, 1, 30, 2, 31, 3]
+    path = str(tmp_path / 'jumps.xtf')
+    with XTFWriter(path, sample_file_header()) as writer:
+        for i, second in enumerate(seconds):
+            ping = XTFPingHeader()
+            set_time(ping, second)
+            ping.PingNumber = i
+            writer.write_sonar([np.full(50, i, dtype=np.uint16), np.full(60, i, dtype=np.uint16)], ping=ping)
+
+    # Appended pieces are copied with copy_file_range as well, without falling back
+    if hasattr(os, 'copy_file_range'):
+        copy_calls = count_calls(monkeypatch, 'copy_file_range')
+        disable(monkeypatch, 'sendfile')
+    out_paths = xtf_split(path, np.timedelta64(10, 's'), out_path=str(tmp_path / 'piece_{0:03d}.xtf'))
+    assert len(out_paths) == 2
+    if hasattr(os, 'copy_file_range'):
+        assert len(copy_calls) >= len(seconds) - 1
+
+    (_, packets) = xtf_read(path)
+    for out_path, ping_numbers in zip(out_paths, [[0, 1, 3, 5], [2, 4]]):
+        check_index(out_path)
+        (_, out_packets) = xtf_read(out_path)
+        assert [ping.PingNumber for ping in out_packets[XTFHeaderType.sonar]] == ping_numbers
+        for ping in out_packets[XTFHeaderType.sonar]:
+            assert bytes(ping) == bytes(packets[XTFHeaderType.sonar][ping.PingNumber])
+            assert np.all(ping.data[0] == ping.PingNumber)
+
+
+@pytest.mark.parametrize('method', ['copy_file_range', 'sendfile', 'write'])
+def test_copy_methods(sample_xtf, tmp_path, monkeypatch, method):
+    # Each method copies the whole range when the previous methods are not available
+    if method != 'write' and not hasattr(os, method):
+        pytest.skip('os.{} is not available'.format(method))
+
+    if method == 'copy_file_range':
+        disable(monkeypatch, 'sendfile')
+    elif method == 'sendfile':
+        monkeypatch.delattr(os, 'copy_file_range', raising=False)
+    else:
+        monkeypatch.delattr(os, 'copy_file_range', raising=False)
+        monkeypatch.delattr(os, 'sendfile', raising=False)
+    calls = count_calls(monkeypatch, method)
+
+    out_path = str(tmp_path / 'copy.xtf')
+    xtf_filter(sample_xtf, out_path)
+    assert len(calls) > (1 if method == 'write' else 0)  # The file header is written with os.write
+    assert read_bytes(out_path) == read_bytes(sample_xtf)
+    check_index(out_path)
+
+
+def test_copy_method_fallback(sample_xtf, tmp_path, monkeypatch):
+    # A copy method failing partway continues with the next method from where it stopped
+    if not hasattr(os, 'copy_file_range'):
+        pytest.skip('os.copy_file_range is not available')
+    copy_file_range = os.copy_file_range
+
+    def partial_copy(src_fd, dst_fd, count, offset_src=None, *args):
+        if count < 1000:
+            raise OSError('Not supported')
+        return copy_file_range(src_fd, dst_fd, count // 2, offset_src)
+
+    monkeypatch.setattr(os, 'copy_file_range', partial_copy)
+    monkeypatch.delattr(os, 'sendfile', raising=False)
+
+    out_path = str(tmp_path / 'copy.xtf')
+    xtf_filter(sample_xtf, out_path)
+    assert read_bytes(out_path) == read_bytes(sample_xtf)
+
+
+def test_filter(sample_xtf, tmp_path):
+    out_path = str(tmp_path / 'filtered.xtf')
+    start, end = np.datetime64('2020-01-02T03:00:05'), np.datetime64('2020-01-02T03:00:15')
+    n_packets = xtf_filter(sample_xtf, out_path, exclude=[XTFHeaderType.navigation], start=start, end=end)
+    check_index(out_path)
+
+    (_, packets) = xtf_read(sample_xtf)
+    (_, out_packets) = xtf_read(out_path)
+    assert set(out_packets) == {XTFHeaderType.sonar, XTFHeaderType.attitude}
+    assert n_packets == sum(len(v) for v in out_packets.values())
+    for p_headertype, out_list in out_packets.items():
+        expected = [p for p in packets[p_headertype] if start <= p.get_time() < end]
+        assert [bytes(p) for p in out_list] == [bytes(p) for p in expected]
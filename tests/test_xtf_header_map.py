@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+
+from pyxtf import XTFHeaderMap, XTFHeaderType, XTFPingHeader, xtf_read, xtf_read_index
+
+from conftest import write_sample_xtf
+
+
+def read_bytes(path: str) -> bytes:
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def header_mask(path: str, header_type: XTFHeaderType) -> np.ndarray:
+    # True for the bytes of the packet headers of the given type
+    mask = np.zeros(len(read_bytes(path)), dtype=bool)
+    for loc in xtf_read_index(path)[header_type]:
+        mask[loc:loc + XTFPingHeader.np_dtype().itemsize] = True
+    return mask
+
+
+@pytest.mark.parametrize('n_samples', [120, None], ids=['strided', 'gather'])
+def test_header_map_write(tmp_path, n_samples):
+    path = write_sample_xtf(str(tmp_path / 'map.xtf'), n_samples=n_samples)
+    before = np.frombuffer(read_bytes(path), dtype=np.uint8)
+
+    with XTFHeaderMap(path, XTFHeaderType.sonar) as headers:
+        assert (headers._view is not None) == (n_samples is not None)
+        assert len(headers) == 40
+        np.testing.assert_array_equal(headers['PingNumber'], np.arange(40))
+
+        headers['SensorXcoordinate'] = headers['SensorXcoordinate'] + 0.5
+        headers['SensorHeading'] = 123.0
+        headers.update({'ReservedSpace2': np.arange(40 * 6, dtype=np.uint8).reshape(40, 6)})
+
+    after = np.frombuffer(read_bytes(path), dtype=np.uint8)
+    assert len(after) == len(before)
+
+    # Only the headers of the mapped type are changed, the channel headers, samples and other packets are untouched
+    mask = header_mask(path, XTFHeaderType.sonar)
+    np.testing.assert_array_equal(after[~mask], before[~mask])
+    assert np.any(after[mask] != before[mask])
+
+    (_, packets) = xtf_read(path)
+    pings = packets[XTFHeaderType.sonar]
+    for i, ping in enumerate(pings):
+        assert ping.SensorXcoordinate == 10.5 + i
+        assert ping.SensorYcoordinate == 60.0 - i
+        assert ping.SensorHeading == 123.0
+        assert list(ping.ReservedSpace2) == list(range(i * 6, i * 6 + 6))
+        assert ping.PingNumber == i
+        assert np.all(ping.data[1] == (np.arange(len(ping.data[1])) + i * 3 + 1))
+
+
+def test_header_map_read_only(sample_xtf):
+    before = read_bytes(sample_xtf)
+    with XTFHeaderMap(sample_xtf, XTFHeaderType.attitude, mode='r') as headers:
+        assert len(headers) == 80
+        np.testing.assert_array_equal(headers['Pitch'], np.repeat(np.arange(40), 2) + np.tile([0.0, 0.5], 40))
+        with pytest.raises(ValueError):
+            headers['Pitch'] = 0.0
+    assert read_bytes(sample_xtf) == before
@@ -0,0 +1,156 @@
+import bz2
+import gzip
+import lzma
+import os
+import threading
+
+import numpy as np
+import pytest
+
+from pyxtf import LocalStorage, XTFHeaderType, xtf_read_gen, xtf_read_index, xtf_read_stream
+from pyxtf import xtf_io
+from pyxtf.xtf_io import xtf_index_path
+from pyxtf.xtf_prefetch import PrefetchStream
+
+from conftest import write_sample_xtf
+
+
+def packet_bytes(packets) -> list:
+    # The headers and data of each packet (the file header first)
+    return [type(p).__name__.encode() + p.to_bytes() for p in packets]
+
+
+@pytest.mark.parametrize('ext,compress', [('.gz', gzip.compress), ('.xz', lzma.compress), ('.bz2', bz2.compress)],
+                         ids=['gz', 'xz', 'bz2'])
+def test_read_stream_compressed(sample_xtf, tmp_path, ext, compress):
+    expected = packet_bytes(xtf_read_gen(sample_xtf))
+    path = str(tmp_path / 'sample.xtf') + ext
+    with open(sample_xtf, 'rb') as f_src, open(path, 'wb') as f_dst:
+        f_dst.write(compress(f_src.read()))
+
+    assert packet_bytes(xtf_read_stream(path)) == expected
+
+    # Skipped packets are read past without decoding
+    pings = packet_bytes(xtf_read_stream(path, types=[XTFHeaderType.sonar]))
+    assert pings == expected[:1] + packet_bytes(xtf_read_gen(sample_xtf, types=[XTFHeaderType.sonar]))[1:]
+
+
+def test_read_stream_pipe(tmp_path):
+    # The writer sends the file in small pieces, so that reads return short and packets span several reads
+    path = write_sample_xtf(str(tmp_path / 'pipe.xtf'), n_samples=3000)
+    expected = packet_bytes(xtf_read_gen(path))
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    (fd_read, fd_write) = os.pipe()
+
+    def send():
+        with os.fdopen(fd_write, 'wb', buffering=0) as f_write:
+            for i in range(0, len(data), 1000):
+                f_write.write(data[i:i + 1000])
+
+    sender = threading.Thread(target=send)
+    sender.start()
+    try:
+        with os.fdopen(fd_read, 'rb', buffering=0) as f_read:
+            assert packet_bytes(xtf_read_stream(f_read)) == expected
+    finally:
+        sender.join()
+
+
+def test_read_stream_truncated(sample_xtf, tmp_path):
+    path = str(tmp_path / 'truncated.xtf.gz')
+    with open(sample_xtf, 'rb') as f_src, gzip.open(path, 'wb') as f_dst:
+        f_dst.write(f_src.read()[:-10])
+
+    with pytest.raises(RuntimeError):
+        list(xtf_read_stream(path))
+
+
+def record_ranges(monkeypatch) -> list:
+    # Records the (offset, size) ranges read by xtf_read_gen with an index
+    ranges = []
+    read_ranges = xtf_io._xtf_read_ranges
+
+    def wrapper(f, file_ranges):
+        file_ranges = list(file_ranges)
+        ranges.extend(file_ranges)
+        return read_ranges(f, file_ranges)
+
+    monkeypatch.setattr(xtf_io, '_xtf_read_ranges', wrapper)
+    return ranges
+
+
+@pytest.mark.parametrize('types', [None, [XTFHeaderType.sonar], [XTFHeaderType.attitude, XTFHeaderType.navigation]],
+                         ids=['all', 'sonar', 'attitude'])
+@pytest.mark.parametrize('max_gap,max_read', [(0, 2 ** 30), (64 * 1024, 1000), (64 * 1024, 10000),
+                                              (64 * 1024, 2 ** 30)])
+def test_coalesced_reads(tmp_path, monkeypatch, types, max_gap, max_read):
+    path = write_sample_xtf(str(tmp_path / 'coalesce.xtf'), save_index=True)
+
+    # Each packet read separately
+    ranges = record_ranges(monkeypatch)
+    expected = packet_bytes(xtf_read_gen(path, types=types, max_gap=-1))
+    (packet_starts, packet_sizes) = np.array(ranges).T
+    assert len(packet_starts) == len(expected) - 1
+    n_contiguous = 1 + np.count_nonzero(packet_starts[1:] != packet_starts[:-1] + packet_sizes[:-1])
+
+    del ranges[:]
+    assert packet_bytes(xtf_read_gen(path, types=types, max_gap=max_gap, max_read=max_read)) == expected
+
+    # The reads cover the packets in order, a read is larger than max_read only if it holds a single packet
+    n_range_packets = [np.count_nonzero((packet_starts >= offset) & (packet_starts < offset + size))
+                       for offset, size in ranges]
+    assert sum(n_range_packets) == len(packet_starts)
+    assert all(size <= max_read or n == 1 for (_, size), n in zip(ranges, n_range_packets))
+    if max_read == 2 ** 30:
+        # Without gaps, only contiguous packets are read together (the gaps between the selected packets are small)
+        assert len(ranges) == (n_contiguous if max_gap == 0 else 1)
+
+
+@pytest.mark.parametrize('index', [True, False], ids=['index', 'no_index'])
+@pytest.mark.parametrize('types', [None, [XTFHeaderType.sonar]], ids=['all', 'sonar'])
+@pytest.mark.parametrize('max_read', [1000, 2 ** 20])
+@pytest.mark.parametrize('prefetch', [1, 4])
+def test_prefetch(tmp_path, index, types, max_read, prefetch):
+    path = write_sample_xtf(str(tmp_path / 'prefetch.xtf'), save_index=index)
+    expected = packet_bytes(xtf_read_gen(path, types=types))
+
+    assert packet_bytes(xtf_read_gen(path, types=types, max_read=max_read, prefetch=prefetch)) == expected
+    with LocalStorage(path) as storage:
+        assert packet_bytes(xtf_read_gen(storage, types=types, max_read=max_read, prefetch=prefetch)) == expected
+
+
+def test_prefetch_save_index(sample_xtf):
+    # Without an index, the prefetched stream records the packet positions
+    expected = xtf_read_index(sample_xtf)
+    list(xtf_read_gen(sample_xtf, prefetch=2, max_read=1000, save_index=True))
+    assert os.path.isfile(xtf_index_path(sample_xtf))
+    assert xtf_read_index(sample_xtf) == expected
+
+
+@pytest.mark.parametrize('index', [True, False], ids=['index', 'no_index'])
+def test_prefetch_close(tmp_path, index):
+    # Closing the generator early stops the background thread
+    path = write_sample_xtf(str(tmp_path / 'close.xtf'), save_index=index)
+    n_threads = threading.active_count()
+    gen = xtf_read_gen(path, max_read=1000, prefetch=1)
+    for _ in range(5):
+        next(gen)
+    gen.close()
+    assert threading.active_count() == n_threads
+
+
+def test_prefetch_truncated(sample_xtf, tmp_path):
+    path = str(tmp_path / 'truncated.xtf')
+    with open(sample_xtf, 'rb') as f_src, open(path, 'wb') as f_dst:
+        f_dst.write(f_src.read()[:-10])
+
+    with pytest.raises(RuntimeError):
+        list(xtf_read_gen(path, prefetch=2, max_read=1000))
+
+
+def test_prefetch_stream(sample_xtf):
+    expected = packet_bytes(xtf_read_stream(sample_xtf))
+    with open(sample_xtf, 'rb') as f, PrefetchStream(f, chunk_size=1000, queue_size=2) as stream:
+        assert packet_bytes(xtf_read_stream(stream)) == expected
@@ -0,0 +1,73 @@
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from pyxtf import XTFHeaderType, XTFReader, xtf_read
+
+
+@pytest.mark.parametrize('use_mmap', [False, True])
+def test_reader_matches_xtf_read(sample_xtf, use_mmap):
+    (_, packets) = xtf_read(sample_xtf)
+    with XTFReader(sample_xtf, use_mmap=use_mmap) as reader:
+        for p_headertype, packet_list in packets.items():
+            assert reader.count(p_headertype) == len(packet_list)
+            for i in [0, len(packet_list) // 2, -1]:
+                assert bytes(reader.read(p_headertype, i)) == bytes(packet_list[i])
+
+
+def test_reader_threads(sample_xtf):
+    (_, packets) = xtf_read(sample_xtf)
+    expected = [bytes(p) for p in packets[XTFHeaderType.sonar]]
+
+    with XTFReader(sample_xtf, cache_bytes=64 * 1024, read_ahead=4) as reader:
+        executor = reader._executor
+
+        def scan(start: int):
+            # Each thread scans forwards and backwards from a different packet
+            order = list(range(start, len(expected))) + list(range(len(expected) - 1, -1, -1))
+            for i in order:
+                ping = reader.read(XTFHeaderType.sonar, i)
+                assert bytes(ping) == expected[i]
+                assert np.all(ping.data[0] == np.arange(len(ping.data[0])) + i * 3)
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            for future in [pool.submit(scan, start) for start in range(0, 40, 5)]:
+                future.result()
+
+        # A single read-ahead executor is shared by all threads
+        assert reader._executor is executor
+        assert reader.cache_size <= reader.cache_bytes
+
+    assert reader._executor is None
+    assert not reader._pending
+
+
+def test_reader_waits_for_read_ahead(sample_xtf):
+    # A packet being read ahead is not read again by a foreground read
+    with XTFReader(sample_xtf, cache_bytes=1024 ** 2, read_ahead=8) as reader:
+        reads = []
+        started = threading.Event()
+        read = reader._read
+
+        def slow_read(offset: int):
+            reads.append(offset)
+            if threading.current_thread() is not threading.main_thread():
+                started.set()
+                time.sleep(0.02)
+            return read(offset)
+
+        reader._read = slow_read
+        reader.read(XTFHeaderType.attitude, 0)
+        reader.read(XTFHeaderType.attitude, 1)
+        assert started.wait(5)
+        for i in range(2, 10):
+            reader.read(XTFHeaderType.attitude, i)
+
+        offsets = reader.offsets[XTFHeaderType.attitude]
+        for i in range(10):
+            assert reads.count(int(offsets[i])) == 1
+        assert reader.misses == 2
+        assert reader.hits == 8
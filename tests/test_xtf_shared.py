@@ -0,0 +1,99 @@
+import json
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+from pyxtf import XTFHeaderType, XTFSharedWaterfall, concatenate_pings, xtf_read_gen
+
+pytest.importorskip('multiprocessing.shared_memory')
+
+# The publisher runs in a subprocess, so that the messages of its resource tracker (e.g. segments unregistered twice,
+# or leaked) are captured
+_publisher = '''
+import json, multiprocessing, subprocess, sys
+import numpy as np
+from pyxtf import XTFHeaderType, XTFSharedWaterfall, concatenate_pings, xtf_read_gen
+
+ATTACH = """
+import json, sys
+from pyxtf import XTFSharedWaterfall
+with XTFSharedWaterfall.attach(json.loads(sys.argv[1])) as shared:
+    print(int(shared.waterfall(0).sum()))
+"""
+
+def worker(descriptor):
+    with XTFSharedWaterfall.attach(descriptor) as shared:
+        return int(shared.waterfall(0).sum())
+
+if __name__ == '__main__':
+    gen = xtf_read_gen(sys.argv[1], types=[XTFHeaderType.sonar])
+    file_header = next(gen)
+    pings = concatenate_pings(gen, file_header)
+    expected = int(pings.waterfall(0).sum())
+
+    shared = XTFSharedWaterfall.publish(pings)
+
+    # Child processes share the resource tracker of the publisher
+    with multiprocessing.get_context(sys.argv[2]).Pool(2) as pool:
+        assert pool.map(worker, [shared.descriptor] * 4) == [expected] * 4
+
+    # Independent processes have their own tracker, which must not remove the segments when they exit
+    out = subprocess.run([sys.executable, '-c', ATTACH, json.dumps(shared.descriptor)], capture_output=True,
+                         text=True, check=True)
+    assert int(out.stdout) == expected, out.stderr
+    sys.stderr.write(out.stderr)
+
+    # The segments still exist
+    with XTFSharedWaterfall.attach(json.loads(json.dumps(shared.descriptor))) as attached:
+        assert int(attached.waterfall(0).sum()) == expected
+
+    shared.close()
+    shared.unlink()
+    print('done')
+'''
+
+
+@pytest.mark.parametrize('start_method', ['spawn', 'fork'])
+def test_shared_waterfall_processes(sample_xtf, tmp_path, start_method):
+    import multiprocessing
+    if start_method not in multiprocessing.get_all_start_methods():
+        pytest.skip('{} is not available'.format(start_method))
+
+    script = tmp_path / 'publisher.py'
+    script.write_text(_publisher)
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([os.getcwd()] + sys.path))
+    out = subprocess.run([sys.executable, str(script), sample_xtf, start_method], capture_output=True, text=True,
+                         env=env, timeout=120)
+    assert out.returncode == 0, out.stderr
+    assert out.stdout.strip() == 'done'
+    assert 'Traceback' not in out.stderr
+    assert 'leaked' not in out.stderr
+
+
+def test_shared_waterfall(sample_xtf):
+    gen = xtf_read_gen(sample_xtf, types=[XTFHeaderType.sonar])
+    file_header = next(gen)
+    pings = concatenate_pings(gen, file_header)
+
+    with XTFSharedWaterfall.publish(pings) as shared:
+        attached = XTFSharedWaterfall.attach(json.loads(json.dumps(shared.descriptor)))
+        for c in range(pings.n_channels):
+            np.testing.assert_array_equal(attached.waterfall(c), pings.waterfall(c))
+        np.testing.assert_array_equal(attached['PingNumber'], pings.headers['PingNumber'])
+        assert bytes(attached.file_header) == bytes(file_header)
+
+        with pytest.raises(RuntimeError):
+            attached.unlink()
+
+        # The segments that are not in use are closed, the others when their arrays are released
+        (ping_numbers, waterfall) = (attached['PingNumber'], attached.waterfall(0))
+        segments = list(attached._segments)
+        with pytest.raises(RuntimeError):
+            attached.close()
+        assert attached._segments == [segments[1], segments[3]]
+        del ping_numbers, waterfall
+        attached.close()
+        assert attached._segments == []
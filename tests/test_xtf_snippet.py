@@ -0,0 +1,104 @@
+import ctypes
+
+import numpy as np
+import pytest
+
+from pyxtf import SNP0, SNP1, XTFHeaderType, XTFPingHeader, XTFWriter, concatenate_snippets, xtf_read
+
+from conftest import sample_file_header
+
+
+def snippet_packet(ping_number: int, fragments: list, header_size: int = None) -> XTFPingHeader:
+    """
+    Builds a bathy snippet packet from a list of (beam, gain_start, gain_end, samples).
+    The SNP0 header is followed by 4 spare bytes, to check that the fragments are found through HeaderSize.
+    """
+    snp0 = SNP0()
+    snp0.HeaderSize = ctypes.sizeof(SNP0) + 4
+    snp0.PingNumber = ping_number
+    snp0.BeamCnt = len(fragments)
+    payload = bytes(snp0) + bytes(4)
+
+    for beam, gain_start, gain_end, samples in fragments:
+        snp1 = SNP1()
+        snp1.HeaderSize = ctypes.sizeof(SNP1) if header_size is None else header_size
+        snp1.DataSize = 2 * len(samples)
+        snp1.PingNumber = ping_number
+        snp1.Beam = beam
+        snp1.SnipSamples = len(samples)
+        snp1.GainStart, snp1.GainEnd = gain_start, gain_end
+        snp1.FragOffset = 10 * beam
+        snp1.FragSamples = len(samples)
+        payload += bytes(snp1) + np.asarray(samples, dtype='<u2').tobytes()
+
+    ping = XTFPingHeader()
+    ping.HeaderType = XTFHeaderType.bathy_snippet.value
+    ping.PingNumber = ping_number
+    ping.data = payload
+    return ping
+
+
+def write_snippets(path: str, packets: list) -> list:
+    with XTFWriter(path, sample_file_header()) as writer:
+        for packet in packets:
+            writer.write(packet)
+    (_, packets) = xtf_read(path, types=[XTFHeaderType.bathy_snippet])
+    return packets[XTFHeaderType.bathy_snippet]
+
+
+def test_concatenate_snippets(tmp_path):
+    fragments = [
+        [(0, 1000, 2000, [1, 2, 3, 4, 5]), (1, 0, 0, [6, 7]), (2, 500, 500, [8])],
+        [(5, 100, 300, np.arange(100, 130))]
+    ]
+    pings = write_snippets(str(tmp_path / 'snippets.xtf'), [snippet_packet(i, f) for i, f in enumerate(fragments)])
+    snippets = concatenate_snippets(pings)
+
+    assert len(snippets) == 4
+    np.testing.assert_array_equal(snippets.pings['PingNumber'], [0, 1])
+    np.testing.assert_array_equal(snippets.pings['BeamCnt'], [3, 1])
+    np.testing.assert_array_equal(snippets.ping_offsets, [0, 3, 4])
+    np.testing.assert_array_equal(snippets.offsets, [0, 5, 7, 8, 38])
+    np.testing.assert_array_equal(snippets.beam, [0, 1, 2, 5])
+    np.testing.assert_array_equal(snippets.ping, [0, 0, 0, 1])
+    np.testing.assert_array_equal(snippets.fragments['FragOffset'], [0, 10, 20, 50])
+    np.testing.assert_array_equal(snippets.fragments['PingNumber'], [0, 0, 0, 1])
+
+    expected = [samples for ping_fragments in fragments for (_, _, _, samples) in ping_fragments]
+    for i, samples in enumerate(expected):
+        np.testing.assert_array_equal(snippets.fragment_samples(i), samples)
+    np.testing.assert_array_equal(snippets.samples, np.concatenate(expected))
+
+    # The gain is interpolated from GainStart to GainEnd (0.01 dB) over the samples of each fragment
+    gain = snippets.gain()
+    assert gain.shape == snippets.samples.shape
+    np.testing.assert_allclose(gain[:5], [10, 12.5, 15, 17.5, 20])
+    np.testing.assert_allclose(gain[5:8], [0, 0, 5])
+    np.testing.assert_allclose(gain[8:], np.linspace(1, 3, 30), rtol=1e-6)
+
+
+def test_corrupt_snippets(tmp_path):
+    packets = [
+        snippet_packet(0, [(0, 0, 0, [1, 2, 3])]),
+        snippet_packet(1, [(0, 0, 0, [4, 5])], header_size=60000),  # Header size beyond the end of the packet
+        snippet_packet(2, [(0, 0, 0, [6])], header_size=4),  # Header size smaller than SNP1
+        snippet_packet(3, [(0, 0, 0, [7, 8]), (1, 0, 0, [9])])
+    ]
+    packets[3].data = packets[3].data[:-(ctypes.sizeof(SNP1) + 2)] + bytes(10)  # Second fragment cut short
+    pings = write_snippets(str(tmp_path / 'corrupt.xtf'), packets)
+    pings.append(snippet_packet(4, [(0, 0, 0, [10, 11, 12, 13])]))
+    pings[-1].data = pings[-1].data[:-4]  # Samples cut short, without padding
+    not_snippet = XTFPingHeader()
+    not_snippet.data = bytes(100)
+    pings.append(not_snippet)
+
+    with pytest.warns(UserWarning) as record:
+        snippets = concatenate_snippets(pings)
+    assert len(record) == 4
+
+    # Invalid fragments are dropped, but all pings are kept
+    assert len(snippets.pings) == 6
+    np.testing.assert_array_equal(snippets.pings['PingNumber'], [0, 1, 2, 3, 4, 0])
+    np.testing.assert_array_equal(snippets.ping_offsets, [0, 1, 1, 1, 2, 3, 3])
+    np.testing.assert_array_equal(snippets.offsets, [0, 3, 5, 7])
+    np.testing.assert_array_equal(snippets.samples, [1, 2, 3, 7, 8, 10, 11])
@@ -0,0 +1,157 @@
+from functools import partial
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import os
+import pickle
+import re
+import threading
+
+import numpy as np
+import pytest
+
+from pyxtf import CachedStorage, HTTPStorage, xtf_read, xtf_read_batches, xtf_read_index
+from pyxtf.xtf_io import xtf_index_path
+
+from conftest import write_sample_xtf
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    """
+    Serves the files of a directory, supporting HEAD and single range requests. The requests are recorded.
+    """
+    def __init__(self, *args, directory: str, requests: list, **kwargs):
+        self.directory = directory
+        self.requests = requests
+        super().__init__(*args, **kwargs)
+
+    def log_message(self, *args):
+        pass
+
+    def _data(self):
+        path = os.path.join(self.directory, os.path.basename(self.path))
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return None
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def do_HEAD(self):
+        self.requests.append(('HEAD', self.path, None))
+        data = self._data()
+        if data is not None:
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+
+    def do_GET(self):
+        self.requests.append(('GET', self.path, self.headers.get('Range')))
+        data = self._data()
+        if data is None:
+            return
+
+        match = re.fullmatch(r'bytes=(\d+)-(\d+)', self.headers.get('Range', ''))
+        if match is None:
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            return
+
+        (start, end) = (int(match.group(1)), min(int(match.group(2)), len(data) - 1))
+        if start >= len(data):
+            self.send_error(416)
+            return
+        self.send_response(206)
+        self.send_header('Content-Range', 'bytes {}-{}/{}'.format(start, end, len(data)))
+        self.send_header('Content-Length', str(end - start + 1))
+        self.end_headers()
+        self.wfile.write(data[start:end + 1])
+
+
+@pytest.fixture
+def http_server(tmp_path):
+    requests = []
+    server = ThreadingHTTPServer(('127.0.0.1', 0), partial(RangeHandler, directory=str(tmp_path), requests=requests))
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    try:
+        yield 'http://127.0.0.1:{}/'.format(server.server_address[1]), requests
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+
+def test_http_range_reads(tmp_path, http_server):
+    (url, requests) = http_server
+    path = write_sample_xtf(str(tmp_path / 'remote.xtf'), save_index=True)
+    (_, expected) = xtf_read(path)
+
+    with HTTPStorage(url + 'remote.xtf') as storage:
+        (_, packets) = xtf_read(storage)
+        assert {k: [bytes(p) for p in v] for k, v in packets.items()} == \
+            {k: [bytes(p) for p in v] for k, v in expected.items()}
+        assert storage.n_requests == sum(1 for r in requests if r[1] == '/remote.xtf')
+
+    # The index is loaded from the server, and every read of the file is a range request
+    assert ('GET', '/remote.pyxtf_idx', 'bytes=0-{}'.format(os.path.getsize(xtf_index_path(path)) - 1)) in requests
+    assert all(r[2] is not None for r in requests if r[0] == 'GET')
+
+
+def test_cached_storage(tmp_path, http_server):
+    (url, requests) = http_server
+    path = write_sample_xtf(str(tmp_path / 'cached.xtf'), save_index=True)
+    expected = [t.headers for t in xtf_read_batches(path, batch_size=16)]
+
+    with CachedStorage(HTTPStorage(url + 'cached.xtf'), block_size=4096) as storage:
+        n_blocks = (storage.size() + 4095) // 4096
+
+        # The blocks of the ranges of each batch are fetched together, consecutive blocks with a single request
+        del requests[:]
+        tables = list(xtf_read_batches(storage, batch_size=16, max_gap=0))
+        for table, headers in zip(tables, expected):
+            np.testing.assert_array_equal(table.headers, headers)
+        n_requests = len([r for r in requests if r[1] == '/cached.xtf'])
+        assert storage.misses == n_blocks
+        assert n_requests < n_blocks
+
+        # A second pass is served from the cache
+        del requests[:]
+        hits = storage.hits
+        tables = list(xtf_read_batches(storage, batch_size=16, max_gap=0))
+        assert len(tables) == len(expected)
+        assert not [r for r in requests if r[1] == '/cached.xtf']
+        assert storage.hits > hits
+        assert storage.misses == n_blocks
+
+    # The missing blocks of nearby ranges are fetched with a single request
+    with CachedStorage(HTTPStorage(url + 'cached.xtf'), block_size=4096) as storage:
+        del requests[:]
+        pieces = storage.read_ranges([(100, 10), (5000, 10), (9000, 10)])
+    with open(path, 'rb') as f:
+        data = f.read()
+    assert pieces == [data[100:110], data[5000:5010], data[9000:9010]]
+    assert [r[2] for r in requests if r[0] == 'GET'] == ['bytes=0-12287']
+
+
+class RemoveFile:
+    # Pickles as a call of os.remove, as a malicious index file could
+    def __init__(self, path: str):
+        self.path = path
+
+    def __reduce__(self):
+        return os.remove, (self.path,)
+
+
+def test_index_refuses_code(tmp_path, http_server):
+    (url, _) = http_server
+    path = write_sample_xtf(str(tmp_path / 'unsafe.xtf'))
+    canary = tmp_path / 'canary'
+    canary.write_bytes(b'')
+    with open(xtf_index_path(path), 'wb') as f_idx:
+        pickle.dump({0: [1024], 'x': RemoveFile(str(canary))}, f_idx)
+
+    with pytest.raises(pickle.UnpicklingError):
+        xtf_read_index(path)
+    with pytest.raises(pickle.UnpicklingError):
+        xtf_read_index(HTTPStorage(url + 'unsafe.xtf'))
+    assert canary.exists()
@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+
+from pyxtf import XTFCache, XTFChannelType, XTFFileHeader, XTFHeaderType, XTFPingChanHeader, XTFPingHeader, \
+    XTFSampleFormat, XTFWriter, concatenate_channel, concatenate_pings, xtf_read, xtf_read_gen
+
+
+def read_pings(path: str):
+    gen = xtf_read_gen(path, types=[XTFHeaderType.sonar])
+    file_header = next(gen)
+    return concatenate_pings(gen, file_header)
+
+
+def test_ping_table(sample_xtf):
+    (file_header, packets) = xtf_read(sample_xtf)
+    pings = packets[XTFHeaderType.sonar]
+    table = read_pings(sample_xtf)
+
+    assert len(table) == len(pings)
+    assert table.n_channels == 2
+    assert [table.channel_type(c) for c in range(2)] == [XTFChannelType.port, XTFChannelType.stbd]
+    for ping, table_ping in zip(pings, table):
+        assert bytes(table_ping) == bytes(ping)
+        assert [bytes(c) for c in table_ping.ping_chan_headers] == [bytes(c) for c in ping.ping_chan_headers]
+        for samples, table_samples in zip(ping.data, table_ping.data):
+            np.testing.assert_array_equal(table_samples, samples)
+
+    # The pings are in file order, concatenate_channel returns the latest ping first
+    for c in range(2):
+        np.testing.assert_array_equal(table.waterfall(c), concatenate_channel(pings, file_header, c)[::-1])
+
+
+@pytest.fixture
+def subbottom_xtf(tmp_path) -> str:
+    # A subbottom file, without sonar channels in the file header. The last pings also have a bathymetry channel
+    file_header = XTFFileHeader()
+    for i, chan_type in enumerate([XTFChannelType.subbottom, XTFChannelType.bathy]):
+        file_header.ChanInfo[i].TypeOfChannel = chan_type.value
+        file_header.ChanInfo[i].BytesPerSample = 2
+        file_header.ChanInfo[i].SampleFormat = XTFSampleFormat.word.value
+
+    path = str(tmp_path / 'subbottom.xtf')
+    with XTFWriter(path, file_header) as writer:
+        for i in range(6):
+            ping = XTFPingHeader()
+            ping.Year, ping.Month, ping.Day, ping.Second = 2020, 1, 1, i
+            n_chans = 1 if i < 4 else 2
+            chans = [XTFPingChanHeader() for _ in range(n_chans)]
+            for c, p_chan in enumerate(chans):
+                p_chan.ChannelNumber = c
+            writer.write_sonar([np.full(20 + 2 * i, i + 1, dtype=np.uint16) for _ in range(n_chans)], ping=ping,
+                               ping_chan_headers=chans)
+    return path
+
+
+def test_ping_table_subbottom(subbottom_xtf, tmp_path):
+    table = read_pings(subbottom_xtf)
+    assert table.file_header.sonar_info == []
+    assert len(table) == 6
+    assert table.n_channels == 2
+    assert [table.channel_type(c) for c in range(2)] == [XTFChannelType.subbottom, XTFChannelType.bathy]
+    assert [len(ping.data) for ping in table] == [1, 1, 1, 1, 2, 2]
+
+    # Shorter pings of other channel types than port and starboard are centered
+    waterfall = table.waterfall(0)
+    assert waterfall.shape == (6, 30)
+    for i in range(6):
+        pad = (30 - (20 + 2 * i)) // 2
+        assert np.all(waterfall[i, pad:30 - pad] == i + 1)
+        assert np.all(waterfall[i, :pad] == 0) and np.all(waterfall[i, 30 - pad:] == 0)
+
+    # Pings without the channel are empty rows
+    waterfall = table.waterfall(1)
+    assert waterfall.shape == (6, 30)
+    assert np.all(waterfall[:4] == 0)
+    assert np.all(waterfall[4, 1:29] == 5) and np.all(waterfall[5] == 6)
+
+    cached = XTFCache(str(tmp_path / 'cache')).read_pings(subbottom_xtf)
+    assert cached.n_channels == 2
+    np.testing.assert_array_equal(cached.waterfall(0), table.waterfall(0))
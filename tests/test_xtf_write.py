@@ -0,0 +1,123 @@
+from functools import partial
+import os
+
+import numpy as np
+import pytest
+
+from pyxtf import xtf_write
+from pyxtf import XTFHeaderType, XTFPingChanHeader, XTFPingHeader, XTFWriter, xtf_read, xtf_read_index, xtf_time_fields
+
+import conftest
+from conftest import sample_file_header, write_sample_xtf
+
+
+def test_time_fields():
+    time = np.array(['2020-01-02T03:04:05.670', '2021-12-31T23:59:59.999', '2024-02-29T00:00:00'],
+                    dtype='datetime64[ms]')
+    fields = xtf_time_fields(time)
+    np.testing.assert_array_equal(fields['Year'], [2020, 2021, 2024])
+    np.testing.assert_array_equal(fields['Month'], [1, 12, 2])
+    np.testing.assert_array_equal(fields['Day'], [2, 31, 29])
+    np.testing.assert_array_equal(fields['Hour'], [3, 23, 0])
+    np.testing.assert_array_equal(fields['Minute'], [4, 59, 0])
+    np.testing.assert_array_equal(fields['Second'], [5, 59, 0])
+    np.testing.assert_array_equal(fields['HSeconds'], [67, 99, 0])
+    np.testing.assert_array_equal(fields['JulianDay'], [2, 365, 60])
+
+
+@pytest.mark.parametrize('buffer_size', [1, 4096, 4 * 1024 * 1024])
+def test_write_sonar_arrays(tmp_path, buffer_size):
+    n_pings = 25
+    port = np.arange(n_pings * 100, dtype=np.uint16).reshape(n_pings, 100)
+    stbd = (np.arange(n_pings * 100, dtype=np.uint16) + 7).reshape(n_pings, 100)
+    time = np.datetime64('2020-01-02T03:04:05') + np.arange(n_pings) * np.timedelta64(250, 'ms')
+
+    ping_fields = dict(xtf_time_fields(time), PingNumber=np.arange(n_pings) + 1000, SoundVelocity=750.0)
+    chan_fields = [{'SlantRange': 50.0}, {'SlantRange': np.arange(n_pings, dtype=np.float32)}]
+    template = XTFPingHeader()
+    template.ShipSpeed = 3.5
+
+    path = str(tmp_path / 'arrays.xtf')
+    with XTFWriter(path, sample_file_header(), buffer_size=buffer_size) as writer:
+        writer.write_sonar([port[0], stbd[0]])
+        positions = writer.write_sonar_arrays([port, stbd], ping_fields=ping_fields, chan_fields=chan_fields,
+                                              ping=template)
+        writer.write_sonar([port[-1], stbd[-1]])
+        index = writer.index
+
+    # The positions match the index of the file
+    assert list(positions) == index[XTFHeaderType.sonar][1:-1]
+    assert xtf_read_index(path)[XTFHeaderType.sonar] == index[XTFHeaderType.sonar]
+
+    (_, packets) = xtf_read(path)
+    pings = packets[XTFHeaderType.sonar][1:-1]
+    assert len(pings) == n_pings
+    for i, ping in enumerate(pings):
+        assert ping.PingNumber == 1000 + i
+        assert ping.SoundVelocity == 750.0
+        assert ping.ShipSpeed == 3.5
+        assert ping.NumChansToFollow == 2
+        assert ping.NumBytesThisRecord % 64 == 0
+        assert ping.get_time() == time[i].astype('datetime64[us]').item()
+        assert [c.ChannelNumber for c in ping.ping_chan_headers] == [0, 1]
+        assert [c.NumSamples for c in ping.ping_chan_headers] == [100, 100]
+        assert [c.SlantRange for c in ping.ping_chan_headers] == [50.0, i]
+        np.testing.assert_array_equal(ping.data[0], port[i])
+        np.testing.assert_array_equal(ping.data[1], stbd[i])
+
+    # The packets are the same as those written one at a time
+    one_path = str(tmp_path / 'one.xtf')
+    with XTFWriter(one_path, sample_file_header()) as writer:
+        for i in range(n_pings):
+            ping = XTFPingHeader.from_buffer_copy(bytes(template))
+            for name, values in ping_fields.items():
+                setattr(ping, name, values if np.ndim(values) == 0 else values[i].item())
+            chans = [XTFPingChanHeader() for _ in range(2)]
+            for c, p_chan in enumerate(chans):
+                p_chan.ChannelNumber = c
+                p_chan.SlantRange = chan_fields[c]['SlantRange'] if c == 0 else i
+            writer.write_sonar([port[i], stbd[i]], ping=ping, ping_chan_headers=chans)
+    (_, one_packets) = xtf_read(one_path)
+    assert [bytes(p) for p in one_packets[XTFHeaderType.sonar]] == [bytes(p) for p in pings]
+
+
+def test_write_sonar_arrays_errors(tmp_path):
+    with XTFWriter(str(tmp_path / 'errors.xtf'), sample_file_header()) as writer:
+        with pytest.raises(RuntimeError):
+            writer.write_sonar_arrays([np.zeros(10, dtype=np.uint16)])
+        with pytest.raises(RuntimeError):
+            writer.write_sonar_arrays([np.zeros((2, 10), dtype=np.uint16), np.zeros((3, 10), dtype=np.uint16)])
+        with pytest.raises(RuntimeError):
+            writer.write_sonar_arrays([np.zeros((2, 10), dtype=np.uint16)], chan_fields=[{}, {}])
+
+
+def short_writev(monkeypatch, max_bytes: int) -> list:
+    # Writes at most max_bytes per call, ending partway through a buffer
+    calls = []
+    writev = os.writev
+
+    def wrapper(fd, buffers):
+        calls.append(len(buffers))
+        data = b''.join(bytes(b) for b in buffers)[:max_bytes]
+        return writev(fd, [data])
+
+    monkeypatch.setattr(os, 'writev', wrapper)
+    return calls
+
+
+@pytest.mark.skipif(not hasattr(os, 'writev'), reason='os.writev is not available')
+@pytest.mark.parametrize('max_bytes', [1000, 2 ** 30], ids=['short', 'full'])
+def test_zero_copy(tmp_path, monkeypatch, max_bytes):
+    expected_path = write_sample_xtf(str(tmp_path / 'expected.xtf'))
+
+    # Few buffers per call, so that the buffers are split over several calls as well
+    monkeypatch.setattr(xtf_write, '_iov_max', 7)
+    calls = short_writev(monkeypatch, max_bytes)
+
+    path = str(tmp_path / 'zero_copy.xtf')
+    monkeypatch.setattr(conftest, 'XTFWriter', partial(XTFWriter, zero_copy=True, buffer_size=16 * 1024))
+    write_sample_xtf(path)
+
+    assert calls and max(calls) <= 7
+    with open(path, 'rb') as f, open(expected_path, 'rb') as f_expected:
+        assert f.read() == f_expected.read()
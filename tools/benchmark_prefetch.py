@@ -0,0 +1,86 @@
+"""
+Benchmark of read-ahead (xtf_read_gen with prefetch) against plain reading.
+The latency of each read can be simulated, to show the overlap of I/O and decoding on slow disks or network mounts.
+Usage: python benchmark_prefetch.py [path.xtf] [--latency 5] [--prefetch 4] [--index]
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+import pyxtf
+
+
+class SlowStorage(pyxtf.LocalStorage):
+    """
+    Local storage with an added delay on every read, standing in for a spinning disk or a NAS mount.
+    """
+    def __init__(self, path: str, latency: float, bandwidth: float):
+        super().__init__(path)
+        self.latency = latency
+        self.bandwidth = bandwidth
+
+    def sibling(self, path: str):
+        return SlowStorage(path, self.latency, self.bandwidth)
+
+    def read_range(self, offset: int, size: int) -> bytes:
+        time.sleep(self.latency + size / self.bandwidth)
+        return super().read_range(offset, size)
+
+
+def make_test_file(path: str, n_pings: int = 4000, n_samples: int = 8000):
+    fh = pyxtf.XTFFileHeader()
+    fh.NumberOfSonarChannels = 2
+    for i, chan_type in enumerate((pyxtf.XTFChannelType.port, pyxtf.XTFChannelType.stbd)):
+        fh.ChanInfo[i].TypeOfChannel = chan_type.value
+        fh.ChanInfo[i].BytesPerSample = 2
+
+    data = np.random.default_rng(0).integers(0, 2 ** 16, size=(n_pings, n_samples), dtype=np.uint16)
+    with pyxtf.XTFWriter(path, fh) as writer:
+        writer.write_sonar_arrays([data, data[:, ::-1]], {'PingNumber': np.arange(n_pings)})
+
+
+def time_read(storage: pyxtf.XTFStorage, prefetch: int, max_read: int) -> float:
+    t_start = time.perf_counter()
+    for packet in pyxtf.xtf_read_gen(storage, prefetch=prefetch, max_read=max_read):
+        if isinstance(packet, pyxtf.XTFPingHeader):
+            # Some decoding work per ping
+            [np.log1p(samples.astype(np.float32)).mean() for samples in packet.data]
+    return time.perf_counter() - t_start
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('path', nargs='?', help='XTF file (a synthetic file is generated if not given)')
+    parser.add_argument('--latency', type=float, default=5.0, help='Simulated latency per read [ms]')
+    parser.add_argument('--bandwidth', type=float, default=200.0, help='Simulated bandwidth [MB/s]')
+    parser.add_argument('--prefetch', type=int, default=4, help='Number of reads to run ahead')
+    parser.add_argument('--max-read', type=int, default=4, help='Size of each read [MB]')
+    parser.add_argument('--index', action='store_true', help='Store the index file before reading (indexed reads)')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = args.path
+        if path is None:
+            path = os.path.join(tmp_dir, 'benchmark.xtf')
+            make_test_file(path)
+        if args.index:
+            pyxtf.xtf_read_index(path, save_index=True)
+
+        # Reads are made in blocks of max_read bytes in both cases, the difference is only the overlap
+        max_read = args.max_read * 1024 * 1024
+        storage = pyxtf.CachedStorage(SlowStorage(path, args.latency * 1e-3, args.bandwidth * 1e6),
+                                      block_size=max_read, max_bytes=4 * max_read)
+        size_mb = storage.size() / 1e6
+        has_index = os.path.isfile(pyxtf.xtf_io.xtf_index_path(path))
+
+        print('{} ({:.0f} MB, {}index), latency {} ms, bandwidth {} MB/s'.format(
+            path, size_mb, '' if has_index else 'no ', args.latency, args.bandwidth))
+
+        for prefetch in (0, args.prefetch):
+            storage.close()  # Clears the cache
+            t = time_read(storage, prefetch, max_read)
+            print('prefetch={}: {:.2f} s ({:.0f} MB/s)'.format(prefetch, t, size_mb / t))
@@ -35,6 +35,21 @@ class XTFBase(ctypes.LittleEndianStructure):
     def __init__(self, buffer=None, *args, **kwargs):
         pass
 
+    def __reduce_ex__(self, protocol: int) -> tuple:
+        pass
+
+    @classmethod
+    def create_from_buffer(cls, buffer: IOBase, file_header=None):
+        pass
+
+    @classmethod
+    def view_from_buffer(cls, buffer: IOBase, file_header=None):
+        pass
+
+    @classmethod
+    def np_dtype(cls, byte_order: str = '<') -> np.dtype:
+        pass
+
 """
 
 
@@ -49,6 +64,21 @@ def ctype_struct_generator(module):
                 yield obj
 
 
+def function_generator(module):
+    # Public functions defined in the module (not imported), in the order they appear
+    functions = inspect.getmembers(module, predicate=(
+        lambda x: inspect.isfunction(x) and x.__module__ == module.__name__ and not x.__name__.startswith('_')))
+    functions.sort(key=lambda x: inspect.getsourcelines(x[1])[1])
+    for name, obj in functions:
+        yield obj
+
+
+def signature_str(fun, module) -> str:
+    # Annotations are written relative to the imports of the pyi file
+    return str(inspect.signature(fun)).replace(module.__name__ + '.', '').replace('numpy.', 'np.') \
+        .replace('NoneType', 'None')
+
+
 def get_all_fields(obj):
     cur_obj = obj
     fields = []
@@ -77,13 +107,18 @@ def generate_pyi(module):
             'import numpy as np\n',
             #'import {}\n'.format(module.__package__),
             'from io import IOBase, BytesIO\n'
-            'from typing import List, Tuple, Dict, Callable, Any\n\n\n'
+            'from typing import List, Tuple, Dict, Callable, Any, Generator, Iterable\n\n\n'
         ])
 
         # Write CField and XTFBase classes
         f.write(XTF_CField)
         f.write(XTF_Base)
 
+        # Write module level functions
+        for fun in function_generator(module):
+            f.write('\ndef {}{}:\n'.format(fun.__name__, signature_str(fun, module)) + ' '*4 + 'pass\n\n')
+        f.write('\n')
+
         for struct in c_structs:
             base_names = [type.__name__ for type in struct.__bases__]
             f.write('class {}({}):\n'.format(struct.__name__, ','.join(base_names)))
@@ -125,7 +160,7 @@ def generate_pyi(module):
 
             for name, fun in inspect.getmembers(struct, predicate=inspect.isfunction):
                 if not (name.startswith('__') or name.endswith('__')):
-                    f.write(' '*4 + 'def {}{}:\n'.format(name, inspect.signature(fun)) + ' '*8 + 'pass\n')
+                    f.write(' '*4 + 'def {}{}:\n'.format(name, signature_str(fun, module)) + ' '*8 + 'pass\n')
 
             f.write('\n\n')
 